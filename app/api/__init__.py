@@ -1,9 +1,26 @@
+import os
+
 from fastapi import APIRouter
-from app.api.endpoints import clients, visits, cars, face_recognition, analytics
+from app.api.endpoints import clients, visits, cars, face_recognition, analytics, profiling
+
+# Deployment role of this process:
+#   all          - every router (default)
+#   api          - CRUD and analytics; never loads the ML libraries or the gallery
+#   recognition  - only the face endpoints
+APP_ROLES = ("all", "api", "recognition")
+APP_ROLE = os.getenv("APP_ROLE", "all")
+if APP_ROLE not in APP_ROLES:
+    raise ValueError(f"APP_ROLE must be one of {', '.join(APP_ROLES)}, got {APP_ROLE!r}")
+
+SERVES_API = APP_ROLE in ("all", "api")
+SERVES_RECOGNITION = APP_ROLE in ("all", "recognition")
 
 api_router = APIRouter()
-api_router.include_router(clients.router, prefix="/clients", tags=["clients"])
-api_router.include_router(visits.router, prefix="/visits", tags=["visits"])
-api_router.include_router(cars.router, prefix="/cars", tags=["cars"])
-api_router.include_router(face_recognition.router, prefix="/face", tags=["face_recognition"])
-api_router.include_router(analytics.router, prefix="/analytics", tags=["analytics"]) 
\ No newline at end of file
+if SERVES_API:
+    api_router.include_router(clients.router, prefix="/clients", tags=["clients"])
+    api_router.include_router(visits.router, prefix="/visits", tags=["visits"])
+    api_router.include_router(cars.router, prefix="/cars", tags=["cars"])
+    api_router.include_router(analytics.router, prefix="/analytics", tags=["analytics"])
+if SERVES_RECOGNITION:
+    api_router.include_router(face_recognition.router, prefix="/face", tags=["face_recognition"])
+api_router.include_router(profiling.router, prefix="/admin/profiling", tags=["admin"])
@@ -0,0 +1,44 @@
+import hashlib
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+from app.db.versions import table_versions
+from app.services.metrics.registry import metrics
+
+# Catalog data is shared by everyone; visits are not
+CATALOG_CACHE_CONTROL = "public, no-cache"
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+conditional_requests_total = metrics.counter(
+    "conditional_requests_total", "Requests with If-None-Match, by outcome", ["result"]
+)
+
+
+def make_etag(request: Request, *tables: str, extra: str = "") -> str:
+    """
+    Build a strong ETag from the request URL and the versions of the tables
+    the response is read from. Computing it never touches the database.
+    """
+    raw = f"{request.url.path}?{request.url.query}|{table_versions.token(tables)}|{extra}"
+    return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
+
+
+def cache_headers(etag: str, cache_control: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def not_modified_response(request: Request, etag: str, cache_control: str) -> Optional[Response]:
+    """
+    Return a 304 response if the request's If-None-Match matches etag.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if etag in candidates or "*" in candidates:
+        conditional_requests_total.inc(result="not_modified")
+        return Response(status_code=304, headers=cache_headers(etag, cache_control))
+    conditional_requests_total.inc(result="modified")
+    return None
@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func, extract, desc
-from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Any, Optional
 import json
 
 from app.db.base import get_db
 from app.models.models import Visit, Client, Car
+from app.services.visits.dwell import RELATIVE_ACCURACY, dwell_stats
 
 router = APIRouter()
 
@@ -102,6 +103,38 @@ def get_visits_by_age(
     return {"data": age_data, "days": days}
 
 
+@router.get("/dwell-time")
+def get_dwell_time(
+    days: int = 30,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    group_by: str = Query("day", pattern=r"^(day|purpose|age)(,(day|purpose|age))*$"),
+    purpose: Optional[str] = None,
+    age: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Get visit dwell time (exit - entry) statistics: count, mean and
+    p50/p90/p99 in seconds, grouped by entry day, purpose and/or age range.
+    Quantiles come from the dwell sketches, within 1% of the exact value.
+    """
+    end_date = end_date or datetime.utcnow().date()
+    start_date = start_date or end_date - timedelta(days=days - 1)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date is after end_date")
+    
+    group_names = list(dict.fromkeys(group_by.split(",")))
+    data = dwell_stats(db, start_date, end_date, group_names, purpose=purpose, age=age)
+    
+    return {
+        "data": data,
+        "start_date": start_date,
+        "end_date": end_date,
+        "group_by": group_names,
+        "relative_accuracy": RELATIVE_ACCURACY
+    }
+
+
 @router.get("/cars/most-recommended")
 def get_most_recommended_cars(
     days: int = 30,
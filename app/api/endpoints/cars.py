@@ -1,35 +1,147 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
-from typing import Any, List
+from typing import Any, List, Optional
 import json
 
-from app.db.base import get_db
+from app.api.caching import CATALOG_CACHE_CONTROL, cache_headers, make_etag, not_modified_response
+from app.api.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, count_cache, decode_offset_cursor, encode_offset_cursor, keyset_paginate
+)
+from app.api.serialization import FAST_JSON_RESPONSES, FastJSONResponse, car_projection
+from app.db.base import SessionLocal, get_db
 from app.models.models import Car
 from app.schemas.car import CarCreate, CarUpdate, Car as CarSchema
+from app.schemas.pagination import PaginatedResponse
+from app.services.catalog.search import SORT_FIELDS, car_search_index
 
 router = APIRouter()
 
 
-@router.get("/", response_model=List[CarSchema])
+def prime_catalog() -> int:
+    """
+    Read the whole catalog once at startup (warm-up step): fills the SQLite
+    page cache the recommendation engine reads on every visit, the cached
+    total of the car listing and the search index.
+    """
+    db = SessionLocal()
+    try:
+        cars = db.query(Car).all()
+        count_cache.get(("cars",), lambda: len(cars))
+    finally:
+        db.close()
+    car_search_index.current()
+    return len(cars)
+
+
+@router.get("/", response_model=PaginatedResponse[CarSchema])
 def read_cars(
-    skip: int = 0,
-    limit: int = 100,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = True,
     db: Session = Depends(get_db)
 ) -> Any:
     """
-    Retrieve cars.
+    Retrieve cars, paginated by id.
     """
-    cars = db.query(Car).offset(skip).limit(limit).all()
+    etag = make_etag(request, "cars")
+    not_modified = not_modified_response(request, etag, CATALOG_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    headers = cache_headers(etag, CATALOG_CACHE_CONTROL)
+    
+    query = db.query(*car_projection.columns) if FAST_JSON_RESPONSES else db.query(Car)
+    page = keyset_paginate(
+        query,
+        Car.id,
+        count_key=("cars",),
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total
+    )
+    
+    if FAST_JSON_RESPONSES:
+        page["items"] = car_projection.to_dicts(page["items"])
+        return FastJSONResponse(page, headers=headers)
+    response.headers.update(headers)
     
     # Convert features from JSON string to dict for each car
-    for car in cars:
+    for car in page["items"]:
         if car.features:
             try:
                 car.features = json.loads(car.features)
             except:
                 car.features = {}
     
-    return cars
+    return page
+
+
+@router.get("/search", response_model=PaginatedResponse[CarSchema])
+def search_cars(
+    request: Request,
+    response: Response,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    brand: List[str] = Query([]),
+    category: List[str] = Query([]),
+    feature: List[str] = Query([], description="Boolean feature flags that must all be set, e.g. safety"),
+    sort: str = Query("id", pattern="^-?(" + "|".join(SORT_FIELDS) + ")$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+) -> Any:
+    """
+    Search the catalog by price and year range, brands, categories and
+    feature flags. Filtering and sorting run on the in-memory search index;
+    only the returned page is read from the database.
+    """
+    etag = make_etag(request, "cars")
+    not_modified = not_modified_response(request, etag, CATALOG_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    headers = cache_headers(etag, CATALOG_CACHE_CONTROL)
+
+    matches = car_search_index.current().search(
+        min_price=min_price,
+        max_price=max_price,
+        min_year=min_year,
+        max_year=max_year,
+        brands=brand,
+        categories=category,
+        features=feature,
+        sort=sort
+    )
+    offset = decode_offset_cursor(cursor) if cursor else 0
+    page_ids = matches[offset:offset + limit].tolist()
+    next_offset = offset + len(page_ids)
+
+    query = db.query(*car_projection.columns) if FAST_JSON_RESPONSES else db.query(Car)
+    rows = {row.id: row for row in query.filter(Car.id.in_(page_ids))} if page_ids else {}
+    # A car deleted since the index was built is skipped
+    items = [rows[car_id] for car_id in page_ids if car_id in rows]
+    page = {
+        "items": items,
+        "total": len(matches),
+        "page_size": limit,
+        "next_cursor": encode_offset_cursor(next_offset) if next_offset < len(matches) else None
+    }
+
+    if FAST_JSON_RESPONSES:
+        page["items"] = car_projection.to_dicts(items)
+        return FastJSONResponse(page, headers=headers)
+    response.headers.update(headers)
+
+    for car in items:
+        if car.features:
+            try:
+                car.features = json.loads(car.features)
+            except:
+                car.features = {}
+
+    return page
 
 
 @router.post("/", response_model=CarSchema)
@@ -58,6 +170,7 @@ def create_car(
     db.add(car)
     db.commit()
     db.refresh(car)
+    count_cache.invalidate("cars")
     
     # Convert features from JSON string to dict for response
     if car.features:
@@ -73,17 +186,25 @@ def create_car(
 def read_car(
     *,
     db: Session = Depends(get_db),
-    car_id: int
+    car_id: int,
+    request: Request,
+    response: Response
 ) -> Any:
     """
     Get car by ID.
     """
+    etag = make_etag(request, "cars")
+    not_modified = not_modified_response(request, etag, CATALOG_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    
     car = db.query(Car).filter(Car.id == car_id).first()
     if not car:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Car not found"
         )
+    response.headers.update(cache_headers(etag, CATALOG_CACHE_CONTROL))
     
     # Convert features from JSON string to dict
     if car.features:
@@ -160,4 +281,5 @@ def delete_car(
     
     db.delete(car)
     db.commit()
+    count_cache.invalidate("cars")
     return car
\ No newline at end of file
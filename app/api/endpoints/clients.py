@@ -1,25 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from typing import Any, List, Optional
 
+from app.api.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, count_cache, decode_offset_cursor, encode_offset_cursor, keyset_paginate
+)
+from app.api.serialization import FAST_JSON_RESPONSES, FastJSONResponse, client_projection
 from app.db.base import get_db
+from app.db.client_search import count_matches, search_client_ids, search_terms
 from app.models.models import Client
-from app.schemas.client import ClientCreate, ClientUpdate, Client as ClientSchema
+from app.schemas.client import ClientCreate, ClientMerge, ClientUpdate, Client as ClientSchema
+from app.schemas.pagination import PaginatedResponse
+from app.services.face_recognition.duplicates import merge_clients
+from app.services.face_recognition.gallery import face_gallery
+from app.services.visits.dwell import forget_dwell, reassign_dwell_age
 
 router = APIRouter()
 
 
-@router.get("/", response_model=List[ClientSchema])
+@router.get("/", response_model=PaginatedResponse[ClientSchema])
 def read_clients(
-    skip: int = 0, 
-    limit: int = 100, 
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = True,
     db: Session = Depends(get_db)
 ) -> Any:
     """
-    Retrieve clients.
+    Retrieve clients, paginated by id.
     """
-    clients = db.query(Client).offset(skip).limit(limit).all()
-    return clients
+    query = db.query(*client_projection.columns) if FAST_JSON_RESPONSES else db.query(Client)
+    page = keyset_paginate(
+        query,
+        Client.id,
+        count_key=("clients",),
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total
+    )
+    
+    if FAST_JSON_RESPONSES:
+        page["items"] = client_projection.to_dicts(page["items"])
+        return FastJSONResponse(page)
+    return page
 
 
 @router.post("/", response_model=ClientSchema)
@@ -62,9 +84,45 @@ def create_client(client: ClientCreate, db: Session = Depends(get_db)):
     db.add(db_client)
     db.commit()
     db.refresh(db_client)
+    count_cache.invalidate("clients")
     return db_client
 
 
+@router.get("/search", response_model=PaginatedResponse[ClientSchema])
+def search_clients(
+    q: str = Query(..., min_length=1, description="Prefixes of name, phone, workplace or interest words"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = True,
+    db: Session = Depends(get_db)
+) -> Any:
+    """
+    Full-text client search: every word of q must prefix-match a word of
+    the client's name, phone, workplace or interests. Best matches first.
+    """
+    terms = search_terms(q)
+    offset = decode_offset_cursor(cursor) if cursor else 0
+
+    # One extra id tells whether there is a next page
+    ids = search_client_ids(db, terms, offset, limit + 1) if terms else []
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+
+    query = db.query(*client_projection.columns) if FAST_JSON_RESPONSES else db.query(Client)
+    rows = {row.id: row for row in query.filter(Client.id.in_(ids))} if ids else {}
+    page = {
+        "items": [rows[client_id] for client_id in ids if client_id in rows],
+        "total": (count_matches(db, terms) if terms else 0) if include_total else None,
+        "page_size": limit,
+        "next_cursor": encode_offset_cursor(offset + len(ids)) if has_more else None
+    }
+
+    if FAST_JSON_RESPONSES:
+        page["items"] = client_projection.to_dicts(page["items"])
+        return FastJSONResponse(page)
+    return page
+
+
 @router.get("/{client_id}", response_model=ClientSchema)
 def read_client(
     *,
@@ -115,12 +173,19 @@ def update_client(
     if "has_credit" in update_data and update_data["has_credit"] and not update_data["has_credit"].strip():
         update_data["has_credit"] = None
     
+    old_age = client.age
     for field, value in update_data.items():
         setattr(client, field, value)
     
+    # Dwell sketches are kept per age bucket
+    reassign_dwell_age(db, client.id, old_age, client.age)
     db.add(client)
     db.commit()
     db.refresh(client)
+    
+    # Recognition results read the name from the gallery snapshot
+    if "first_name" in update_data or "last_name" in update_data:
+        face_gallery.rename_client(client.id, f"{client.first_name} {client.last_name}")
     return client
 
 
@@ -140,6 +205,35 @@ def delete_client(
             detail="Client not found"
         )
     
+    # Mijoz bilan birga uning tashriflari ham o'chiriladi (cascade)
+    forget_dwell(db, client.visits, client.age)
     db.delete(client)
     db.commit()
-    return client 
\ No newline at end of file
+    count_cache.invalidate("clients")
+    count_cache.invalidate("visits")
+    # O'chirilgan mijozning yuz kodlari galereyadan ham olib tashlanadi
+    face_gallery.remove_clients([client_id])
+    return client 
+
+
+@router.post("/{client_id}/merge", response_model=ClientSchema)
+def merge_client(
+    *,
+    db: Session = Depends(get_db),
+    client_id: int,
+    merge_in: ClientMerge
+) -> Any:
+    """
+    Merge a duplicate identity into this client: its face encodings and
+    visits move here, then the duplicate is deleted.
+    """
+    try:
+        client = merge_clients(db, client_id, merge_in.duplicate_id)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    count_cache.invalidate("clients")
+    count_cache.invalidate("visits")
+    return client
@@ -1,35 +1,49 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import os
 import uuid
-import cv2
 import numpy as np
-from datetime import datetime
-import json
 from typing import List, Dict, Any
-import face_recognition
 
-from app.db.base import get_db
-from app.models.models import Client, FaceEncoding, Visit
+from app.db.base import get_async_db, get_db
+from app.models.models import Client, FaceEncoding
 from app.schemas.face import FaceDetectionResult
-from app.services.face_recognition.recognition import FaceRecognitionService
-from app.services.recommendation.engine import RecommendationEngine
+from app.services.face_recognition.pruning import prune_client_encodings
+from app.services.face_recognition.quality import FaceSkippedError, face_gate
+from app.services.face_recognition.recognition import face_service, load_cv2
+from app.services.recommendation.engine import recommendation_engine
+from app.services.metrics.registry import metrics, recognition_stage_seconds
+from app.services.visits.recording import log_entry_visit, log_exit_visit, log_visit
 
 router = APIRouter()
-face_service = FaceRecognitionService()
-recommendation_engine = RecommendationEngine()
 
 # Directory to save face images
 FACE_UPLOAD_DIR = "public/faces"
 os.makedirs(FACE_UPLOAD_DIR, exist_ok=True)
 
+face_detections_total = metrics.counter(
+    "face_detections_total", "Detect endpoint outcomes per face", ["endpoint", "result"]
+)
+face_gate_skipped_total = metrics.counter(
+    "face_gate_skipped_total", "Detected faces not encoded by the quality gate", ["endpoint", "reason"]
+)
+
+# Pre-encode quality gate per endpoint (FACE_GATE_<ENDPOINT>_MIN_SIZE / _MIN_SHARPNESS)
+FACE_GATES = {endpoint: face_gate(endpoint) for endpoint in ("detect", "detect-multiple", "detect-entry", "detect-exit")}
+
+
+def record_skipped_faces(endpoint: str, skipped) -> None:
+    for face in skipped:
+        face_gate_skipped_total.inc(endpoint=endpoint, reason=face.reason)
+
 
 @router.post("/detect", response_model=FaceDetectionResult)
 async def detect_face(
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    file: UploadFile = File(...)
 ):
     """
     Detect face in an uploaded image and look for matches in the database.
@@ -38,8 +52,7 @@ async def detect_face(
     try:
         # Read image from request
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image = await run_in_threadpool(decode_image, contents)
         
         if image is None:
             raise HTTPException(
@@ -49,8 +62,19 @@ async def detect_face(
         
         # Extract face encoding
         try:
-            face_encoding, face_location = face_service.encode_face_from_frame(image)
+            face_encoding, face_location = await run_in_threadpool(
+                face_service.encode_face_from_frame, image, FACE_GATES["detect"]
+            )
+        except FaceSkippedError as e:
+            record_skipped_faces("detect", e.skipped)
+            face_detections_total.inc(endpoint="detect", result="skipped")
+            return FaceDetectionResult(
+                is_recognized=False,
+                face_location=None,
+                skipped_faces=[face.as_dict() for face in e.skipped]
+            )
         except ValueError:
+            face_detections_total.inc(endpoint="detect", result="no_face")
             return FaceDetectionResult(
                 is_recognized=False,
                 client_id=None,
@@ -58,21 +82,21 @@ async def detect_face(
                 face_location=None
             )
         
-        # Find matching client
-        client, confidence = face_service.find_matching_client(face_encoding, db)
+        # Find matching client (snapshot only, no database query)
+        client_id, client_name, confidence = await face_service.identify_face_async(face_encoding)
         
-        if client:
+        face_detections_total.inc(endpoint="detect", result="recognized" if client_id is not None else "unknown")
+        if client_id is not None:
             # Log a visit in the background
             background_tasks.add_task(
                 log_visit,
-                client_id=client.id,
-                db=db
+                client_id=client_id
             )
             
             return FaceDetectionResult(
                 is_recognized=True,
-                client_id=client.id,
-                client_name=f"{client.first_name} {client.last_name}",
+                client_id=client_id,
+                client_name=client_name,
                 confidence=confidence,
                 face_location=list(face_location)
             )
@@ -96,13 +120,15 @@ async def detect_face(
 async def register_face(
     client_id: int = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Register a face for an existing client.
+    Register a face for an existing client. The image quality is recorded
+    and the client's encodings are pruned to the gallery policy, which may
+    drop the new one when the client already has better ones.
     """
     # Check if client exists
-    client = db.query(Client).filter(Client.id == client_id).first()
+    client = await db.get(Client, client_id)
     if not client:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -120,7 +146,7 @@ async def register_face(
         
         # Extract face encoding
         try:
-            face_encoding = face_service.encode_face_from_image(file_path)
+            face_encoding, quality = await run_in_threadpool(face_service.encode_face_with_quality, file_path)
         except ValueError:
             # Clean up file if no face found
             os.remove(file_path)
@@ -130,14 +156,28 @@ async def register_face(
             )
         
         # Save face encoding to database
-        face_encoding_obj = face_service.save_face_encoding(
-            client_id=client_id,
-            face_encoding=face_encoding,
-            image_path=file_path,
-            db=db
+        face_encoding_obj = await db.run_sync(
+            lambda session: face_service.save_face_encoding(
+                client_id=client_id,
+                face_encoding=face_encoding,
+                image_path=file_path,
+                db=session,
+                quality=quality
+            )
         )
+        dropped = await db.run_sync(lambda session: prune_client_encodings(session, [client_id]))
         
-        return {"success": True, "message": "Face registered successfully"}
+        # Publish the new encoding to the shared gallery of all workers
+        await run_in_threadpool(face_service.gallery.sync)
+        
+        kept = face_encoding_obj.id not in dropped
+        return {
+            "success": True,
+            "message": "Face registered successfully" if kept else "Client already has better face images",
+            "kept": kept,
+            "quality": quality.as_dict(),
+            "pruned_encodings": len(dropped)
+        }
         
     except Exception as e:
         raise HTTPException(
@@ -184,42 +224,20 @@ def get_recommendations(
     return result
 
 
-def log_visit(client_id: int, db: Session):
+def decode_image(contents: bytes):
     """
-    Log a visit for a client (used as a background task).
+    Decode uploaded image bytes into an OpenCV BGR frame (None if invalid).
     """
-    visit = Visit(
-        client_id=client_id,
-        entry_time=datetime.utcnow(),
-        purpose="Auto detected by face recognition"
-    )
-    
-    db.add(visit)
-    db.commit()
-    
-    # Get recommendations and save them to the visit
-    client = db.query(Client).filter(Client.id == client_id).first()
-    if client:
-        recommendations = recommendation_engine.get_recommendations(client, db)
-        recommendations_data = []
-        
-        for car, score in recommendations:
-            recommendations_data.append({
-                "car_id": car.id,
-                "name": f"{car.brand} {car.model}",
-                "interest_score": score
-            })
-        
-        visit.recommendations = json.dumps(recommendations_data)
-        db.add(visit)
-        db.commit()
+    cv2 = load_cv2()
+    with recognition_stage_seconds.time(stage="decode"):
+        nparr = np.frombuffer(contents, np.uint8)
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
 
 @router.post("/detect-multiple")
 async def detect_multiple_faces(
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    file: UploadFile = File(...)
 ):
     """
     Detect multiple faces in an uploaded image and look for matches in the database.
@@ -227,8 +245,7 @@ async def detect_multiple_faces(
     try:
         # Read image from request
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image = await run_in_threadpool(decode_image, contents)
         
         if image is None:
             raise HTTPException(
@@ -237,33 +254,34 @@ async def detect_multiple_faces(
             )
         
         # Extract all face encodings
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_image)
+        faces, skipped = await run_in_threadpool(
+            face_service.encode_gated_faces_from_frame, image, FACE_GATES["detect-multiple"]
+        )
+        record_skipped_faces("detect-multiple", skipped)
+        if not faces:
+            face_detections_total.inc(
+                endpoint="detect-multiple", result="skipped" if skipped else "no_face"
+            )
         results = []
         
-        for face_location in face_locations:
+        for face_encoding, face_location in faces:
             try:
-                # Get face encoding
-                face_encodings = face_recognition.face_encodings(rgb_image, [face_location])
-                if len(face_encodings) == 0:
-                    continue
-                    
-                face_encoding = face_encodings[0]
-                
                 # Find matching client
-                client, confidence = face_service.find_matching_client(face_encoding, db)
+                client_id, _, confidence = await face_service.identify_face_async(face_encoding)
+                face_detections_total.inc(
+                    endpoint="detect-multiple", result="recognized" if client_id is not None else "unknown"
+                )
                 
-                if client:
+                if client_id is not None:
                     # Log a visit in the background
                     background_tasks.add_task(
                         log_visit,
-                        client_id=client.id,
-                        db=db
+                        client_id=client_id
                     )
                     
                     results.append({
                         "is_recognized": True,
-                        "client_id": client.id,
+                        "client_id": client_id,
                         "confidence": confidence,
                         "face_location": list(face_location)
                     })
@@ -278,7 +296,7 @@ async def detect_multiple_faces(
                 # Skip faces that can't be encoded
                 continue
         
-        return {"faces": results}
+        return {"faces": results, "skipped_faces": [face.as_dict() for face in skipped]}
             
     except Exception as e:
         raise HTTPException(
@@ -290,8 +308,7 @@ async def detect_multiple_faces(
 @router.post("/detect-entry")
 async def detect_entry_face(
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    file: UploadFile = File(...)
 ):
     """
     Kirish kamerasi uchun yuzni aniqlash va tashrif yaratish
@@ -299,8 +316,7 @@ async def detect_entry_face(
     try:
         # Read image from request
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image = await run_in_threadpool(decode_image, contents)
         
         if image is None:
             raise HTTPException(
@@ -310,8 +326,19 @@ async def detect_entry_face(
         
         # Extract face encoding
         try:
-            face_encoding, face_location = face_service.encode_face_from_frame(image)
+            face_encoding, face_location = await run_in_threadpool(
+                face_service.encode_face_from_frame, image, FACE_GATES["detect-entry"]
+            )
+        except FaceSkippedError as e:
+            record_skipped_faces("detect-entry", e.skipped)
+            face_detections_total.inc(endpoint="detect-entry", result="skipped")
+            return FaceDetectionResult(
+                is_recognized=False,
+                face_location=None,
+                skipped_faces=[face.as_dict() for face in e.skipped]
+            )
         except ValueError:
+            face_detections_total.inc(endpoint="detect-entry", result="no_face")
             return FaceDetectionResult(
                 is_recognized=False,
                 client_id=None,
@@ -319,21 +346,21 @@ async def detect_entry_face(
                 face_location=None
             )
         
-        # Find matching client
-        client, confidence = face_service.find_matching_client(face_encoding, db)
+        # Find matching client (snapshot only, no database query)
+        client_id, client_name, confidence = await face_service.identify_face_async(face_encoding)
         
-        if client:
+        face_detections_total.inc(endpoint="detect-entry", result="recognized" if client_id is not None else "unknown")
+        if client_id is not None:
             # Log a visit in the background
             background_tasks.add_task(
                 log_entry_visit,
-                client_id=client.id,
-                db=db
+                client_id=client_id
             )
             
             return FaceDetectionResult(
                 is_recognized=True,
-                client_id=client.id,
-                client_name=f"{client.first_name} {client.last_name}",
+                client_id=client_id,
+                client_name=client_name,
                 confidence=confidence,
                 face_location=list(face_location)
             )
@@ -356,8 +383,7 @@ async def detect_entry_face(
 @router.post("/detect-exit")
 async def detect_exit_face(
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    file: UploadFile = File(...)
 ):
     """
     Chiqish kamerasi uchun yuzni aniqlash va tashrifni yakunlash
@@ -365,8 +391,7 @@ async def detect_exit_face(
     try:
         # Read image from request
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image = await run_in_threadpool(decode_image, contents)
         
         if image is None:
             raise HTTPException(
@@ -376,8 +401,19 @@ async def detect_exit_face(
         
         # Extract face encoding
         try:
-            face_encoding, face_location = face_service.encode_face_from_frame(image)
+            face_encoding, face_location = await run_in_threadpool(
+                face_service.encode_face_from_frame, image, FACE_GATES["detect-exit"]
+            )
+        except FaceSkippedError as e:
+            record_skipped_faces("detect-exit", e.skipped)
+            face_detections_total.inc(endpoint="detect-exit", result="skipped")
+            return FaceDetectionResult(
+                is_recognized=False,
+                face_location=None,
+                skipped_faces=[face.as_dict() for face in e.skipped]
+            )
         except ValueError:
+            face_detections_total.inc(endpoint="detect-exit", result="no_face")
             return FaceDetectionResult(
                 is_recognized=False,
                 client_id=None,
@@ -385,21 +421,21 @@ async def detect_exit_face(
                 face_location=None
             )
         
-        # Find matching client
-        client, confidence = face_service.find_matching_client(face_encoding, db)
+        # Find matching client (snapshot only, no database query)
+        client_id, client_name, confidence = await face_service.identify_face_async(face_encoding)
         
-        if client:
+        face_detections_total.inc(endpoint="detect-exit", result="recognized" if client_id is not None else "unknown")
+        if client_id is not None:
             # Checkout visit in the background
             background_tasks.add_task(
                 log_exit_visit,
-                client_id=client.id,
-                db=db
+                client_id=client_id
             )
             
             return FaceDetectionResult(
                 is_recognized=True,
-                client_id=client.id,
-                client_name=f"{client.first_name} {client.last_name}",
+                client_id=client_id,
+                client_name=client_name,
                 confidence=confidence,
                 face_location=list(face_location)
             )
@@ -417,60 +453,3 @@ async def detect_exit_face(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing image: {str(e)}"
         )
-
-
-def log_entry_visit(client_id: int, db: Session):
-    """
-    Mijoz kirish tashrifini ro'yxatga olish
-    """
-    # Avval tugallanmagan tashrif bor-yo'qligini tekshirish
-    active_visit = db.query(Visit).filter(
-        Visit.client_id == client_id,
-        Visit.exit_time.is_(None)
-    ).first()
-    
-    # Agar faol tashrif bo'lsa, yangi tashrif yaratmaymiz
-    if active_visit:
-        return
-    
-    visit = Visit(
-        client_id=client_id,
-        entry_time=datetime.utcnow(),
-        purpose="Auto detected by face recognition (Entry)"
-    )
-    
-    db.add(visit)
-    db.commit()
-    
-    # Get recommendations and save them to the visit
-    client = db.query(Client).filter(Client.id == client_id).first()
-    if client:
-        recommendations = recommendation_engine.get_recommendations(client, db)
-        recommendations_data = []
-        
-        for car, score in recommendations:
-            recommendations_data.append({
-                "car_id": car.id,
-                "name": f"{car.brand} {car.model}",
-                "interest_score": score
-            })
-        
-        visit.recommendations = json.dumps(recommendations_data)
-        db.add(visit)
-        db.commit()
-
-def log_exit_visit(client_id: int, db: Session):
-    """
-    Mijoz chiqish tashrifini ro'yxatga olish (exit_time ni qo'shish)
-    """
-    # Mijozning eng so'nggi tugallanmagan tashrifini topish
-    active_visit = db.query(Visit).filter(
-        Visit.client_id == client_id,
-        Visit.exit_time.is_(None)
-    ).order_by(Visit.entry_time.desc()).first()
-    
-    # Agar faol tashrif bo'lsa, uni yakunlaymiz
-    if active_visit:
-        active_visit.exit_time = datetime.utcnow()
-        db.add(active_visit)
-        db.commit() 
\ No newline at end of file
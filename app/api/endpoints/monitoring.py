@@ -0,0 +1,80 @@
+from anyio import to_thread
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.api import APP_ROLE, SERVES_RECOGNITION
+from app.db.changes import change_feed
+from app.services.events.broker import visit_events
+from app.services.face_recognition.gallery import face_gallery
+from app.services.metrics.registry import metrics
+from app.services.startup.warmup import startup_warmup
+
+router = APIRouter()
+
+# Starlette appends "; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _gallery_value(attribute):
+    def read():
+        snapshot = face_gallery.loaded_snapshot
+        if snapshot is None:
+            return None
+        return len(snapshot) if attribute == "encodings" else getattr(snapshot, attribute)
+    return read
+
+
+def _threadpool_busy():
+    # Evaluated inside the /metrics request, so the anyio limiter is available
+    return to_thread.current_default_thread_limiter().borrowed_tokens
+
+
+metrics.gauge("gallery_loaded", "1 once this process has loaded the face gallery",
+              callback=lambda: int(face_gallery.loaded_snapshot is not None))
+metrics.gauge("gallery_encodings", "Face encodings in the loaded gallery snapshot",
+              callback=_gallery_value("encodings"))
+metrics.gauge("gallery_generation", "Generation of the loaded gallery snapshot",
+              callback=_gallery_value("generation"))
+metrics.gauge("gallery_high_water_mark", "Largest face_encodings.id in the loaded snapshot",
+              callback=_gallery_value("high_water_mark"))
+metrics.gauge("visit_stream_subscribers", "Connected /visits/stream subscribers",
+              callback=lambda: len(visit_events.queue_depths()))
+metrics.gauge("visit_stream_queued_events", "Events waiting in visit stream subscriber queues",
+              callback=lambda: sum(visit_events.queue_depths()))
+metrics.gauge("threadpool_busy_threads", "Worker threads in use (sync endpoints, run_in_threadpool)",
+              callback=_threadpool_busy)
+metrics.gauge("change_feed_last_id", "Last change_log event applied by this process",
+              callback=lambda: change_feed.last_id)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    """
+    Metrics of this worker process in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.get("/ready")
+async def readiness():
+    """
+    Readiness probe: 503 until the startup warm-up has finished and the
+    face gallery is loaded (api-only processes do not load it). Stays 503
+    with status "failed" if a required warm-up step failed, e.g. the
+    recognition libraries of a recognition worker.
+    """
+    snapshot = face_gallery.loaded_snapshot
+    gallery = {"loaded": snapshot is not None}
+    if snapshot is not None:
+        gallery.update(generation=snapshot.generation, encodings=len(snapshot))
+
+    ready = startup_warmup.done and (snapshot is not None or not SERVES_RECOGNITION)
+    if ready:
+        state = "ready"
+    else:
+        state = "failed" if startup_warmup.state == "failed" else "starting"
+    return JSONResponse(
+        {"status": state, "role": APP_ROLE, "gallery": gallery,
+         "warmup": startup_warmup.status()},
+        status_code=200 if ready else 503
+    )
@@ -0,0 +1,38 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from pydantic import BaseModel, Field
+
+from app.services.profiling.profiler import PROFILING_AVAILABLE, check_token, profiling_state
+
+router = APIRouter()
+
+
+class ProfilingSettings(BaseModel):
+    sample_rate: float = Field(0.0, ge=0.0, le=1.0)
+    path_prefix: Optional[str] = None
+
+
+def require_profiling_token(x_profile_token: Optional[str] = Header(None)):
+    if not PROFILING_AVAILABLE:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiling is not enabled")
+    if not check_token(x_profile_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid profiling token")
+
+
+@router.get("/", dependencies=[Depends(require_profiling_token)])
+def read_profiling():
+    """
+    Current profiling settings.
+    """
+    return profiling_state.status()
+
+
+@router.put("/", dependencies=[Depends(require_profiling_token)])
+def update_profiling(settings: ProfilingSettings):
+    """
+    Profile a share of requests (sample_rate 0 turns sampling off).
+    Single requests can also be profiled with the X-Profile header.
+    """
+    profiling_state.configure(settings.sample_rate, settings.path_prefix)
+    return profiling_state.status()
@@ -1,59 +1,165 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import Any, List
+from typing import Any, Dict, List, Optional
+import asyncio
 import datetime
 import json
+import os
+import time
 
-from app.db.base import get_db
+from app.api.caching import PRIVATE_CACHE_CONTROL, cache_headers, make_etag, not_modified_response
+from app.api.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, count_cache, keyset_paginate
+from app.api.serialization import FAST_JSON_RESPONSES, FastJSONResponse, client_projection, visit_projection
+from app.db.base import AsyncSessionLocal, get_db
 from app.models.models import Visit, Client
+from app.schemas.pagination import PaginatedResponse
 from app.schemas.visit import VisitCreate, VisitUpdate, Visit as VisitSchema, VisitWithClient
+from app.services.events.broker import publish_entry, publish_exit, visit_events
+from app.services.visits.dwell import record_dwell, visit_dwell
 
 router = APIRouter()
 
 
-@router.get("/", response_model=List[VisitSchema])
+@router.get("/", response_model=PaginatedResponse[VisitSchema])
 def read_visits(
-    skip: int = 0,
-    limit: int = 100,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = True,
     db: Session = Depends(get_db)
 ) -> Any:
     """
-    Retrieve visits.
+    Retrieve visits, newest first, paginated by id.
     """
-    visits = db.query(Visit).offset(skip).limit(limit).all()
+    query = db.query(*visit_projection.columns) if FAST_JSON_RESPONSES else db.query(Visit)
+    page = keyset_paginate(
+        query,
+        Visit.id,
+        count_key=("visits",),
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
+        descending=True
+    )
     
-    # Purpose maydonini tekshirib, to'g'ri qaytarish
-    result = []
-    for visit in visits:
-        # Purpose maydoni to'g'ri qaytarilishini ta'minlash
+    if FAST_JSON_RESPONSES:
+        page["items"] = visit_projection.to_dicts(page["items"])
+        return FastJSONResponse(page)
+    
+    # Purpose maydoni to'g'ri qaytarilishini ta'minlash
+    for visit in page["items"]:
         if visit.purpose is None:
             visit.purpose = "Not specified"
-        
+    
+    return page
+
+
+# Open visits older than this are treated as stale (missed exit) and hidden
+CURRENT_VISIT_MAX_AGE_HOURS = float(os.getenv("CURRENT_VISIT_MAX_AGE_HOURS", "12"))
+
+
+def _current_visits_statement(max_age_hours: float):
+    """
+    Open visits and their clients as one joined column projection.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=max_age_hours)
+    return select(
+        *visit_projection.columns, *client_projection.columns
+    ).join(
+        Client, Visit.client_id == Client.id
+    ).where(
+        Visit.exit_time.is_(None),
+        Visit.entry_time >= cutoff
+    ).order_by(
+        Visit.entry_time.desc()
+    )
+
+
+def _current_visit_dicts(rows) -> List[Dict[str, Any]]:
+    """
+    Turn projected rows straight into VisitWithClient-shaped dicts, so no
+    ORM entities are built and no lazy `client` loads are issued.
+    """
+    n_visit = len(visit_projection.columns)
+    result = []
+    for row in rows:
+        visit = visit_projection.to_dict(row[:n_visit])
+        visit["client"] = client_projection.to_dict(row[n_visit:])
         result.append(visit)
     
     return result
 
 
 @router.get("/current", response_model=List[VisitWithClient])
-def read_current_visits(db: Session = Depends(get_db)) -> Any:
+def read_current_visits(
+    request: Request,
+    response: Response,
+    max_age_hours: float = Query(CURRENT_VISIT_MAX_AGE_HOURS, gt=0),
+    db: Session = Depends(get_db)
+) -> Any:
     """
-    Retrieve all current visits (no exit time).
+    Retrieve current visits (no exit time) that started within max_age_hours.
     """
-    visits = db.query(Visit).filter(Visit.exit_time.is_(None)).all()
+    # The staleness cutoff moves with time, so the ETag also changes every minute
+    etag = make_etag(request, "visits", "clients", extra=str(int(time.time() // 60)))
+    not_modified = not_modified_response(request, etag, PRIVATE_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    headers = cache_headers(etag, PRIVATE_CACHE_CONTROL)
     
-    # Ma'lumotlarni to'g'ri formatda qaytarish
-    result = []
-    for visit in visits:
-        # Recommendations JSON string bo'lsa, uni dict ga o'zgartirish
-        if visit.recommendations and isinstance(visit.recommendations, str):
-            try:
-                visit.recommendations = json.loads(visit.recommendations)
-            except:
-                visit.recommendations = None
-        
-        result.append(visit)
+    visits = _current_visit_dicts(db.execute(_current_visits_statement(max_age_hours)))
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(visits, headers=headers)
+    response.headers.update(headers)
+    return visits
+
+
+# Seconds between keep-alive comments on an idle stream
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+async def _current_visits_snapshot() -> List[Dict[str, Any]]:
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(_current_visits_statement(CURRENT_VISIT_MAX_AGE_HOURS))
+        return _current_visit_dicts(rows)
+
+
+def _sse_message(event_type: str, data: Any) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@router.get("/stream")
+async def stream_visits(request: Request):
+    """
+    Server-sent events feed of current visits.
+
+    Sends a `snapshot` of all current visits on connect, then `entry`,
+    `exit` and `recommendation` events as they happen.
+    """
+    async def event_source():
+        # Subscribe before taking the snapshot so no event falls in between
+        queue = visit_events.subscribe()
+        try:
+            snapshot = await _current_visits_snapshot()
+            yield _sse_message("snapshot", snapshot)
+            
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse_message(event["type"], event["data"])
+        finally:
+            visit_events.unsubscribe(queue)
     
-    return result
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.post("/", response_model=VisitSchema)
@@ -86,8 +192,13 @@ def create_visit(
     )
     
     db.add(visit)
+    record_dwell(db, visit)
     db.commit()
     db.refresh(visit)
+    count_cache.invalidate("visits")
+    
+    if visit.exit_time is None:
+        publish_entry(visit)
     return visit
 
 
@@ -132,12 +243,19 @@ def update_visit(
     if "recommendations" in update_data and update_data["recommendations"]:
         update_data["recommendations"] = json.dumps(update_data["recommendations"])
     
+    was_open = visit.exit_time is None
+    # Dwell sketches hold closed visits; an edit moves the visit between bins
+    previous_dwell = visit_dwell(db, visit)
     for field, value in update_data.items():
         setattr(visit, field, value)
     
     db.add(visit)
+    record_dwell(db, visit, previous_dwell)
     db.commit()
     db.refresh(visit)
+    
+    if was_open and visit.exit_time is not None:
+        publish_exit(visit)
     return visit
 
 
@@ -157,21 +275,40 @@ def checkout_visit(
             detail="Visit not found"
         )
     
+    previous_dwell = visit_dwell(db, visit)
     visit.exit_time = datetime.datetime.utcnow()
     db.add(visit)
+    record_dwell(db, visit, previous_dwell)
     db.commit()
     db.refresh(visit)
+    publish_exit(visit)
     return visit
 
 
-@router.get("/client/{client_id}", response_model=List[VisitSchema])
+@router.get("/client/{client_id}", response_model=PaginatedResponse[VisitSchema])
 def read_client_visits(
     *,
     db: Session = Depends(get_db),
-    client_id: int
+    client_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = True
 ) -> Any:
     """
-    Get all visits for a specific client.
+    Get visits for a specific client, newest first, paginated by id.
     """
-    visits = db.query(Visit).filter(Visit.client_id == client_id).all()
-    return visits 
\ No newline at end of file
+    query = db.query(*visit_projection.columns) if FAST_JSON_RESPONSES else db.query(Visit)
+    page = keyset_paginate(
+        query.filter(Visit.client_id == client_id),
+        Visit.id,
+        count_key=("visits", client_id),
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
+        descending=True
+    )
+    
+    if FAST_JSON_RESPONSES:
+        page["items"] = visit_projection.to_dicts(page["items"])
+        return FastJSONResponse(page)
+    return page 
\ No newline at end of file
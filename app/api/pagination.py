@@ -0,0 +1,168 @@
+import base64
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import func
+from sqlalchemy.orm import Query
+
+from app.db.changes import change_feed
+from app.services.metrics.registry import metrics
+
+# How long a cached COUNT(*) result is trusted (seconds)
+COUNT_CACHE_TTL = 30.0
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+count_cache_requests_total = metrics.counter(
+    "count_cache_requests_total", "Paginated listing totals served from the count cache", ["table", "result"]
+)
+
+
+class CountCache:
+    """
+    In-process cache for the totals returned by paginated listings.
+
+    Keys are tuples whose first element is the table name, so all cached
+    totals of a table can be dropped after a write to it.
+    """
+
+    def __init__(self, ttl: float = COUNT_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Hashable, ...], Tuple[float, int]] = {}
+
+    def get(self, key: Tuple[Hashable, ...], compute: Callable[[], int]) -> int:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._values.get(key)
+        if cached is not None and now - cached[0] < self.ttl:
+            count_cache_requests_total.inc(table=key[0], result="hit")
+            return cached[1]
+
+        count_cache_requests_total.inc(table=key[0], result="miss")
+        value = compute()
+        with self._lock:
+            self._values[key] = (now, value)
+        return value
+
+    def invalidate(self, table: str) -> None:
+        with self._lock:
+            for key in [key for key in self._values if key[0] == table]:
+                del self._values[key]
+
+
+count_cache = CountCache()
+
+
+def _invalidate_changed_counts(changes) -> None:
+    # Other workers' writes; local writers invalidate directly
+    for table in {change.table for change in changes}:
+        count_cache.invalidate(table)
+
+
+change_feed.add_listener(_invalidate_changed_counts)
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Encode the last seen sort key as an opaque URL-safe cursor.
+    """
+    raw = json.dumps({"id": last_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Decode a cursor produced by encode_cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def encode_offset_cursor(offset: int) -> str:
+    """
+    Cursor for listings sorted in memory, where the position in the sorted
+    result is the only stable key.
+    """
+    raw = json.dumps({"offset": offset}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = int(json.loads(base64.urlsafe_b64decode(padded))["offset"])
+    except (ValueError, KeyError, TypeError):
+        offset = -1
+    if offset < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return offset
+
+
+def keyset_paginate(
+    query: Query,
+    key_column: Any,
+    count_key: Tuple[Hashable, ...],
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    include_total: bool = True,
+    descending: bool = False
+) -> Dict[str, Any]:
+    """
+    Paginate a query by seeking past the last seen value of an indexed key.
+
+    Unlike OFFSET/LIMIT the cost of a page does not depend on how deep it is.
+
+    Args:
+        query: Filtered query to paginate (without ordering)
+        key_column: Unique indexed column used as sort key (usually the primary key)
+        count_key: Cache key for the total; first element must be the table name
+        cursor: Cursor returned with the previous page, or None for the first page
+        limit: Page size
+        include_total: Whether to return the (cached) total row count
+        descending: Walk the key from newest to oldest
+
+    Returns:
+        Dict matching the PaginatedResponse schema
+    """
+    total = None
+    if include_total:
+        total = count_cache.get(
+            count_key,
+            lambda: query.with_entities(func.count(key_column)).scalar()
+        )
+
+    if cursor:
+        last_id = decode_cursor(cursor)
+        query = query.filter(key_column < last_id if descending else key_column > last_id)
+
+    query = query.order_by(key_column.desc() if descending else key_column.asc())
+
+    # Fetch one extra row to know whether another page exists
+    items = query.limit(limit + 1).all()
+    has_more = len(items) > limit
+    items = items[:limit]
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor(getattr(items[-1], key_column.key))
+
+    return {
+        "items": items,
+        "total": total,
+        "page_size": limit,
+        "next_cursor": next_cursor
+    }
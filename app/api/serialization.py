@@ -0,0 +1,105 @@
+import datetime
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Type
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from app.models.models import Car, Client, Visit
+from app.schemas.car import Car as CarSchema
+from app.schemas.client import Client as ClientSchema
+from app.schemas.visit import Visit as VisitSchema
+
+try:
+    import orjson
+except ImportError:  # orjson ixtiyoriy; bo'lmasa standart json ishlatiladi
+    orjson = None
+
+# Opt-in: read endpoints build plain dicts from column projections and skip
+# per-row Pydantic validation when this is enabled
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "0").lower() in ("1", "true", "yes")
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (or compact stdlib json as a fallback)
+    without going through jsonable_encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(content, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+class RowProjection:
+    """
+    Column projection of a model that produces dicts shaped like a schema.
+
+    Schema fields backed by a column are selected; the rest get their schema
+    default. Transforms reproduce what the schema's validators would do.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        schema: Type[BaseModel],
+        transforms: Optional[Dict[str, Callable[[Any], Any]]] = None
+    ):
+        table_columns = model.__table__.columns
+        self.columns = [
+            getattr(model, name) for name in schema.model_fields if name in table_columns
+        ]
+        self.keys = [column.key for column in self.columns]
+        self.defaults = {
+            name: field.default
+            for name, field in schema.model_fields.items()
+            if name not in table_columns and not field.is_required()
+        }
+        self.transforms = transforms or {}
+
+    def to_dict(self, values: Sequence[Any]) -> Dict[str, Any]:
+        """
+        Build a dict from a row (or slice of a row) ordered like self.columns.
+        """
+        data = dict(self.defaults)
+        data.update(zip(self.keys, values))
+        for name, transform in self.transforms.items():
+            data[name] = transform(data[name])
+        return data
+
+    def to_dicts(self, rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+        return [self.to_dict(row) for row in rows]
+
+
+def parse_json_text(value: Any, fallback: Any = None) -> Any:
+    """
+    Parse a JSON text column, returning fallback for empty or broken values.
+    """
+    if not value:
+        return fallback
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return fallback
+
+
+client_projection = RowProjection(Client, ClientSchema)
+
+visit_projection = RowProjection(Visit, VisitSchema, transforms={
+    "purpose": lambda value: value if value is not None else "Not specified",
+    "recommendations": parse_json_text
+})
+
+car_projection = RowProjection(Car, CarSchema, transforms={
+    "features": lambda value: parse_json_text(value, {})
+})
@@ -1,20 +1,138 @@
-from sqlalchemy import create_engine
+import logging
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Any SQLAlchemy URL; defaults to the local SQLite file
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./autoclientai.db")
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./autoclientai.db"
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+IS_SQLITE = _url.get_backend_name() == "sqlite"
+_IS_SQLITE_MEMORY = IS_SQLITE and _url.database in (None, "", ":memory:")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Async drivers for the async endpoints (aiosqlite for local SQLite)
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    _url.set(drivername=_ASYNC_DRIVERS.get(_url.get_backend_name(), _url.drivername)).render_as_string(hide_password=False)
 )
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    # WAL: o'quvchilar yozuvchini kutmaydi (dashboard vs visit logging)
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative cache_size is in KiB
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+# Seconds between periodic PRAGMA optimize runs (0 disables them)
+DB_OPTIMIZE_INTERVAL = float(os.getenv("DB_OPTIMIZE_INTERVAL", "3600"))
+
+
+def _engine_kwargs(is_async: bool = False) -> dict:
+    kwargs = {}
+    if IS_SQLITE:
+        kwargs["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000
+        }
+    else:
+        kwargs["pool_pre_ping"] = True
+
+    # In-memory SQLite must share one connection across threads
+    if _IS_SQLITE_MEMORY:
+        kwargs["poolclass"] = StaticPool
+    else:
+        if is_async:
+            # aiosqlite would otherwise default to NullPool
+            kwargs["poolclass"] = AsyncAdaptedQueuePool
+        kwargs.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "-1"))
+        )
+    return kwargs
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            if name == "journal_mode" and _IS_SQLITE_MEMORY:
+                continue
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **_engine_kwargs())
+
+# Note: an in-memory URL gives the async engine its own, separate database
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(is_async=True))
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
 Base = declarative_base()
 
+
+def optimize_database():
+    """
+    Refresh query planner statistics (ANALYZE / PRAGMA optimize).
+    Cheap when nothing changed, so it can run periodically.
+    """
+    if not IS_SQLITE:
+        return
+
+    with engine.connect() as connection:
+        # Katta jadvallarda ANALYZE uzoq davom etmasligi uchun
+        connection.execute(text("PRAGMA analysis_limit=1000"))
+        has_stats = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        )).first()
+        if not has_stats:
+            connection.execute(text("ANALYZE"))
+        connection.execute(text("PRAGMA optimize"))
+        connection.commit()
+    logger.info("Database statistics refreshed")
+
+
 # Dependency
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+
+# Dependency for async endpoints
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,140 @@
+import asyncio
+import datetime
+import logging
+import os
+import threading
+from typing import Callable, List, NamedTuple, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, select
+
+from app.db.base import engine
+from app.db.versions import process_origin, table_versions
+from app.models.models import ChangeEvent
+
+logger = logging.getLogger(__name__)
+
+# Seconds between change_log polls (0 disables tailing)
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", "0.5"))
+
+# Events older than this are deleted; workers only need the recent tail
+CHANGE_LOG_RETENTION_HOURS = float(os.getenv("CHANGE_LOG_RETENTION_HOURS", "24"))
+
+_BATCH_SIZE = 1000
+_PRUNE_EVERY = 3600.0
+
+_change_log = ChangeEvent.__table__
+
+
+class Change(NamedTuple):
+    id: int
+    table: str
+    row_id: Optional[int]
+    operation: str
+    origin: str
+
+
+class ChangeFeed:
+    """
+    Tails the change_log table and applies other processes' writes to this
+    process's caches.
+
+    Table versions (ETags) follow every event; listeners only receive events
+    written by other processes, since local writers already update their
+    caches directly.
+    """
+
+    def __init__(self, poll_interval: float = CHANGE_FEED_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.last_id = 0
+        self._listeners: List[Callable[[List[Change]], None]] = []
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def add_listener(self, listener: Callable[[List[Change]], None]) -> None:
+        """
+        Register listener(changes), called from a worker thread.
+        """
+        self._listeners.append(listener)
+
+    def prime(self) -> None:
+        """
+        Start from the end of the log and take table versions from it.
+        """
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(_change_log.c.table_name, func.max(_change_log.c.id))
+                .group_by(_change_log.c.table_name)
+            ).all()
+        with self._lock:
+            for table, change_id in rows:
+                table_versions.advance([table], change_id)
+                self.last_id = max(self.last_id, change_id)
+
+    def poll(self) -> List[Change]:
+        """
+        Read and apply all events after the last seen one.
+        """
+        with self._lock:
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    select(
+                        _change_log.c.id,
+                        _change_log.c.table_name,
+                        _change_log.c.row_id,
+                        _change_log.c.operation,
+                        _change_log.c.origin
+                    )
+                    .where(_change_log.c.id > self.last_id)
+                    .order_by(_change_log.c.id)
+                    .limit(_BATCH_SIZE)
+                ).all()
+            if not rows:
+                return []
+
+            changes = [Change(*row) for row in rows]
+            self.last_id = changes[-1].id
+
+        for change in changes:
+            table_versions.advance([change.table], change.id)
+
+        origin = process_origin()
+        foreign = [change for change in changes if change.origin != origin]
+        if foreign:
+            for listener in self._listeners:
+                try:
+                    listener(foreign)
+                except Exception:
+                    logger.exception("Change listener %r failed", listener)
+        return changes
+
+    def prune(self) -> int:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=CHANGE_LOG_RETENTION_HOURS)
+        # The latest event of every table is kept: it is the table's version
+        # (ETags), which must not fall back after a restart
+        latest = select(func.max(_change_log.c.id)).group_by(_change_log.c.table_name)
+        with engine.begin() as connection:
+            return connection.execute(
+                delete(_change_log).where(_change_log.c.created_at < cutoff, _change_log.c.id.not_in(latest))
+            ).rowcount
+
+    async def run(self) -> None:
+        """
+        Poll forever; meant to run as a background task in every worker.
+        """
+        await run_in_threadpool(self.prime)
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # Drain bursts in batches before sleeping
+                while len(await run_in_threadpool(self.poll)) == _BATCH_SIZE:
+                    pass
+                if loop.time() - self._last_prune > _PRUNE_EVERY:
+                    self._last_prune = loop.time()
+                    await run_in_threadpool(self.prune)
+            except Exception:
+                logger.exception("Change feed poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,180 @@
+import logging
+import os
+import re
+import time
+from typing import List
+
+from sqlalchemy import or_, text
+from sqlalchemy.orm import Session
+
+from app.db.base import IS_SQLITE, engine
+from app.models.models import Client
+
+logger = logging.getLogger(__name__)
+
+# Searchable columns and their bm25 weights (names matter most)
+SEARCH_COLUMNS = {
+    "first_name": 10.0,
+    "last_name": 10.0,
+    "phone": 5.0,
+    "workplace": 2.0,
+    "interests": 1.0,
+}
+
+# bm25 is computed only for the newest RANK_WINDOW matches; broad queries
+# ("ka", "90") match a large part of the table and ranking all of it costs
+# hundreds of milliseconds on a million clients
+RANK_WINDOW = int(os.getenv("CLIENT_SEARCH_RANK_WINDOW", "2000"))
+
+_TRIGGERS = ("clients_fts_insert", "clients_fts_delete", "clients_fts_update")
+
+
+def _indexed_values(row: str) -> str:
+    """
+    SQL expressions for the indexed values of a clients row (new/old/clients).
+    Besides the phone as written, its digits and its local 9-digit number
+    are indexed, so "+998 90 123-45-67", "99890123" and "901234567" match.
+    """
+    digits = f"coalesce({row}.phone, '')"
+    for char in (" ", "-", "+", "(", ")"):
+        digits = f"replace({digits}, '{char}', '')"
+    phone = f"coalesce({row}.phone, '') || ' ' || {digits} || ' ' || substr({digits}, -9)"
+    values = [f"coalesce({row}.{column}, '')" if column != "phone" else phone for column in SEARCH_COLUMNS]
+    return ", ".join(values)
+
+
+_COLUMN_LIST = ", ".join(SEARCH_COLUMNS)
+
+# Contentless FTS5 table: it only stores the index, results are client ids.
+# Prefix indexes make 2 and 3 character prefix queries cheap.
+_CREATE_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(
+    {_COLUMN_LIST},
+    content='',
+    prefix='2 3',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+_CREATE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clients_fts_insert AFTER INSERT ON clients BEGIN
+        INSERT INTO clients_fts(rowid, {_COLUMN_LIST}) VALUES (new.id, {_indexed_values("new")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clients_fts_delete AFTER DELETE ON clients BEGIN
+        INSERT INTO clients_fts(clients_fts, rowid, {_COLUMN_LIST}) VALUES ('delete', old.id, {_indexed_values("old")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clients_fts_update AFTER UPDATE OF {_COLUMN_LIST} ON clients BEGIN
+        INSERT INTO clients_fts(clients_fts, rowid, {_COLUMN_LIST}) VALUES ('delete', old.id, {_indexed_values("old")});
+        INSERT INTO clients_fts(rowid, {_COLUMN_LIST}) VALUES (new.id, {_indexed_values("new")});
+    END
+    """,
+]
+
+
+def ensure_client_search_index() -> None:
+    """
+    Create the clients_fts table and its sync triggers. The index is
+    (re)built from the clients table when the triggers are missing: on the
+    first run, and after the clients table was recreated (dropping a table
+    drops its triggers).
+    """
+    if not IS_SQLITE:
+        return
+
+    with engine.begin() as connection:
+        connection.execute(text(_CREATE_TABLE))
+        existing = connection.execute(text(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({})".format(
+                ", ".join(f"'{name}'" for name in _TRIGGERS)
+            )
+        )).scalar()
+        if existing == len(_TRIGGERS):
+            return
+
+        started = time.perf_counter()
+        for name in _TRIGGERS:
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        connection.execute(text("INSERT INTO clients_fts(clients_fts) VALUES ('delete-all')"))
+        connection.execute(text(
+            f"INSERT INTO clients_fts(rowid, {_COLUMN_LIST}) SELECT id, {_indexed_values('clients')} FROM clients"
+        ))
+        for statement in _CREATE_TRIGGERS:
+            connection.execute(text(statement))
+    logger.info("Client search index built in %.1fs", time.perf_counter() - started)
+
+
+def search_terms(query: str) -> List[str]:
+    """
+    Words of a free-text query (letters and digits only).
+    """
+    return re.findall(r"\w+", query)[:10]
+
+
+def match_expression(terms: List[str]) -> str:
+    """
+    FTS5 query: every term must match the start of a word in any column
+    (single characters match whole words only). Terms are quoted, so user
+    input cannot inject FTS5 syntax.
+    """
+    return " AND ".join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+
+
+def search_client_ids(db: Session, terms: List[str], offset: int, limit: int) -> List[int]:
+    """
+    Ids of clients matching all terms: the newest RANK_WINDOW matches best
+    bm25 rank first, then any further matches newest first.
+    """
+    if IS_SQLITE:
+        match = match_expression(terms)
+        ids = []
+        if offset < RANK_WINDOW:
+            weights = ", ".join(str(weight) for weight in SEARCH_COLUMNS.values())
+            ids = [row[0] for row in db.execute(
+                text(
+                    f"SELECT rowid FROM ("
+                    f"  SELECT rowid, bm25(clients_fts, {weights}) AS score FROM clients_fts"
+                    f"  WHERE clients_fts MATCH :match ORDER BY rowid DESC LIMIT :window"
+                    f") ORDER BY score, rowid DESC LIMIT :limit OFFSET :offset"
+                ),
+                {"match": match, "window": RANK_WINDOW, "limit": limit, "offset": offset}
+            )]
+            if len(ids) == limit or offset + len(ids) < RANK_WINDOW:
+                return ids
+
+        ids += [row[0] for row in db.execute(
+            text(
+                "SELECT rowid FROM clients_fts WHERE clients_fts MATCH :match "
+                "ORDER BY rowid DESC LIMIT :limit OFFSET :offset"
+            ),
+            {"match": match, "limit": limit - len(ids), "offset": max(offset, RANK_WINDOW)}
+        )]
+        return ids
+
+    # Other databases: unranked prefix matching, no index
+    return [
+        row[0] for row in _fallback_query(db, terms).with_entities(Client.id)
+        .order_by(Client.id).offset(offset).limit(limit)
+    ]
+
+
+def count_matches(db: Session, terms: List[str]) -> int:
+    if IS_SQLITE:
+        return db.execute(
+            text("SELECT count(*) FROM clients_fts WHERE clients_fts MATCH :match"),
+            {"match": match_expression(terms)}
+        ).scalar()
+    return _fallback_query(db, terms).count()
+
+
+def _fallback_query(db: Session, terms: List[str]):
+    query = db.query(Client)
+    for term in terms:
+        query = query.filter(or_(
+            *[getattr(Client, column).ilike(f"{term}%") for column in SEARCH_COLUMNS]
+        ))
+    return query
@@ -0,0 +1,21 @@
+from sqlalchemy import text
+from app.db.base import engine
+
+QUALITY_COLUMNS = (("quality", "FLOAT"), ("sharpness", "FLOAT"), ("face_size", "INTEGER"), ("yaw", "FLOAT"))
+
+def run_migration():
+    """Add enrollment quality columns to face_encodings table"""
+    with engine.connect() as connection:
+        for column, column_type in QUALITY_COLUMNS:
+            try:
+                # Check if column exists
+                connection.execute(text(f"SELECT {column} FROM face_encodings LIMIT 1"))
+                print(f"{column} column already exists")
+            except Exception:
+                connection.rollback()
+                connection.execute(text(f"ALTER TABLE face_encodings ADD COLUMN {column} {column_type}"))
+                connection.commit()
+                print(f"Added {column} column to face_encodings table")
+
+if __name__ == "__main__":
+    run_migration()
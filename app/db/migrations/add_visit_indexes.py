@@ -0,0 +1,19 @@
+from sqlalchemy import text
+from app.db.base import engine
+
+def run_migration():
+    """Add indexes used by keyset pagination of visits"""
+    with engine.connect() as connection:
+        # create_all mavjud jadvallarga yangi indekslarni qo'shmaydi
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_visits_client_id_id ON visits (client_id, id)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_visits_open_entry_time "
+            "ON visits (entry_time) WHERE exit_time IS NULL"
+        ))
+        connection.commit()
+        print("ix_visits_client_id_id and ix_visits_open_entry_time indexes are ready")
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,19 @@
+from sqlalchemy import text
+from app.db.base import engine
+
+def run_migration():
+    """Add last_seen_at and exit_estimated columns to visits table"""
+    with engine.connect() as connection:
+        for column, definition in (("last_seen_at", "DATETIME"), ("exit_estimated", "BOOLEAN DEFAULT 0")):
+            try:
+                # Check if column exists
+                connection.execute(text(f"SELECT {column} FROM visits LIMIT 1"))
+                print(f"{column} column already exists")
+            except Exception:
+                connection.rollback()
+                connection.execute(text(f"ALTER TABLE visits ADD COLUMN {column} {definition}"))
+                connection.commit()
+                print(f"Added {column} column to visits table")
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,125 @@
+import datetime
+import os
+import threading
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+
+from app.models.models import ChangeEvent
+
+# Changes every process start, so a new process never takes an earlier
+# process's change events for its own
+BOOT_ID = uuid.uuid4().hex[:8]
+
+_PENDING_KEY = "changed_tables"
+_CHANGE_ID_KEY = "change_id"
+
+_change_log = ChangeEvent.__table__
+
+
+def process_origin() -> str:
+    """
+    Identifies the writing process in the change log. Evaluated on every
+    call because preforked workers share BOOT_ID but not the pid.
+    """
+    return f"{BOOT_ID}:{os.getpid()}"
+
+
+class TableVersions:
+    """
+    Per-table versions: the id of the latest change_log event for the table.
+
+    The change log is shared by all processes, so every worker reports the
+    same version for the same data once it has seen the event.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = defaultdict(int)
+
+    def get(self, table: str) -> int:
+        with self._lock:
+            return self._versions[table]
+
+    def advance(self, tables: Iterable[str], version: int) -> None:
+        with self._lock:
+            for table in tables:
+                if version > self._versions[table]:
+                    self._versions[table] = version
+
+    def token(self, tables: Iterable[str]) -> str:
+        """
+        Compact string identifying the current state of the given tables.
+        change_log ids are persistent and never reused, so the token is the
+        same in every worker and across restarts.
+        """
+        with self._lock:
+            return ",".join(f"{table}:{self._versions[table]}" for table in tables)
+
+
+table_versions = TableVersions()
+
+
+def _pending(session: Session) -> set:
+    return session.info.setdefault(_PENDING_KEY, set())
+
+
+def _record_changes(session: Session, changes: list) -> None:
+    """
+    Write change_log rows in the session's transaction, so they commit or
+    roll back together with the change itself.
+    """
+    if not changes:
+        return
+
+    origin = process_origin()
+    now = datetime.datetime.utcnow()
+    connection = session.connection()
+    connection.execute(insert(_change_log), [
+        {"table_name": table, "row_id": row_id, "operation": operation, "origin": origin, "created_at": now}
+        for table, row_id, operation in changes
+    ])
+    change_id = connection.execute(select(func.max(_change_log.c.id))).scalar()
+    session.info[_CHANGE_ID_KEY] = max(session.info.get(_CHANGE_ID_KEY, 0), change_id or 0)
+    _pending(session).update(table for table, _, _ in changes)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    changes = []
+    for objects, operation in ((session.new, "insert"), (session.dirty, "update"), (session.deleted, "delete")):
+        for obj in objects:
+            table = getattr(obj, "__tablename__", None)
+            if table:
+                changes.append((table, getattr(obj, "id", None), operation))
+    _record_changes(session, changes)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_statement(orm_execute_state):
+    # UPDATE/DELETE statements (session.execute(update(...)), Query.update())
+    # bypass the flush; the affected rows are unknown, so row_id is None
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    if table is None or table.name == _change_log.name:
+        return
+    operation = "update" if orm_execute_state.is_update else "delete"
+    _record_changes(orm_execute_state.session, [(table.name, None, operation)])
+
+
+@event.listens_for(Session, "after_commit")
+def _advance_committed_tables(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    change_id = session.info.pop(_CHANGE_ID_KEY, 0)
+    if pending:
+        table_versions.advance(pending, change_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_tables(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_CHANGE_ID_KEY, None)
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Text, JSON, ARRAY
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, Float, DateTime, Text, JSON, ARRAY
 from sqlalchemy.orm import relationship
 import datetime
 
@@ -34,6 +34,11 @@ class FaceEncoding(Base):
     client_id = Column(Integer, ForeignKey("clients.id"))
     encoding_vector = Column(Text)  # Store as serialized numpy array (JSON string)
     image_path = Column(String)
+    # Enrollment image quality (NULL for encodings saved before it was measured)
+    quality = Column(Float, nullable=True)    # 0..1, used to choose which encodings to keep
+    sharpness = Column(Float, nullable=True)  # Laplacian variance of the face crop
+    face_size = Column(Integer, nullable=True)  # Yuz o'lchami, px
+    yaw = Column(Float, nullable=True)        # Head turn from landmarks, 0 = frontal
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     # Relationships
@@ -47,12 +52,26 @@ class Visit(Base):
     client_id = Column(Integer, ForeignKey("clients.id"))
     entry_time = Column(DateTime, default=datetime.datetime.utcnow)
     exit_time = Column(DateTime, nullable=True)
+    # Latest recognition while open (written in batches, see services/visits/sessions.py)
+    last_seen_at = Column(DateTime, nullable=True)
+    # exit_time estimated by closing an idle visit, not seen by the exit camera
+    exit_estimated = Column(Boolean, default=False)
     purpose = Column(String, nullable=True)
     recommendations = Column(Text, nullable=True)  # Store as JSON string
     
     # Relationships
     client = relationship("Client", back_populates="visits")
 
+    __table_args__ = (
+        # /visits/client/{id} keyset pagination uchun
+        Index("ix_visits_client_id_id", "client_id", "id"),
+        # Faqat ochiq tashriflar (/visits/current) uchun qisman indeks
+        Index(
+            "ix_visits_open_entry_time", "entry_time",
+            sqlite_where=exit_time.is_(None)
+        ),
+    )
+
 
 class Car(Base):
     __tablename__ = "cars"
@@ -66,4 +85,33 @@ class Car(Base):
     category = Column(String)  # sedan, SUV, hatchback, etc.
     features = Column(Text)  # JSON string of features
     image_url = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow) 
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.datetime.utcnow) 
+
+class ChangeEvent(Base):
+    __tablename__ = "change_log"
+
+    # AUTOINCREMENT: id'lar qayta ishlatilmaydi, ular keshlar uchun versiya
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=True)  # NULL for bulk updates/deletes
+    operation = Column(String, nullable=False)  # insert, update, delete
+    origin = Column(String, nullable=False)  # Writing process
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class DwellSketchBin(Base):
+    __tablename__ = "dwell_sketch_bins"
+
+    # One bin of the dwell-time sketch of (entry day, purpose, age bucket),
+    # see app/services/visits/dwell.py
+    day = Column(String, primary_key=True)  # YYYY-MM-DD
+    purpose = Column(String, primary_key=True)
+    age_bucket = Column(String, primary_key=True)
+    bin = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    total_seconds = Column(Float, nullable=False, default=0.0)
+
+    # Clustered on the key: range scans read the counts without a second lookup
+    __table_args__ = {"sqlite_with_rowid": False}
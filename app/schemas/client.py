@@ -74,6 +74,10 @@ class ClientUpdate(BaseModel):
     purpose: Optional[str] = None  # Tashrif maqsadi
 
 
+class ClientMerge(BaseModel):
+    duplicate_id: int  # Merged into the client in the path, then deleted
+
+
 class ClientInDB(ClientBase):
     id: int
     created_at: datetime
@@ -25,9 +25,18 @@ class FaceEncoding(FaceEncodingInDB):
     pass
 
 
+class SkippedFace(BaseModel):
+    face_location: List[int]  # [top, right, bottom, left]
+    reason: str  # too_small, blurry
+    face_size: int
+    sharpness: Optional[float] = None
+
+
 class FaceDetectionResult(BaseModel):
     is_recognized: bool
     client_id: Optional[int] = None
     client_name: Optional[str] = None  # Mijoz ismini qo'shamiz
     confidence: Optional[float] = None
-    face_location: Optional[List[int]] = None  # [top, right, bottom, left] 
\ No newline at end of file
+    face_location: Optional[List[int]] = None  # [top, right, bottom, left]
+    # Faces found but not encoded (quality gate); the next frame may do better
+    skipped_faces: List[SkippedFace] = [] 
\ No newline at end of file
@@ -5,7 +5,6 @@ T = TypeVar('T')
 
 class PaginatedResponse(BaseModel, Generic[T]):
     items: List[T]
-    total: int
-    page: int
+    total: Optional[int] = None  # include_total=false bo'lsa qaytarilmaydi
     page_size: int
-    total_pages: int 
\ No newline at end of file
+    next_cursor: Optional[str] = None  # Keyingi sahifa uchun kursor (oxirgi sahifada None)
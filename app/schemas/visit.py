@@ -51,6 +51,8 @@ class VisitUpdate(BaseModel):
 class VisitInDB(VisitBase):
     id: int
     client_id: int
+    last_seen_at: Optional[datetime] = None
+    exit_estimated: Optional[bool] = False
 
     class Config:
         orm_mode = True
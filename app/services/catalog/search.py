@@ -0,0 +1,180 @@
+import json
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from app.db.base import SessionLocal
+from app.db.versions import table_versions
+from app.models.models import Car
+from app.services.metrics.registry import metrics
+
+logger = logging.getLogger(__name__)
+
+# Sort keys accepted by search(); prefix with "-" for descending
+SORT_FIELDS = ("id", "price", "year")
+
+car_index_rebuilds_total = metrics.counter(
+    "car_index_rebuilds_total", "Rebuilds of the in-memory car search index"
+)
+
+
+class CatalogIndex(NamedTuple):
+    """
+    Column arrays of the whole catalog, one row per car. Brands and
+    categories are dictionary-encoded (lowercase); every boolean feature
+    flag found in Car.features gets a bitmap.
+    """
+    version: int
+    ids: np.ndarray
+    prices: np.ndarray
+    years: np.ndarray
+    brand_codes: np.ndarray
+    brands: Dict[str, int]
+    category_codes: np.ndarray
+    categories: Dict[str, int]
+    features: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _codes_mask(self, codes: np.ndarray, lookup: Dict[str, int], values: Iterable[str]) -> np.ndarray:
+        wanted = [lookup[value.lower()] for value in values if value.lower() in lookup]
+        return np.isin(codes, wanted)
+
+    def search(
+        self,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_year: Optional[int] = None,
+        max_year: Optional[int] = None,
+        brands: Sequence[str] = (),
+        categories: Sequence[str] = (),
+        features: Sequence[str] = (),
+        sort: str = "id"
+    ) -> np.ndarray:
+        """
+        Ids of the matching cars in sort order. Brands and categories match
+        any of the given values (case-insensitive); all given features must
+        be set.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if min_price is not None:
+            mask &= self.prices >= min_price
+        if max_price is not None:
+            mask &= self.prices <= max_price
+        if min_year is not None:
+            mask &= self.years >= min_year
+        if max_year is not None:
+            mask &= self.years <= max_year
+        if brands:
+            mask &= self._codes_mask(self.brand_codes, self.brands, brands)
+        if categories:
+            mask &= self._codes_mask(self.category_codes, self.categories, categories)
+        for feature in features:
+            bitmap = self.features.get(feature)
+            if bitmap is None:
+                # No car has this flag
+                return self.ids[:0]
+            mask &= bitmap
+
+        rows = np.flatnonzero(mask)
+        field = sort.lstrip("-")
+        if field == "id":
+            order = rows[::-1] if sort.startswith("-") else rows
+        else:
+            keys = {"price": self.prices, "year": self.years}[field][rows]
+            if sort.startswith("-"):
+                keys = -keys
+            # Ties by id (rows are in id order, the sort is stable)
+            order = rows[np.argsort(keys, kind="stable")]
+        return self.ids[order]
+
+
+def _feature_flags(features_json: Optional[str]) -> List[str]:
+    try:
+        features = json.loads(features_json) if features_json else {}
+    except ValueError:
+        return []
+    if not isinstance(features, dict):
+        return []
+    return [name for name, value in features.items() if value is True]
+
+
+def _dictionary_encode(values: List[Optional[str]]) -> Tuple[np.ndarray, Dict[str, int]]:
+    lookup: Dict[str, int] = {}
+    codes = np.fromiter(
+        (lookup.setdefault((value or "").lower(), len(lookup)) for value in values),
+        dtype=np.int32, count=len(values)
+    )
+    return codes, lookup
+
+
+class CarSearchIndex:
+    """
+    In-memory search index over the car catalog.
+
+    Rebuilt from the cars table on the first search after the table's
+    version changed (local writes and, through the change feed, other
+    workers' writes advance it), so searches never scan the features JSON.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Optional[CatalogIndex] = None
+
+    def current(self) -> CatalogIndex:
+        index = self._index
+        if index is not None and index.version == table_versions.get("cars"):
+            return index
+        with self._lock:
+            index = self._index
+            if index is None or index.version != table_versions.get("cars"):
+                index = self._index = self._build()
+        return index
+
+    def _build(self) -> CatalogIndex:
+        started = time.perf_counter()
+        # Read the version first: a write during the build triggers another one
+        version = table_versions.get("cars")
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(Car.id, Car.price, Car.year, Car.brand, Car.category, Car.features).order_by(Car.id)
+            ).all()
+        finally:
+            db.close()
+
+        count = len(rows)
+        brand_codes, brands = _dictionary_encode([row.brand for row in rows])
+        category_codes, categories = _dictionary_encode([row.category for row in rows])
+        features: Dict[str, np.ndarray] = {}
+        for position, row in enumerate(rows):
+            for name in _feature_flags(row.features):
+                if name not in features:
+                    features[name] = np.zeros(count, dtype=bool)
+                features[name][position] = True
+
+        index = CatalogIndex(
+            version=version,
+            ids=np.fromiter((row.id for row in rows), dtype=np.int64, count=count),
+            prices=np.fromiter((row.price if row.price is not None else np.nan for row in rows),
+                               dtype=np.float64, count=count),
+            years=np.fromiter((row.year if row.year is not None else 0 for row in rows),
+                              dtype=np.int32, count=count),
+            brand_codes=brand_codes,
+            brands=brands,
+            category_codes=category_codes,
+            categories=categories,
+            features=features,
+        )
+        car_index_rebuilds_total.inc()
+        logger.info("Car search index built: %d cars, %d feature flags in %.3fs",
+                    count, len(features), time.perf_counter() - started)
+        return index
+
+
+car_search_index = CarSearchIndex()
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from typing import Any, Dict, List, Tuple
+
+from app.models.models import Visit
+from app.schemas.visit import VisitWithClient
+from app.services.metrics.registry import metrics
+
+# Events kept per subscriber before the oldest ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+visit_events_dropped_total = metrics.counter(
+    "visit_events_dropped_total", "Visit stream events dropped because a subscriber fell behind"
+)
+
+
+class VisitEventBroker:
+    """
+    In-process fan-out of visit events (entry, exit, recommendation)
+    to connected stream subscribers.
+
+    Subscribers are asyncio queues owned by the event loop; publishers may
+    run in the thread pool (sync endpoints and background tasks), so events
+    are handed over with call_soon_threadsafe.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Register a new subscriber. Must be called from the event loop.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def queue_depths(self) -> List[int]:
+        """
+        Pending events of every subscriber.
+        """
+        with self._lock:
+            return [queue.qsize() for _, queue in self._subscribers]
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._subscribers = [(loop, q) for loop, q in self._subscribers if q is not queue]
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> None:
+        """
+        Send an event to every subscriber. Safe to call from any thread.
+        """
+        event = {"type": event_type, "data": data}
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe(queue)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, event: Dict[str, Any]) -> None:
+        # Slow clients lose the oldest events instead of blocking publishers
+        if queue.full():
+            queue.get_nowait()
+            visit_events_dropped_total.inc()
+        queue.put_nowait(event)
+
+
+visit_events = VisitEventBroker()
+
+
+def visit_payload(visit: Visit) -> Dict[str, Any]:
+    """
+    Serialize a visit (with its client) the same way /visits/current does.
+    """
+    return VisitWithClient.model_validate(visit).model_dump(mode="json")
+
+
+def publish_entry(visit: Visit) -> None:
+    visit_events.publish("entry", visit_payload(visit))
+
+
+def publish_exit(visit: Visit) -> None:
+    visit_events.publish("exit", {
+        "id": visit.id,
+        "client_id": visit.client_id,
+        "exit_time": visit.exit_time.isoformat() if visit.exit_time else None
+    })
+
+
+def publish_recommendations(visit: Visit, recommendations: List[Dict[str, Any]]) -> None:
+    visit_events.publish("recommendation", {
+        "id": visit.id,
+        "client_id": visit.client_id,
+        "recommendations": recommendations
+    })
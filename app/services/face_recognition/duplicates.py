@@ -0,0 +1,261 @@
+"""
+Duplicate identity detection over the face gallery.
+
+The same person registered twice shows up as two clients whose face
+encodings are closer to each other than to anybody else. The job compares
+every encoding with every other one blockwise (block x block distance
+matrices, so memory stays bounded however large the gallery is) and
+reports client pairs with encodings within DUPLICATE_MAX_DISTANCE.
+
+    python -m app.services.face_recognition.duplicates --output duplicates.json
+    python -m app.services.face_recognition.duplicates --merge 12 345
+
+merge_clients() folds one client into another; it is also exposed as
+POST /api/clients/{survivor_id}/merge.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.base import SessionLocal
+from app.models.models import Client, FaceEncoding, Visit
+from app.services.face_recognition.gallery import GallerySnapshot, face_gallery
+from app.services.visits.dwell import reassign_dwell_age
+
+logger = logging.getLogger(__name__)
+
+# Stricter than the recognition tolerance (0.6): a false merge is much
+# worse than a missed duplicate
+DUPLICATE_MAX_DISTANCE = float(os.getenv("DUPLICATE_MAX_DISTANCE", "0.4"))
+
+# Rows per block; a block pair needs a 4 * block_size^2 bytes distance matrix
+DUPLICATE_BLOCK_SIZE = int(os.getenv("DUPLICATE_BLOCK_SIZE", "1024"))
+
+# Fields copied from the merged client when the survivor has none
+_MERGED_FIELDS = ("gender", "age", "phone", "interests", "budget", "has_credit", "workplace", "purpose")
+
+
+class DuplicatePair(NamedTuple):
+    client_id: int
+    other_client_id: int
+    distance: float      # closest pair of encodings
+    matching_pairs: int  # encoding pairs within max_distance
+
+    @property
+    def similarity(self) -> float:
+        return 1.0 - self.distance
+
+
+def _augmented(matrix: np.ndarray, sq_norms: np.ndarray, side: int) -> np.ndarray:
+    """
+    Rows extended so that left @ right.T is the squared distance matrix:
+    [a, |a|^2, 1] . [-2b, 1, |b|^2] = |a|^2 + |b|^2 - 2ab, all in one matmul.
+    """
+    ones = np.ones((len(matrix), 1), dtype=np.float32)
+    norms = np.asarray(sq_norms, dtype=np.float32)[:, None]
+    if side == 0:
+        return np.hstack([matrix, norms, ones])
+    return np.hstack([-2.0 * matrix, ones, norms])
+
+
+def find_duplicate_pairs(
+    snapshot: GallerySnapshot,
+    max_distance: float = DUPLICATE_MAX_DISTANCE,
+    block_size: int = DUPLICATE_BLOCK_SIZE
+) -> List[DuplicatePair]:
+    """
+    All pairs of different clients with at least one pair of encodings
+    within max_distance, closest first.
+    """
+    count = len(snapshot)
+    client_ids = np.asarray(snapshot.client_ids)
+    sq_norms = np.asarray(snapshot.sq_norms)
+    limit = np.float32(max_distance * max_distance)
+
+    # (low client id << 32 | high client id) -> [min squared distance, pair count]
+    found: Dict[int, List[float]] = {}
+    for start in range(0, count, block_size):
+        block = _augmented(snapshot.matrix[start:start + block_size], sq_norms[start:start + block_size], 0)
+        block_clients = client_ids[start:start + block_size]
+
+        # Upper triangle only: block pairs (i, j) with j >= i
+        for other_start in range(start, count, block_size):
+            other = _augmented(
+                snapshot.matrix[other_start:other_start + block_size], sq_norms[other_start:other_start + block_size], 1
+            )
+            sq_distances = block @ other.T
+
+            rows, columns = np.nonzero(sq_distances <= limit)
+            if other_start == start:
+                upper = columns > rows
+                rows, columns = rows[upper], columns[upper]
+            first = block_clients[rows]
+            second = client_ids[other_start + columns]
+            different = first != second
+            if not different.any():
+                continue
+
+            first, second = first[different], second[different]
+            keys = (np.minimum(first, second) << 32) | np.maximum(first, second)
+            distances = sq_distances[rows[different], columns[different]]
+
+            order = np.argsort(keys, kind="stable")
+            keys, distances = keys[order], distances[order]
+            unique_keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+            minimums = np.minimum.reduceat(distances, starts)
+            for key, minimum, pairs in zip(unique_keys.tolist(), minimums.tolist(), counts.tolist()):
+                entry = found.get(key)
+                if entry is None:
+                    found[key] = [minimum, pairs]
+                else:
+                    entry[0] = min(entry[0], minimum)
+                    entry[1] += pairs
+
+    duplicates = [
+        DuplicatePair(key >> 32, key & 0xFFFFFFFF, float(np.sqrt(max(minimum, 0.0))), pairs)
+        for key, (minimum, pairs) in found.items()
+    ]
+    duplicates.sort(key=lambda pair: (pair.distance, pair.client_id, pair.other_client_id))
+    return duplicates
+
+
+def duplicate_report(db: Session, pairs: List[DuplicatePair]) -> List[Dict[str, Any]]:
+    """
+    Pairs with both clients' details and the suggested survivor: the client
+    with more visits, the older one on a tie.
+    """
+    client_ids = {pair.client_id for pair in pairs} | {pair.other_client_id for pair in pairs}
+    if not client_ids:
+        return []
+
+    clients = {client.id: client for client in db.query(Client).filter(Client.id.in_(client_ids))}
+    encodings = dict(
+        db.query(FaceEncoding.client_id, func.count(FaceEncoding.id))
+        .filter(FaceEncoding.client_id.in_(client_ids)).group_by(FaceEncoding.client_id)
+    )
+    visits = dict(
+        db.query(Visit.client_id, func.count(Visit.id))
+        .filter(Visit.client_id.in_(client_ids)).group_by(Visit.client_id)
+    )
+
+    def describe(client_id: int) -> Dict[str, Any]:
+        client = clients[client_id]
+        return {
+            "id": client.id,
+            "name": f"{client.first_name} {client.last_name}",
+            "phone": client.phone,
+            "created_at": client.created_at.isoformat() if client.created_at else None,
+            "encodings": encodings.get(client_id, 0),
+            "visits": visits.get(client_id, 0),
+        }
+
+    report = []
+    for pair in pairs:
+        # Deleted since the snapshot was published
+        if pair.client_id not in clients or pair.other_client_id not in clients:
+            continue
+        first, second = describe(pair.client_id), describe(pair.other_client_id)
+        survivor, duplicate = sorted((first, second), key=lambda client: (-client["visits"], client["id"]))
+        report.append({
+            "distance": round(pair.distance, 4),
+            "similarity": round(pair.similarity, 4),
+            "matching_pairs": pair.matching_pairs,
+            "survivor": survivor,
+            "duplicate": duplicate,
+        })
+    return report
+
+
+def merge_clients(db: Session, survivor_id: int, duplicate_id: int) -> Client:
+    """
+    Fold the duplicate client into the survivor: face encodings and visits
+    are re-pointed, empty survivor fields are filled from the duplicate and
+    the duplicate is deleted.
+
+    Raises:
+        ValueError: if both ids are the same
+        LookupError: if either client does not exist
+    """
+    if survivor_id == duplicate_id:
+        raise ValueError("Cannot merge a client into itself")
+    survivor = db.query(Client).filter(Client.id == survivor_id).first()
+    duplicate = db.query(Client).filter(Client.id == duplicate_id).first()
+    if not survivor or not duplicate:
+        raise LookupError("Client not found")
+
+    old_survivor_age = survivor.age
+    for field in _MERGED_FIELDS:
+        if getattr(survivor, field) in (None, "") and getattr(duplicate, field) not in (None, ""):
+            setattr(survivor, field, getattr(duplicate, field))
+
+    # Row by row, so the change feed names the moved encodings and other
+    # workers refresh just those gallery rows
+    encodings = db.query(FaceEncoding).filter(FaceEncoding.client_id == duplicate_id).all()
+    for encoding in encodings:
+        encoding.client_id = survivor_id
+    # The survivor's age may have been filled from the duplicate: its own
+    # visits move first, then the duplicate's join them in the same bucket
+    reassign_dwell_age(db, survivor_id, old_survivor_age, survivor.age)
+    reassign_dwell_age(db, duplicate_id, duplicate.age, survivor.age)
+    db.query(Visit).filter(Visit.client_id == duplicate_id).update(
+        {Visit.client_id: survivor_id}, synchronize_session=False
+    )
+    db.flush()
+
+    # Reload the (now empty) collections so the delete cascade does not
+    # take the moved rows with it
+    db.expire(duplicate, ["face_encodings", "visits"])
+    db.delete(duplicate)
+    db.commit()
+    db.refresh(survivor)
+
+    if face_gallery.loaded_snapshot is not None:
+        face_gallery.refresh_encodings(encoding.id for encoding in encodings)
+        face_gallery.remove_clients([duplicate_id])
+    logger.info("Merged client %d into %d: %d face encodings moved", duplicate_id, survivor_id, len(encodings))
+    return survivor
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Find (and merge) duplicate client identities")
+    parser.add_argument("--max-distance", type=float, default=DUPLICATE_MAX_DISTANCE)
+    parser.add_argument("--block-size", type=int, default=DUPLICATE_BLOCK_SIZE)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--merge", nargs=2, type=int, metavar=("SURVIVOR_ID", "DUPLICATE_ID"),
+                        help="merge DUPLICATE_ID into SURVIVOR_ID instead of searching")
+    args = parser.parse_args(argv)
+
+    snapshot = face_gallery.load()
+    db = SessionLocal()
+    try:
+        if args.merge:
+            survivor = merge_clients(db, *args.merge)
+            print(f"Merged client {args.merge[1]} into {survivor.id} ({survivor.first_name} {survivor.last_name})")
+            return
+
+        started = time.perf_counter()
+        pairs = find_duplicate_pairs(snapshot, args.max_distance, args.block_size)
+        report = duplicate_report(db, pairs)
+    finally:
+        db.close()
+
+    print(f"{len(snapshot)} face encodings compared in {time.perf_counter() - started:.1f}s, "
+          f"{len(report)} candidate duplicate pairs")
+    for entry in report:
+        survivor, duplicate = entry["survivor"], entry["duplicate"]
+        print(f"  {entry['similarity']:.3f}  #{survivor['id']} {survivor['name']} "
+              f"<- #{duplicate['id']} {duplicate['name']} ({entry['matching_pairs']} matching encodings)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
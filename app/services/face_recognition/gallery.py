@@ -0,0 +1,595 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+try:
+    import fcntl
+except ImportError:  # Windows: bitta worker, fayl qulfi kerak emas
+    fcntl = None
+
+from app.db.base import SessionLocal
+from app.db.changes import Change, change_feed
+from app.models.models import Client, FaceEncoding
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the memory-mapped gallery generations shared by all workers
+GALLERY_DIR = os.getenv("GALLERY_DIR", "./gallery_cache")
+
+ENCODING_DIM = 128
+
+# Older generations kept on disk for workers that have not switched yet
+KEEP_GENERATIONS = 2
+
+# Bumped whenever the on-disk layout changes; older snapshots are rebuilt
+SNAPSHOT_FORMAT_VERSION = 2
+
+# Verify the snapshot checksum when a process loads it at startup
+GALLERY_VERIFY_CHECKSUM = os.getenv("GALLERY_VERIFY_CHECKSUM", "1").lower() in ("1", "true", "yes")
+
+_CURRENT_FILE = "CURRENT"
+_LOCK_FILE = "publish.lock"
+
+# Array files of one generation, in checksum order
+_PARTS = ("matrix", "sq_norms", "encoding_ids", "client_ids", "client_names")
+
+
+class GallerySnapshotError(Exception):
+    """
+    Raised when a generation on disk is missing, from an older format or corrupt.
+    """
+
+
+class GallerySnapshot:
+    """
+    Immutable view of one gallery generation.
+
+    Arrays are memory-mapped read-only from the generation files, so every
+    worker process shares the same physical pages.
+    """
+
+    def __init__(
+        self,
+        generation: int,
+        matrix: np.ndarray,
+        sq_norms: np.ndarray,
+        encoding_ids: np.ndarray,
+        client_ids: np.ndarray,
+        client_names: np.ndarray
+    ):
+        self.generation = generation
+        self.matrix = matrix              # (N, 128) float32
+        self.sq_norms = sq_norms          # (N,) float32, squared row norms
+        self.encoding_ids = encoding_ids  # (N,) int64, face_encodings.id
+        self.client_ids = client_ids      # (N,) int64, face_encodings.client_id
+        self.client_names = client_names  # (N,) fixed-width str, "first last"
+
+    @classmethod
+    def empty(cls) -> "GallerySnapshot":
+        return cls(
+            0,
+            np.empty((0, ENCODING_DIM), dtype=np.float32),
+            np.empty(0, dtype=np.float32),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype="<U1")
+        )
+
+    def __len__(self) -> int:
+        return len(self.encoding_ids)
+
+    @property
+    def high_water_mark(self) -> int:
+        """
+        Largest face_encodings.id contained in the snapshot.
+        """
+        return int(self.encoding_ids.max()) if len(self) else 0
+
+    def subset(self, keep: np.ndarray) -> "GallerySnapshot":
+        """
+        Return a snapshot with only the rows where keep is True.
+        """
+        return GallerySnapshot(
+            self.generation,
+            self.matrix[keep],
+            self.sq_norms[keep],
+            self.encoding_ids[keep],
+            self.client_ids[keep],
+            self.client_names[keep]
+        )
+
+    def arrays(self) -> dict:
+        return {part: getattr(self, part) for part in _PARTS}
+
+    def match(
+        self, face_encoding: Iterable[float], tolerance: float
+    ) -> Tuple[Optional[int], Optional[str], Optional[float]]:
+        """
+        Find the closest encoding within tolerance.
+
+        Returns:
+            Tuple of (client id, client name, face distance), all None if no match
+        """
+        if not len(self):
+            return None, None, None
+
+        probe = np.asarray(face_encoding, dtype=np.float32)
+        # |a - b|^2 = |a|^2 + |b|^2 - 2ab, without an (N, 128) temporary
+        sq_distances = self.sq_norms + np.dot(probe, probe) - 2.0 * (self.matrix @ probe)
+        best_index = int(np.argmin(sq_distances))
+        distance = float(np.sqrt(max(float(sq_distances[best_index]), 0.0)))
+
+        if distance < tolerance:
+            return int(self.client_ids[best_index]), str(self.client_names[best_index]), distance
+        return None, None, None
+
+
+def _load_array(path: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        return np.load(path)
+    except FileNotFoundError as e:
+        raise GallerySnapshotError(f"Missing gallery file: {path}") from e
+
+
+def _checksum(arrays: Iterable[np.ndarray]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        digest.update(str(array.dtype).encode())
+        digest.update(str(array.shape).encode())
+        # Memory-mapped arrays are hashed straight from the page cache
+        digest.update(np.ascontiguousarray(array).reshape(-1).view(np.uint8))
+    return digest.hexdigest()
+
+
+def _client_name(first_name: Optional[str], last_name: Optional[str]) -> str:
+    # Same format the detect endpoints used to build from the Client row
+    return f"{first_name} {last_name}" if first_name is not None else ""
+
+
+class SharedFaceGallery:
+    """
+    Face gallery published as memory-mapped files shared by all workers.
+
+    Each published generation is a set of .npy files; the CURRENT file names
+    the latest generation and is replaced atomically, so a worker either sees
+    the old or the new snapshot, never a partial one. Workers compare the
+    generation on every lookup and re-map when it changes.
+
+    Generations survive restarts: each one carries a manifest (format
+    version, row count, high-water mark, checksum), so a new process maps
+    the last snapshot and only reads the encodings added since then.
+    """
+
+    def __init__(self, directory: str = GALLERY_DIR):
+        self.directory = directory
+        self._snapshot: Optional[GallerySnapshot] = None
+        self._lock = threading.Lock()
+
+    # Reading
+
+    @property
+    def loaded_snapshot(self) -> Optional[GallerySnapshot]:
+        """
+        Snapshot this process has mapped, without loading one (None before load()).
+        """
+        return self._snapshot
+
+    def current(self) -> GallerySnapshot:
+        """
+        Return the latest published snapshot, publishing one from the
+        database first if none exists yet.
+        """
+        generation = self._read_current_generation()
+        snapshot = self._snapshot
+        if snapshot is not None and generation == snapshot.generation:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is None or self._snapshot.generation != generation:
+                self._snapshot = self._load_current(generation)
+            return self._snapshot
+
+    def _load_current(self, generation: Optional[int]) -> GallerySnapshot:
+        """
+        Map the generation CURRENT names. One removed between reading CURRENT
+        and mapping it was superseded by newer publishes, so CURRENT is read
+        again; the gallery is only rebuilt from the database when no readable
+        generation is left.
+        """
+        while generation is not None:
+            try:
+                return self._load_generation(generation)
+            except GallerySnapshotError:
+                newer = self._read_current_generation()
+                if newer == generation:
+                    break
+                generation = newer
+        # Under the publish lock: rebuilds only if the latest is still unreadable
+        self._publish(lambda snapshot: snapshot)
+        return self._load_generation(self._read_current_generation())
+
+    def match(
+        self, face_encoding: Iterable[float], tolerance: float
+    ) -> Tuple[Optional[int], Optional[str], Optional[float]]:
+        return self.current().match(face_encoding, tolerance)
+
+    def load(self, verify: bool = GALLERY_VERIFY_CHECKSUM) -> GallerySnapshot:
+        """
+        Map the last published snapshot at startup and catch up with the
+        database. Only encodings newer than the snapshot's high-water mark
+        are read; a missing, outdated or corrupt snapshot is rebuilt.
+
+        Does nothing if this process already loaded the gallery (e.g. the
+        server preloaded it before forking workers).
+        """
+        if self._snapshot is not None:
+            return self.current()
+
+        started = time.perf_counter()
+        with self._lock:
+            generation = self._read_current_generation()
+            try:
+                if generation is None:
+                    raise GallerySnapshotError("No gallery snapshot published yet")
+                snapshot = self._load_generation(generation, verify=verify)
+                if self._count_rows(up_to=snapshot.high_water_mark) != len(snapshot):
+                    # Encodings were deleted while no server was running
+                    raise GallerySnapshotError("Gallery snapshot is out of date")
+            except GallerySnapshotError as e:
+                logger.warning("Rebuilding face gallery: %s", e)
+                self._publish(self._build_from_db)
+            else:
+                self._publish(self._append_new_rows)
+
+            self._snapshot = self._load_generation(self._read_current_generation())
+
+        logger.info(
+            "Face gallery generation %d loaded (%d encodings) in %.3fs",
+            self._snapshot.generation, len(self._snapshot), time.perf_counter() - started
+        )
+        return self._snapshot
+
+    # Publishing
+
+    def sync(self) -> GallerySnapshot:
+        """
+        Append encodings newer than the current snapshot (e.g. after an
+        enrollment) and publish them as a new generation.
+        """
+        with self._lock:
+            self._publish(self._append_new_rows)
+            self._snapshot = self._load_generation(self._read_current_generation())
+            return self._snapshot
+
+    def remove_clients(self, client_ids: Iterable[int]) -> GallerySnapshot:
+        """
+        Publish a generation without the given clients' encodings.
+        """
+        client_ids = np.fromiter(client_ids, dtype=np.int64)
+
+        def without_clients(snapshot: GallerySnapshot) -> GallerySnapshot:
+            keep = ~np.isin(snapshot.client_ids, client_ids)
+            return snapshot.subset(keep) if not keep.all() else snapshot
+
+        with self._lock:
+            self._publish(without_clients)
+            self._snapshot = self._load_generation(self._read_current_generation())
+            return self._snapshot
+
+    def remove_encodings(self, encoding_ids: Iterable[int]) -> GallerySnapshot:
+        """
+        Publish a generation without the given face_encodings rows.
+        """
+        encoding_ids = np.fromiter(encoding_ids, dtype=np.int64)
+
+        def without_encodings(snapshot: GallerySnapshot) -> GallerySnapshot:
+            keep = ~np.isin(snapshot.encoding_ids, encoding_ids)
+            return snapshot.subset(keep) if not keep.all() else snapshot
+
+        with self._lock:
+            self._publish(without_encodings)
+            self._snapshot = self._load_generation(self._read_current_generation())
+            return self._snapshot
+
+    def rename_client(self, client_id: int, name: str) -> GallerySnapshot:
+        """
+        Publish a generation with the client's stored name replaced.
+        """
+        def renamed(snapshot: GallerySnapshot) -> GallerySnapshot:
+            rows = snapshot.client_ids == client_id
+            if not rows.any() or (snapshot.client_names[rows] == name).all():
+                return snapshot
+            names = np.array(snapshot.client_names, dtype=np.result_type(snapshot.client_names, np.array([name])))
+            names[rows] = name
+            return GallerySnapshot(
+                snapshot.generation,
+                snapshot.matrix,
+                snapshot.sq_norms,
+                snapshot.encoding_ids,
+                snapshot.client_ids,
+                names
+            )
+
+        with self._lock:
+            self._publish(renamed)
+            self._snapshot = self._load_generation(self._read_current_generation())
+            return self._snapshot
+
+    def refresh_encodings(self, encoding_ids: Iterable[int]) -> GallerySnapshot:
+        """
+        Publish a generation with the given face_encodings rows read again
+        from the database, e.g. after a merge re-pointed them to another
+        client. Rows that no longer exist are dropped.
+        """
+        encoding_ids = sorted(set(encoding_ids))
+
+        def refreshed(snapshot: GallerySnapshot) -> GallerySnapshot:
+            rows = self._read_rows(only_ids=encoding_ids)
+            stale = np.isin(snapshot.encoding_ids, encoding_ids)
+            order = np.argsort(snapshot.encoding_ids[stale], kind="stable")
+            if (np.array_equal(snapshot.encoding_ids[stale][order], rows[0])
+                    and np.array_equal(snapshot.client_ids[stale][order], rows[1])
+                    and np.array_equal(snapshot.client_names[stale][order], rows[2])):
+                # Already published by the writer
+                return snapshot
+            return self._concatenate(snapshot.subset(~stale), *rows)
+
+        with self._lock:
+            self._publish(refreshed)
+            self._snapshot = self._load_generation(self._read_current_generation())
+            return self._snapshot
+
+    def rebuild(self) -> GallerySnapshot:
+        """
+        Rebuild the whole gallery from the face_encodings table.
+        """
+        with self._lock:
+            self._publish(self._build_from_db)
+            self._snapshot = self._load_generation(self._read_current_generation())
+            return self._snapshot
+
+    def apply_changes(self, changes: List[Change]) -> None:
+        """
+        Bring the gallery up to date with writes made by other processes
+        (change feed listener). Writers that already published leave nothing
+        to do, so the resulting publishes are no-ops.
+
+        Processes that never loaded the gallery (api-only role) ignore the
+        feed; load() catches up from the database anyway.
+        """
+        if self._snapshot is None:
+            return
+        encodings = [change for change in changes if change.table == "face_encodings"]
+        clients = [change for change in changes if change.table == "clients"]
+        if not encodings and not clients:
+            return
+
+        # Bulk statements do not say which rows they touched
+        if any(change.row_id is None for change in encodings + clients):
+            self.rebuild()
+            return
+
+        deleted_encodings = [c.row_id for c in encodings if c.operation == "delete"]
+        if deleted_encodings:
+            self.remove_encodings(deleted_encodings)
+        # Re-pointed to another client (merge)
+        updated_encodings = {c.row_id for c in encodings if c.operation == "update"} - set(deleted_encodings)
+        if updated_encodings:
+            self.refresh_encodings(updated_encodings)
+        deleted_clients = [c.row_id for c in clients if c.operation == "delete"]
+        if deleted_clients:
+            self.remove_clients(deleted_clients)
+        if any(c.operation == "insert" for c in encodings):
+            self.sync()
+
+        renamed = {c.row_id for c in clients if c.operation == "update"} - set(deleted_clients)
+        if renamed:
+            db = SessionLocal()
+            try:
+                rows = db.execute(
+                    select(Client.id, Client.first_name, Client.last_name).where(Client.id.in_(renamed))
+                ).all()
+            finally:
+                db.close()
+            for client_id, first_name, last_name in rows:
+                self.rename_client(client_id, _client_name(first_name, last_name))
+
+    def _publish(self, update) -> None:
+        """
+        Apply update(latest snapshot) -> new snapshot and publish the result
+        as the next generation, serialized across processes by a file lock.
+        Nothing is written when update returns the snapshot unchanged.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._publish_lock():
+            generation = self._read_current_generation()
+            try:
+                if generation is None:
+                    raise GallerySnapshotError("No gallery snapshot published yet")
+                latest = self._load_generation(generation)
+            except GallerySnapshotError:
+                # Nothing usable on disk; start from the database
+                latest, update = None, self._build_from_db
+
+            updated = update(latest or GallerySnapshot.empty())
+            if updated is latest:
+                return
+
+            new_generation = (generation or 0) + 1
+            self._write_generation(new_generation, updated)
+            self._write_current_generation(new_generation)
+            self._remove_old_generations(new_generation)
+
+    def _append_new_rows(self, snapshot: GallerySnapshot) -> GallerySnapshot:
+        return self._concatenate(snapshot, *self._read_rows(after_id=snapshot.high_water_mark))
+
+    @staticmethod
+    def _concatenate(
+        snapshot: GallerySnapshot,
+        encoding_ids: np.ndarray,
+        client_ids: np.ndarray,
+        client_names: np.ndarray,
+        matrix: np.ndarray
+    ) -> GallerySnapshot:
+        if not len(encoding_ids):
+            return snapshot
+
+        return GallerySnapshot(
+            snapshot.generation,
+            np.concatenate([snapshot.matrix, matrix]),
+            np.concatenate([snapshot.sq_norms, np.einsum("ij,ij->i", matrix, matrix)]),
+            np.concatenate([snapshot.encoding_ids, encoding_ids]),
+            np.concatenate([snapshot.client_ids, client_ids]),
+            np.concatenate([snapshot.client_names, client_names])
+        )
+
+    def _build_from_db(self, snapshot: GallerySnapshot) -> GallerySnapshot:
+        # The previous snapshot is ignored; everything is read again
+        return self._append_new_rows(GallerySnapshot.empty())
+
+    def _read_rows(
+        self, after_id: int = 0, only_ids: Optional[List[int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        query = (
+            select(
+                FaceEncoding.id,
+                FaceEncoding.client_id,
+                FaceEncoding.encoding_vector,
+                Client.first_name,
+                Client.last_name
+            )
+            .outerjoin(Client, Client.id == FaceEncoding.client_id)
+            .where(FaceEncoding.id > after_id)
+            .order_by(FaceEncoding.id)
+        )
+        if only_ids is not None:
+            query = query.where(FaceEncoding.id.in_(only_ids))
+
+        db = SessionLocal()
+        try:
+            rows = db.execute(query).all()
+        finally:
+            db.close()
+
+        encoding_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        client_ids = np.array([row[1] for row in rows], dtype=np.int64)
+        client_names = np.array([_client_name(row[3], row[4]) for row in rows], dtype=np.str_)
+        matrix = np.array(
+            [json.loads(row[2]) for row in rows], dtype=np.float32
+        ).reshape(len(rows), ENCODING_DIM)
+        return encoding_ids, client_ids, client_names, matrix
+
+    def _count_rows(self, up_to: int) -> int:
+        db = SessionLocal()
+        try:
+            return db.execute(
+                select(func.count(FaceEncoding.id)).where(FaceEncoding.id <= up_to)
+            ).scalar_one()
+        finally:
+            db.close()
+
+    # Files
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _generation_path(self, generation: int, part: str) -> str:
+        return self._path(f"gallery-{generation:08d}.{part}.npy")
+
+    def _manifest_path(self, generation: int) -> str:
+        return self._path(f"gallery-{generation:08d}.meta.json")
+
+    def _read_current_generation(self) -> Optional[int]:
+        try:
+            with open(self._path(_CURRENT_FILE)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_current_generation(self, generation: int) -> None:
+        tmp_path = self._path(f"{_CURRENT_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self._path(_CURRENT_FILE))
+
+    def _write_generation(self, generation: int, snapshot: GallerySnapshot) -> None:
+        arrays = snapshot.arrays()
+        for part, array in arrays.items():
+            path = self._generation_path(generation, part)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(path + ".tmp", path)
+
+        # The manifest is written last: a generation without one is incomplete
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "generation": generation,
+            "count": len(snapshot),
+            "dim": ENCODING_DIM,
+            "high_water_mark": snapshot.high_water_mark,
+            "checksum": _checksum(arrays[part] for part in _PARTS),
+            "created_at": time.time(),
+        }
+        path = self._manifest_path(generation)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _load_generation(self, generation: int, verify: bool = False) -> GallerySnapshot:
+        try:
+            with open(self._manifest_path(generation)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError) as e:
+            raise GallerySnapshotError(f"Generation {generation} has no readable manifest") from e
+
+        if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION or manifest.get("dim") != ENCODING_DIM:
+            raise GallerySnapshotError(f"Generation {generation} uses an unsupported format")
+
+        snapshot = GallerySnapshot(
+            generation,
+            *(_load_array(self._generation_path(generation, part)) for part in _PARTS)
+        )
+        if len(snapshot) != manifest["count"] or snapshot.matrix.shape != (len(snapshot), ENCODING_DIM):
+            raise GallerySnapshotError(f"Generation {generation} does not match its manifest")
+        if verify and _checksum(snapshot.arrays()[part] for part in _PARTS) != manifest["checksum"]:
+            raise GallerySnapshotError(f"Generation {generation} failed checksum verification")
+        return snapshot
+
+    def _remove_old_generations(self, newest: int) -> None:
+        for name in os.listdir(self.directory):
+            if not name.startswith("gallery-"):
+                continue
+            try:
+                generation = int(name.split("-")[1].split(".")[0])
+            except ValueError:
+                continue
+            if generation <= newest - KEEP_GENERATIONS:
+                # Workers that still map the file keep their pages until they re-map
+                with contextlib.suppress(OSError):
+                    os.remove(self._path(name))
+
+    @contextlib.contextmanager
+    def _publish_lock(self):
+        with open(self._path(_LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+face_gallery = SharedFaceGallery()
+change_feed.add_listener(face_gallery.apply_changes)
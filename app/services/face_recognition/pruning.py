@@ -0,0 +1,185 @@
+"""
+Gallery maintenance: keep at most FACE_MAX_ENCODINGS_PER_CLIENT good and
+diverse face encodings per client (see quality.select_encodings).
+
+    python -m app.services.face_recognition.pruning --rescore --dry-run
+    python -m app.services.face_recognition.pruning
+
+--rescore first measures the quality of encodings saved before quality was
+recorded, from their enrollment images (where the file still exists); with
+--dry-run the scores are only used for the report, not saved.
+Enrollment images of pruned encodings are left on disk.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db.base import SessionLocal
+from app.models.models import FaceEncoding
+from app.services.face_recognition.gallery import face_gallery
+from app.services.face_recognition.quality import (
+    FACE_MAX_ENCODINGS_PER_CLIENT, FACE_MIN_DIVERSITY_DISTANCE, FACE_MIN_QUALITY, select_encodings
+)
+from app.services.face_recognition.recognition import FaceRecognitionService
+from app.services.metrics.registry import metrics
+
+logger = logging.getLogger(__name__)
+
+face_encodings_pruned_total = metrics.counter(
+    "face_encodings_pruned_total", "Face encodings removed by the gallery quality policy"
+)
+
+
+def prune_client_encodings(
+    db: Session,
+    client_ids: Iterable[int],
+    max_count: int = FACE_MAX_ENCODINGS_PER_CLIENT,
+    min_quality: float = FACE_MIN_QUALITY,
+    min_distance: float = FACE_MIN_DIVERSITY_DISTANCE,
+    dry_run: bool = False,
+    qualities: Optional[Dict[int, float]] = None,
+    update_gallery: bool = True
+) -> List[int]:
+    """
+    Apply the encoding policy to the given clients and delete the encodings
+    it drops. Returns the dropped encoding ids.
+
+    qualities overrides the saved quality per encoding id (unsaved scores of
+    a dry run). With update_gallery=False the caller removes the dropped ids
+    from the gallery.
+    """
+    qualities = qualities or {}
+    rows: Dict[int, List[FaceEncoding]] = {}
+    for encoding in db.query(FaceEncoding).filter(FaceEncoding.client_id.in_(list(client_ids))):
+        rows.setdefault(encoding.client_id, []).append(encoding)
+
+    dropped = []
+    for encodings in rows.values():
+        kept = set(select_encodings(
+            [(e.id, json.loads(e.encoding_vector), qualities.get(e.id, e.quality)) for e in encodings],
+            max_count, min_quality, min_distance
+        ))
+        dropped.extend(e for e in encodings if e.id not in kept)
+
+    dropped_ids = [encoding.id for encoding in dropped]
+    if dry_run or not dropped:
+        return dropped_ids
+
+    # Row by row, so other workers' galleries remove exactly these ids
+    for encoding in dropped:
+        db.delete(encoding)
+    db.commit()
+    face_encodings_pruned_total.inc(len(dropped_ids))
+    if update_gallery and face_gallery.loaded_snapshot is not None:
+        face_gallery.remove_encodings(dropped_ids)
+    return dropped_ids
+
+
+def rescore_encodings(db: Session, batch_size: int = 100, dry_run: bool = False) -> Dict[int, float]:
+    """
+    Measure the quality of encodings that have none, from their enrollment
+    image (the first face found, as at enrollment). Returns the scores by
+    encoding id; with dry_run they are not saved.
+    """
+    service = FaceRecognitionService()
+    scored: Dict[int, float] = {}
+    last_id = 0
+    while True:
+        encodings = (
+            db.query(FaceEncoding)
+            .filter(FaceEncoding.quality.is_(None), FaceEncoding.id > last_id)
+            .order_by(FaceEncoding.id).limit(batch_size).all()
+        )
+        if not encodings:
+            return scored
+        for encoding in encodings:
+            if not encoding.image_path or not os.path.exists(encoding.image_path):
+                continue
+            try:
+                _, quality = service.encode_face_with_quality(encoding.image_path)
+            except ValueError:
+                # No face detected any more: worst quality
+                scored[encoding.id] = 0.0
+                if not dry_run:
+                    encoding.quality = 0.0
+                continue
+            scored[encoding.id] = quality.score
+            if not dry_run:
+                encoding.quality = quality.score
+                encoding.sharpness = quality.sharpness
+                encoding.face_size = quality.face_size
+                encoding.yaw = quality.yaw
+        if not dry_run:
+            db.commit()
+        last_id = encodings[-1].id
+
+
+def prune_gallery(
+    db: Session,
+    max_count: int = FACE_MAX_ENCODINGS_PER_CLIENT,
+    min_quality: float = FACE_MIN_QUALITY,
+    min_distance: float = FACE_MIN_DIVERSITY_DISTANCE,
+    batch_size: int = 500,
+    dry_run: bool = False,
+    qualities: Optional[Dict[int, float]] = None
+) -> Dict[str, int]:
+    """
+    Apply the encoding policy to every client with more than one encoding
+    (a single encoding is always kept), batch_size clients at a time. The
+    gallery publishes one new generation at the end, not one per batch.
+    """
+    client_ids = [
+        row[0] for row in db.query(FaceEncoding.client_id)
+        .group_by(FaceEncoding.client_id).having(func.count(FaceEncoding.id) > 1)
+    ]
+    total_before = db.query(func.count(FaceEncoding.id)).scalar()
+
+    dropped: List[int] = []
+    for start in range(0, len(client_ids), batch_size):
+        dropped.extend(prune_client_encodings(
+            db, client_ids[start:start + batch_size], max_count, min_quality, min_distance, dry_run,
+            qualities, update_gallery=False
+        ))
+    if dropped and not dry_run and face_gallery.loaded_snapshot is not None:
+        face_gallery.remove_encodings(dropped)
+    return {"clients_checked": len(client_ids), "encodings_before": total_before, "encodings_dropped": len(dropped)}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Prune the face gallery to the encoding quality policy")
+    parser.add_argument("--max-per-client", type=int, default=FACE_MAX_ENCODINGS_PER_CLIENT)
+    parser.add_argument("--min-quality", type=float, default=FACE_MIN_QUALITY)
+    parser.add_argument("--min-distance", type=float, default=FACE_MIN_DIVERSITY_DISTANCE)
+    parser.add_argument("--rescore", action="store_true", help="score encodings without quality first")
+    parser.add_argument("--dry-run", action="store_true", help="report only, delete nothing")
+    args = parser.parse_args(argv)
+
+    face_gallery.load()
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        scores = {}
+        if args.rescore:
+            scores = rescore_encodings(db, dry_run=args.dry_run)
+            print(f"Scored {len(scores)} encodings from their images" + (" (not saved)" if args.dry_run else ""))
+        result = prune_gallery(
+            db, args.max_per_client, args.min_quality, args.min_distance, dry_run=args.dry_run,
+            qualities=scores if args.dry_run else None
+        )
+    finally:
+        db.close()
+
+    action = "would drop" if args.dry_run else "dropped"
+    print(f"{result['clients_checked']} clients with several encodings checked in "
+          f"{time.perf_counter() - started:.1f}s: {action} {result['encodings_dropped']} "
+          f"of {result['encodings_before']} encodings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Side (px) the face crop is resized to before measuring sharpness, so faces
+# of different sizes are comparable
+QUALITY_CROP_SIZE = 112
+
+# A metric at or above its "good" value scores 1.0
+FACE_QUALITY_GOOD_SHARPNESS = float(os.getenv("FACE_QUALITY_GOOD_SHARPNESS", "100"))
+FACE_QUALITY_GOOD_SIZE = int(os.getenv("FACE_QUALITY_GOOD_SIZE", "80"))
+# Nose offset from the eye midpoint, in eye distances, that scores 0.0 (profile)
+FACE_QUALITY_MAX_YAW = float(os.getenv("FACE_QUALITY_MAX_YAW", "0.5"))
+
+# Gallery policy: at most this many encodings per client ...
+FACE_MAX_ENCODINGS_PER_CLIENT = int(os.getenv("FACE_MAX_ENCODINGS_PER_CLIENT", "5"))
+# ... each at least this good (the client's best one is always kept) ...
+FACE_MIN_QUALITY = float(os.getenv("FACE_MIN_QUALITY", "0.3"))
+# ... and no closer than this to a better one (it would add no recall)
+FACE_MIN_DIVERSITY_DISTANCE = float(os.getenv("FACE_MIN_DIVERSITY_DISTANCE", "0.2"))
+
+# Ranking of encodings saved before quality was measured
+UNKNOWN_QUALITY = 0.5
+
+# Live pre-encode gate defaults (0 disables a check); override per endpoint
+# with e.g. FACE_GATE_DETECT_ENTRY_MIN_SIZE
+FACE_GATE_MIN_SIZE = int(os.getenv("FACE_GATE_MIN_SIZE", "50"))
+FACE_GATE_MIN_SHARPNESS = float(os.getenv("FACE_GATE_MIN_SHARPNESS", "20"))
+
+
+class FaceQuality(NamedTuple):
+    sharpness: float        # variance of the Laplacian of the face crop
+    face_size: int          # shorter side of the face box, px
+    yaw: Optional[float]    # signed nose offset in eye distances, None without landmarks
+    score: float            # 0 (useless) .. 1 (sharp, large, frontal)
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        return {
+            "sharpness": round(self.sharpness, 1),
+            "face_size": self.face_size,
+            "yaw": round(self.yaw, 3) if self.yaw is not None else None,
+            "score": round(self.score, 3),
+        }
+
+
+class FaceGate(NamedTuple):
+    """
+    Cheap checks a detected face must pass before it is encoded and
+    matched; tiny and blurred faces rarely match but cost as much.
+    """
+    min_size: int
+    min_sharpness: float
+
+
+def face_gate(endpoint: str) -> FaceGate:
+    """
+    Gate thresholds of an endpoint ("detect-entry" reads
+    FACE_GATE_DETECT_ENTRY_MIN_SIZE / _MIN_SHARPNESS, then the defaults).
+    """
+    prefix = "FACE_GATE_" + endpoint.upper().replace("-", "_")
+    return FaceGate(
+        min_size=int(os.getenv(prefix + "_MIN_SIZE", FACE_GATE_MIN_SIZE)),
+        min_sharpness=float(os.getenv(prefix + "_MIN_SHARPNESS", FACE_GATE_MIN_SHARPNESS)),
+    )
+
+
+class SkippedFace(NamedTuple):
+    face_location: Tuple[int, int, int, int]
+    reason: str                 # too_small, blurry
+    face_size: int
+    sharpness: Optional[float]  # None when the size check failed first
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "face_location": list(self.face_location),
+            "reason": self.reason,
+            "face_size": self.face_size,
+            "sharpness": round(self.sharpness, 1) if self.sharpness is not None else None,
+        }
+
+
+class FaceSkippedError(ValueError):
+    """
+    Raised when faces were found but none passed the quality gate.
+    """
+
+    def __init__(self, skipped: List[SkippedFace]):
+        super().__init__(f"{len(skipped)} face(s) failed the quality gate: "
+                         + ", ".join(face.reason for face in skipped))
+        self.skipped = skipped
+
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    """
+    Sharpness of a grayscale image: variance of its 4-neighbour Laplacian
+    (same as cv2.Laplacian with ksize=1). Blur and darkness both lower it.
+    """
+    gray = np.asarray(gray, dtype=np.float32)
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    laplacian = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def face_box_size(face_location: Sequence[int]) -> int:
+    top, right, bottom, left = face_location
+    return int(min(bottom - top, right - left))
+
+
+def landmark_yaw(landmarks: Dict[str, List[Tuple[int, int]]]) -> Optional[float]:
+    """
+    Horizontal head turn from face_recognition landmarks (5-point "small"
+    or 68-point model): how far the nose tip is from the midpoint of the
+    eyes, in eye distances. About 0 for a frontal face.
+    """
+    try:
+        left_eye = np.mean(landmarks["left_eye"], axis=0)
+        right_eye = np.mean(landmarks["right_eye"], axis=0)
+        nose = np.mean(landmarks["nose_tip"], axis=0)
+    except (KeyError, ValueError):
+        return None
+    eye_distance = float(np.linalg.norm(right_eye - left_eye))
+    if eye_distance == 0:
+        return None
+    return float((nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance)
+
+
+def score_face(sharpness: float, face_size: int, yaw: Optional[float]) -> FaceQuality:
+    """
+    Combine the metrics into one score. Roll is not scored: the encoder
+    aligns the face on its landmarks, but cannot undo a turned head.
+    """
+    score = min(sharpness / FACE_QUALITY_GOOD_SHARPNESS, 1.0) * min(face_size / FACE_QUALITY_GOOD_SIZE, 1.0)
+    if yaw is not None:
+        score *= max(0.0, 1.0 - abs(yaw) / FACE_QUALITY_MAX_YAW)
+    return FaceQuality(sharpness, face_size, yaw, score)
+
+
+def select_encodings(
+    candidates: Sequence[Tuple[int, np.ndarray, Optional[float]]],
+    max_count: int = FACE_MAX_ENCODINGS_PER_CLIENT,
+    min_quality: float = FACE_MIN_QUALITY,
+    min_distance: float = FACE_MIN_DIVERSITY_DISTANCE
+) -> List[int]:
+    """
+    Ids of one client's encodings to keep, from (id, vector, quality) rows:
+    best quality first (newest on a tie), skipping near-duplicates of an
+    already kept one, until max_count. The best encoding is always kept.
+    """
+    ranked = sorted(
+        candidates,
+        key=lambda row: (row[2] if row[2] is not None else UNKNOWN_QUALITY, row[0]),
+        reverse=True
+    )
+    kept: List[int] = []
+    kept_vectors: List[np.ndarray] = []
+    for encoding_id, vector, quality in ranked:
+        if len(kept) == max_count:
+            break
+        quality = quality if quality is not None else UNKNOWN_QUALITY
+        if kept and quality < min_quality:
+            break
+        vector = np.asarray(vector, dtype=np.float32)
+        if kept_vectors and float(np.min(np.linalg.norm(np.stack(kept_vectors) - vector, axis=1))) < min_distance:
+            continue
+        kept.append(encoding_id)
+        kept_vectors.append(vector)
+    return kept
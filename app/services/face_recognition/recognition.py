@@ -1,17 +1,48 @@
-import face_recognition
 import numpy as np
 import os
 import json
-import cv2
+import asyncio
+import functools
 from typing import List, Tuple, Dict, Optional, Any
 from sqlalchemy.orm import Session
 
 from app.models.models import Client, FaceEncoding
+from app.services.face_recognition.gallery import SharedFaceGallery, face_gallery
+from app.services.face_recognition.quality import (
+    QUALITY_CROP_SIZE, FaceGate, FaceQuality, FaceSkippedError, SkippedFace,
+    face_box_size, landmark_yaw, laplacian_variance, score_face
+)
+from app.services.metrics.registry import recognition_stage_seconds
+
+
+# face_recognition (dlib and its models) and cv2 take seconds to import and a
+# lot of memory, so they are loaded on first use. Processes that only serve
+# CRUD or analytics never load them.
+@functools.lru_cache(maxsize=None)
+def load_face_recognition():
+    import face_recognition
+    return face_recognition
+
+
+@functools.lru_cache(maxsize=None)
+def load_cv2():
+    import cv2
+    return cv2
+
+
+def load_ml_libraries() -> None:
+    """
+    Import the recognition libraries now, e.g. in the gunicorn master before
+    forking so workers share them.
+    """
+    load_cv2()
+    load_face_recognition()
 
 
 class FaceRecognitionService:
-    def __init__(self, tolerance: float = 0.6):
+    def __init__(self, tolerance: float = 0.6, gallery: Optional[SharedFaceGallery] = None):
         self.tolerance = tolerance  # Lower is more strict
+        self.gallery = gallery or face_gallery
     
     def encode_face_from_image(self, image_path: str) -> List[float]:
         """
@@ -26,39 +57,184 @@ class FaceRecognitionService:
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image file not found: {image_path}")
             
-        image = face_recognition.load_image_file(image_path)
-        face_locations = face_recognition.face_locations(image)
+        face_recognition = load_face_recognition()
+        with recognition_stage_seconds.time(stage="load_image"):
+            image = face_recognition.load_image_file(image_path)
+        with recognition_stage_seconds.time(stage="detect"):
+            face_locations = face_recognition.face_locations(image)
         
         if not face_locations:
             raise ValueError("No faces found in the image")
             
         # Get the first face found
-        face_encoding = face_recognition.face_encodings(image, face_locations)[0]
+        with recognition_stage_seconds.time(stage="encode"):
+            face_encoding = face_recognition.face_encodings(image, face_locations)[0]
         return face_encoding.tolist()
     
-    def encode_face_from_frame(self, frame: np.ndarray) -> Tuple[List[float], List[int]]:
+    def encode_face_with_quality(self, image_path: str) -> Tuple[List[float], FaceQuality]:
+        """
+        Encode the first face of an enrollment image and measure its quality.
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            Tuple of (encoding list, face quality)
+        """
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"Image file not found: {image_path}")
+            
+        face_recognition = load_face_recognition()
+        with recognition_stage_seconds.time(stage="load_image"):
+            image = face_recognition.load_image_file(image_path)
+        with recognition_stage_seconds.time(stage="detect"):
+            face_locations = face_recognition.face_locations(image)
+        
+        if not face_locations:
+            raise ValueError("No faces found in the image")
+            
+        with recognition_stage_seconds.time(stage="encode"):
+            face_encoding = face_recognition.face_encodings(image, face_locations[:1])[0]
+        with recognition_stage_seconds.time(stage="quality"):
+            quality = self.measure_face_quality(image, face_locations[0])
+        return face_encoding.tolist(), quality
+    
+    def measure_face_quality(self, rgb_image: np.ndarray, face_location: Tuple[int, int, int, int]) -> FaceQuality:
+        """
+        Sharpness, size and head turn of one face of an RGB image.
+        """
+        face_recognition = load_face_recognition()
+        landmarks = face_recognition.face_landmarks(rgb_image, [face_location], model="small")
+        return score_face(
+            self.face_sharpness(rgb_image, face_location),
+            face_box_size(face_location),
+            landmark_yaw(landmarks[0]) if landmarks else None
+        )
+    
+    def face_sharpness(self, rgb_image: np.ndarray, face_location: Tuple[int, int, int, int]) -> float:
+        """
+        Laplacian variance of the face crop, resized to QUALITY_CROP_SIZE.
+        """
+        cv2 = load_cv2()
+        top, right, bottom, left = face_location
+        height, width = rgb_image.shape[:2]
+        crop = rgb_image[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+        if crop.size == 0:
+            return 0.0
+        gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+        gray = cv2.resize(gray, (QUALITY_CROP_SIZE, QUALITY_CROP_SIZE), interpolation=cv2.INTER_AREA)
+        return laplacian_variance(gray)
+    
+    def gate_faces(
+        self, rgb_image: np.ndarray, face_locations: List[Tuple[int, int, int, int]], gate: FaceGate
+    ) -> Tuple[List[Tuple[int, int, int, int]], List[SkippedFace]]:
+        """
+        Split detected faces into those worth encoding and those skipped
+        (too small, then too blurry). Sharpness is only measured for faces
+        that are large enough.
+        
+        Returns:
+            Tuple of (passed face locations, skipped faces)
+        """
+        passed, skipped = [], []
+        with recognition_stage_seconds.time(stage="quality_gate"):
+            for face_location in face_locations:
+                face_size = face_box_size(face_location)
+                if face_size < gate.min_size:
+                    skipped.append(SkippedFace(tuple(face_location), "too_small", face_size, None))
+                    continue
+                if gate.min_sharpness > 0:
+                    sharpness = self.face_sharpness(rgb_image, face_location)
+                    if sharpness < gate.min_sharpness:
+                        skipped.append(SkippedFace(tuple(face_location), "blurry", face_size, sharpness))
+                        continue
+                passed.append(face_location)
+        return passed, skipped
+    
+    def encode_face_from_frame(
+        self, frame: np.ndarray, gate: Optional[FaceGate] = None
+    ) -> Tuple[List[float], List[int]]:
         """
         Encode a face from a video frame.
         
         Args:
             frame: OpenCV frame (numpy array)
+            gate: Quality gate; the first face passing it is encoded
             
         Returns:
             Tuple of (encoding list, face location [top, right, bottom, left])
+            
+        Raises:
+            FaceSkippedError: if faces were found but none passed the gate
         """
+        face_recognition, cv2 = load_face_recognition(), load_cv2()
         # Convert BGR to RGB (OpenCV uses BGR, face_recognition uses RGB)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with recognition_stage_seconds.time(stage="bgr_to_rgb"):
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         
         # Find faces
-        face_locations = face_recognition.face_locations(rgb_frame)
+        with recognition_stage_seconds.time(stage="detect"):
+            face_locations = face_recognition.face_locations(rgb_frame)
         
         if not face_locations:
             raise ValueError("No faces found in the frame")
+        if gate is not None:
+            face_locations, skipped = self.gate_faces(rgb_frame, face_locations, gate)
+            if not face_locations:
+                raise FaceSkippedError(skipped)
             
         # Get the first face found
-        face_encoding = face_recognition.face_encodings(rgb_frame, face_locations)[0]
+        with recognition_stage_seconds.time(stage="encode"):
+            face_encoding = face_recognition.face_encodings(rgb_frame, face_locations[:1])[0]
         return face_encoding.tolist(), face_locations[0]
     
+    def encode_gated_faces_from_frame(
+        self, frame: np.ndarray, gate: Optional[FaceGate]
+    ) -> Tuple[List[Tuple[np.ndarray, Tuple[int, int, int, int]]], List[SkippedFace]]:
+        """
+        Encode every face of a video frame that passes the quality gate.
+        
+        Args:
+            frame: OpenCV frame (numpy array)
+            gate: Quality gate, None to encode every face
+            
+        Returns:
+            Tuple of (list of (encoding, face location) tuples, skipped faces)
+        """
+        face_recognition, cv2 = load_face_recognition(), load_cv2()
+        with recognition_stage_seconds.time(stage="bgr_to_rgb"):
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with recognition_stage_seconds.time(stage="detect"):
+            face_locations = face_recognition.face_locations(rgb_frame)
+        
+        skipped: List[SkippedFace] = []
+        if face_locations and gate is not None:
+            face_locations, skipped = self.gate_faces(rgb_frame, face_locations, gate)
+        if not face_locations:
+            return [], skipped
+        
+        # One call encodes all faces of the frame
+        with recognition_stage_seconds.time(stage="encode"):
+            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        return list(zip(face_encodings, face_locations)), skipped
+    
+    def warm_up(self, image_path: str) -> None:
+        """
+        Run the pipeline once on a test image: JPEG decoder, HOG detector,
+        landmark and encoder models and the gallery match. The image does not
+        need a detectable face; the encoder then runs on the whole frame.
+        """
+        cv2 = load_cv2()
+        with open(image_path, "rb") as f:
+            frame = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError(f"Cannot decode warm-up image: {image_path}")
+
+        face_locations = self.detect_faces(frame)
+        height, width = frame.shape[:2]
+        face_location = face_locations[0] if face_locations else (0, width, height, 0)
+        self.identify_face(self.encode_face_from_location(frame, face_location))
+    
     def find_matching_client(
         self, 
         face_encoding: List[float], 
@@ -74,38 +250,56 @@ class FaceRecognitionService:
         Returns:
             Tuple of (client if found or None, confidence score or None)
         """
-        face_encoding_np = np.array(face_encoding)
+        # Compare against the shared in-memory gallery instead of the table
+        with recognition_stage_seconds.time(stage="match"):
+            client_id, _, distance = self.gallery.match(face_encoding, self.tolerance)
+        client = db.get(Client, client_id) if client_id is not None else None
         
-        # Get all face encodings from the database
-        db_face_encodings = db.query(FaceEncoding).all()
+        if client:
+            # Convert distance to confidence (0-100%)
+            confidence = (1 - distance) * 100
+            return client, confidence
         
-        best_match = None
-        best_match_score = 1.0  # Lower is better (0 is perfect match)
+        return None, None
+    
+    def identify_face(
+        self,
+        face_encoding: List[float]
+    ) -> Tuple[Optional[int], Optional[str], Optional[float]]:
+        """
+        Match a face against the gallery snapshot only. The client name is
+        stored in the snapshot, so no database query is needed.
         
-        for db_face in db_face_encodings:
-            # Convert stored JSON string to numpy array
-            stored_encoding = np.array(json.loads(db_face.encoding_vector))
-            
-            # Calculate face distance (lower means more similar)
-            face_distance = face_recognition.face_distance([stored_encoding], face_encoding_np)[0]
+        Args:
+            face_encoding: Face encoding to match
             
-            if face_distance < self.tolerance and face_distance < best_match_score:
-                best_match_score = face_distance
-                best_match = db_face.client
-        
-        if best_match:
-            # Convert distance to confidence (0-100%)
-            confidence = (1 - best_match_score) * 100
-            return best_match, confidence
+        Returns:
+            Tuple of (client id, client name, confidence score), all None if no match
+        """
+        with recognition_stage_seconds.time(stage="match"):
+            client_id, client_name, distance = self.gallery.match(face_encoding, self.tolerance)
+        if client_id is None:
+            return None, None, None
         
-        return None, None
+        # Convert distance to confidence (0-100%)
+        return client_id, client_name, (1 - distance) * 100
+    
+    async def identify_face_async(
+        self,
+        face_encoding: List[float]
+    ) -> Tuple[Optional[int], Optional[str], Optional[float]]:
+        """
+        Async version of identify_face; the lookup runs in a worker thread.
+        """
+        return await asyncio.to_thread(self.identify_face, face_encoding)
     
     def save_face_encoding(
         self, 
         client_id: int, 
         face_encoding: List[float], 
         image_path: str,
-        db: Session
+        db: Session,
+        quality: Optional[FaceQuality] = None
     ) -> FaceEncoding:
         """
         Save a face encoding for a client.
@@ -115,6 +309,7 @@ class FaceRecognitionService:
             face_encoding: Face encoding to save
             image_path: Path to the image file
             db: Database session
+            quality: Quality of the enrollment image, if measured
             
         Returns:
             Created FaceEncoding object
@@ -127,6 +322,11 @@ class FaceRecognitionService:
             encoding_vector=encoding_json,
             image_path=image_path
         )
+        if quality is not None:
+            face_encoding_obj.quality = quality.score
+            face_encoding_obj.sharpness = quality.sharpness
+            face_encoding_obj.face_size = quality.face_size
+            face_encoding_obj.yaw = quality.yaw
         
         db.add(face_encoding_obj)
         db.commit()
@@ -138,11 +338,14 @@ class FaceRecognitionService:
         """
         Detect all faces in an image
         """
+        face_recognition, cv2 = load_face_recognition(), load_cv2()
         # Convert BGR to RGB (face_recognition uses RGB)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        with recognition_stage_seconds.time(stage="bgr_to_rgb"):
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         
         # Find all face locations
-        face_locations = face_recognition.face_locations(rgb_image, model="hog")
+        with recognition_stage_seconds.time(stage="detect"):
+            face_locations = face_recognition.face_locations(rgb_image, model="hog")
         
         return face_locations
 
@@ -150,13 +353,20 @@ class FaceRecognitionService:
         """
         Encode a face from an image and specific face location
         """
+        face_recognition, cv2 = load_face_recognition(), load_cv2()
         # Convert BGR to RGB (face_recognition uses RGB)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        with recognition_stage_seconds.time(stage="bgr_to_rgb"):
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         
         # Encode the face
-        face_encodings = face_recognition.face_encodings(rgb_image, [face_location])
+        with recognition_stage_seconds.time(stage="encode"):
+            face_encodings = face_recognition.face_encodings(rgb_image, [face_location])
         
         if len(face_encodings) == 0:
             raise ValueError("No face found at the specified location")
         
-        return face_encodings[0] 
\ No newline at end of file
+        return face_encodings[0]
+
+
+# Shared by the detect endpoints, camera ingest and the startup warm-up
+face_service = FaceRecognitionService()
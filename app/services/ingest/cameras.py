@@ -0,0 +1,315 @@
+"""
+Server-side camera ingest: frames are read from RTSP streams, local
+devices or video files with cv2.VideoCapture and go straight into the
+recognition pipeline, without the browser upload (JPEG encode, HTTP,
+decode) of /api/face/detect-entry and /detect-exit.
+
+    CAMERA_SOURCES="lobby:entry=rtsp://10.0.0.5/stream1;door:exit=0;demo:entry=./videos/demo.mp4"
+
+Each entry is name:role=source; role is entry (opens a visit) or exit
+(closes it), source an RTSP/HTTP URL, a device index or a video file
+(played at its own frame rate, for testing).
+
+Per camera a reader thread keeps decoding (a stream read too slowly only
+gets more delayed) into a small queue that drops the oldest frame when
+recognition falls behind, and a recognition thread processes the newest
+frames. Only one process runs the cameras: the one holding
+CAMERA_LOCK_FILE; the other workers retry and take over if it exits.
+"""
+import asyncio
+import collections
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import numpy as np
+
+from app.services.face_recognition.quality import face_gate
+from app.services.face_recognition.recognition import face_service, load_cv2
+from app.services.metrics.registry import metrics
+from app.services.startup.process_lock import ProcessLock
+from app.services.visits.recording import log_entry_visit, log_exit_visit
+from app.services.visits.sessions import last_seen
+
+logger = logging.getLogger(__name__)
+
+CAMERA_SOURCES = os.getenv("CAMERA_SOURCES", "")
+
+# Frames buffered per camera; the oldest is dropped when recognition lags
+CAMERA_QUEUE_SIZE = int(os.getenv("CAMERA_QUEUE_SIZE", "2"))
+
+# Minimum seconds between recognized frames of one camera (0: as fast as possible)
+CAMERA_FRAME_INTERVAL = float(os.getenv("CAMERA_FRAME_INTERVAL", "0.5"))
+
+# Seconds before reopening a stream or device that failed
+CAMERA_RECONNECT_SECONDS = float(os.getenv("CAMERA_RECONNECT_SECONDS", "5"))
+
+# A client recognized again by the same camera within this many seconds is
+# not logged again (the last-seen time is still updated)
+CAMERA_RECOGNITION_COOLDOWN = float(os.getenv("CAMERA_RECOGNITION_COOLDOWN", "10"))
+
+# Held by the process running the cameras
+CAMERA_LOCK_FILE = os.getenv("CAMERA_LOCK_FILE", "./camera_ingest.lock")
+
+# Seconds between attempts of the other workers to take the cameras over
+CAMERA_LOCK_RETRY_SECONDS = 30
+
+CAMERA_ROLES = ("entry", "exit")
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+camera_frames_total = metrics.counter(
+    "camera_frames_total", "Camera frames read, dropped by the queue and processed", ["camera", "result"]
+)
+camera_faces_total = metrics.counter(
+    "camera_faces_total", "Faces found in camera frames per outcome", ["camera", "result"]
+)
+camera_connected = metrics.gauge(
+    "camera_connected", "1 while the camera source is open", ["camera"]
+)
+
+
+class CameraConfig(NamedTuple):
+    name: str
+    role: str                   # entry, exit
+    source: Union[int, str]     # device index, stream URL or video file
+
+
+def parse_camera_sources(value: str) -> List[CameraConfig]:
+    """
+    Parse CAMERA_SOURCES ("name:role=source;..."). Raises ValueError.
+    """
+    cameras = []
+    for entry in filter(None, (part.strip() for part in value.split(";"))):
+        head, separator, source = entry.partition("=")
+        name, _, role = head.partition(":")
+        name, role, source = name.strip(), role.strip(), source.strip()
+        if not separator or not source:
+            raise ValueError(f"Camera source must look like name:role=source, got {entry!r}")
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"Camera name may only contain letters, digits, _ and -, got {name!r}")
+        if role not in CAMERA_ROLES:
+            raise ValueError(f"Camera role must be one of {', '.join(CAMERA_ROLES)}, got {role!r}")
+        if any(camera.name == name for camera in cameras):
+            raise ValueError(f"Duplicate camera name {name!r}")
+        cameras.append(CameraConfig(name, role, int(source) if source.isdigit() else source))
+    return cameras
+
+
+def is_video_file(source: Union[int, str]) -> bool:
+    return isinstance(source, str) and "://" not in source
+
+
+class FrameQueue:
+    """
+    Bounded frame queue that drops the oldest frame instead of blocking the
+    reader, so recognition always works on recent frames.
+    """
+
+    def __init__(self, maxsize: int = CAMERA_QUEUE_SIZE):
+        self._frames = collections.deque(maxlen=max(1, maxsize))
+        self._ready = threading.Condition()
+
+    def put(self, frame: np.ndarray) -> bool:
+        """
+        Add a frame; returns True if the oldest one was dropped for it.
+        """
+        with self._ready:
+            dropped = len(self._frames) == self._frames.maxlen
+            self._frames.append(frame)
+            self._ready.notify()
+        return dropped
+
+    def get(self, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        with self._ready:
+            if not self._frames:
+                self._ready.wait(timeout)
+            return self._frames.popleft() if self._frames else None
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+class Camera:
+    """
+    Reader and recognition threads of one camera source.
+    """
+
+    def __init__(self, config: CameraConfig, loop: asyncio.AbstractEventLoop):
+        self.config = config
+        self.loop = loop
+        self.frames = FrameQueue()
+        # FACE_GATE_CAMERA_<NAME>_MIN_SIZE / _MIN_SHARPNESS, then the defaults
+        self.gate = face_gate(f"camera-{config.name}")
+        self._log_visit = log_entry_visit if config.role == "entry" else log_exit_visit
+        self._last_logged: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._finished = threading.Event()  # video file played to the end
+        self._threads = [
+            threading.Thread(target=self._read_frames, name=f"camera-{config.name}-reader", daemon=True),
+            threading.Thread(target=self._recognize_frames, name=f"camera-{config.name}-recognition", daemon=True),
+        ]
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        # A reader blocked on an unresponsive stream is a daemon thread; not waited for
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _open(self):
+        cv2 = load_cv2()
+        capture = cv2.VideoCapture(self.config.source)
+        if capture.isOpened() and not is_video_file(self.config.source):
+            # Keep the decoder's own buffer short, the queue does the buffering
+            capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return capture
+
+    def _read_frames(self) -> None:
+        cv2 = load_cv2()
+        video_file = is_video_file(self.config.source)
+        while not self._stop.is_set():
+            capture = self._open()
+            if not capture.isOpened():
+                logger.warning("Camera %s: cannot open %s", self.name, self.config.source)
+                capture.release()
+                if video_file:
+                    break
+                self._stop.wait(CAMERA_RECONNECT_SECONDS)
+                continue
+
+            logger.info("Camera %s (%s) opened", self.name, self.config.role)
+            camera_connected.set(1, camera=self.name)
+            # Files are played at their frame rate, like a live camera
+            frame_time = 1.0 / (capture.get(cv2.CAP_PROP_FPS) or 25.0) if video_file else 0.0
+            next_frame = time.monotonic()
+            try:
+                while not self._stop.is_set():
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    camera_frames_total.inc(camera=self.name, result="read")
+                    if self.frames.put(frame):
+                        camera_frames_total.inc(camera=self.name, result="dropped")
+                    if frame_time:
+                        next_frame += frame_time
+                        self._stop.wait(max(0.0, next_frame - time.monotonic()))
+            finally:
+                capture.release()
+                camera_connected.set(0, camera=self.name)
+
+            if video_file:
+                logger.info("Camera %s: end of %s", self.name, self.config.source)
+                break
+            if not self._stop.is_set():
+                logger.warning("Camera %s: stream lost, reconnecting in %.0fs", self.name, CAMERA_RECONNECT_SECONDS)
+                self._stop.wait(CAMERA_RECONNECT_SECONDS)
+        self._finished.set()
+
+    def _recognize_frames(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            frame = self.frames.get(timeout=0.5)
+            if frame is None:
+                if self._finished.is_set():
+                    break
+                continue
+            try:
+                self.process_frame(frame)
+            except Exception:
+                logger.exception("Camera %s: recognition failed", self.name)
+            if CAMERA_FRAME_INTERVAL > 0:
+                self._stop.wait(max(0.0, CAMERA_FRAME_INTERVAL - (time.monotonic() - started)))
+
+    def process_frame(self, frame: np.ndarray) -> List[int]:
+        """
+        Recognize every face of a BGR frame and log the entry/exit of the
+        recognized clients. Returns the recognized client ids.
+        """
+        camera_frames_total.inc(camera=self.name, result="processed")
+        faces, skipped = face_service.encode_gated_faces_from_frame(frame, self.gate)
+        if skipped:
+            camera_faces_total.inc(len(skipped), camera=self.name, result="skipped")
+
+        recognized = []
+        for face_encoding, _ in faces:
+            client_id, _, _ = face_service.identify_face(face_encoding)
+            camera_faces_total.inc(camera=self.name, result="recognized" if client_id is not None else "unknown")
+            if client_id is not None:
+                recognized.append(client_id)
+                self._on_recognized(client_id)
+        return recognized
+
+    def _on_recognized(self, client_id: int) -> None:
+        now = time.monotonic()
+        if self.config.role == "entry":
+            last_seen.touch(client_id)
+        if now - self._last_logged.get(client_id, float("-inf")) < CAMERA_RECOGNITION_COOLDOWN:
+            return
+        self._last_logged[client_id] = now
+        if len(self._last_logged) > 10000:
+            self._last_logged = {
+                client: logged for client, logged in self._last_logged.items()
+                if now - logged < CAMERA_RECOGNITION_COOLDOWN
+            }
+
+        # Visits are written by the same async code as the upload endpoints
+        future = asyncio.run_coroutine_threadsafe(self._log_visit(client_id=client_id), self.loop)
+        future.add_done_callback(self._visit_logged)
+
+    def _visit_logged(self, future) -> None:
+        if future.exception() is not None:
+            logger.error("Camera %s: logging a visit failed", self.name, exc_info=future.exception())
+
+
+class CameraIngest:
+    """
+    The configured cameras of this deployment, run by one process at a time.
+    """
+
+    def __init__(self, configs: List[CameraConfig]):
+        self.configs = configs
+        self.cameras: List[Camera] = []
+        self._lock = ProcessLock(CAMERA_LOCK_FILE)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.configs)
+
+    @property
+    def running(self) -> bool:
+        return bool(self.cameras)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> bool:
+        """
+        Start every camera unless another process runs them. Visits are
+        logged on loop. Returns whether this process runs the cameras.
+        """
+        if self.running:
+            return True
+        if not self._lock.acquire():
+            return False
+        self.cameras = [Camera(config, loop) for config in self.configs]
+        for camera in self.cameras:
+            camera.start()
+        logger.info("Camera ingest started: %s", ", ".join(f"{c.name} ({c.role})" for c in self.configs))
+        return True
+
+    def stop(self) -> None:
+        for camera in self.cameras:
+            camera.stop()
+        self.cameras = []
+        self._lock.release()
+
+
+camera_ingest = CameraIngest(parse_camera_sources(CAMERA_SOURCES))
@@ -0,0 +1,47 @@
+import time
+
+from app.services.metrics.registry import metrics
+
+http_request_duration_seconds = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route", "status"]
+)
+http_requests_in_progress = metrics.gauge(
+    "http_requests_in_progress", "HTTP requests currently being handled"
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware), so streaming responses
+    and background tasks are unaffected. Requests are labelled with the
+    route template, not the raw path, to keep label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with http_requests_in_progress.track_in_progress():
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = getattr(scope.get("route"), "path", "unmatched")
+                http_request_duration_seconds.observe(
+                    time.perf_counter() - started,
+                    method=scope["method"],
+                    route=route,
+                    status=str(status_code)
+                )
@@ -0,0 +1,63 @@
+import logging
+import re
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.services.profiling.profiler import RequestProfile, check_token, profiling_state
+
+logger = logging.getLogger(__name__)
+
+# A client request id is reused (file name, X-Profile-Id) only if it is a plain token
+_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when it carries X-Profile: <PROFILING_TOKEN>, or when
+    the admin toggle samples it. Everything else passes straight through.
+
+    Only installed when PROFILING_TOKEN is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not _REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        profile = RequestProfile(request_id, scope["method"], scope["path"])
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        profile.start()
+        try:
+            # Background tasks run inside this call, so they are profiled too
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            profile.route = getattr(scope.get("route"), "path", None)
+            try:
+                path = await run_in_threadpool(profile.write)
+                profiling_state.profiles_written += 1
+                logger.info("Request profile written to %s", path)
+            except Exception:
+                logger.exception("Writing request profile failed")
+
+    @staticmethod
+    def _wants_profile(scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return check_token(value.decode("latin-1"))
+        return profiling_state.should_sample(scope["path"])
@@ -0,0 +1,237 @@
+import contextvars
+import datetime
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # pyinstrument ixtiyoriy; bo'lmasa o'zimizning sampler ishlatiladi
+    PyinstrumentProfiler = None
+
+logger = logging.getLogger(__name__)
+
+# Shared secret for the X-Profile header and the admin toggle; profiling is
+# completely off (no middleware, no SQL hooks) when it is not set
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_AVAILABLE = bool(PROFILING_TOKEN)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "1")) / 1000
+
+# SQL statements kept per profile (the count and total time cover all of them)
+MAX_RECORDED_STATEMENTS = 500
+
+_active_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "active_profile", default=None
+)
+
+
+def check_token(token: Optional[str]) -> bool:
+    return PROFILING_AVAILABLE and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+class StackSampler:
+    """
+    Minimal statistical profiler: a thread that samples the stacks of the
+    event loop thread and the worker threads every interval and counts
+    identical stacks. Output is the "folded" format read by flamegraph.pl
+    and speedscope.
+
+    All requests share those threads, so work of concurrent requests shows
+    up in the samples too.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._loop_thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _target_thread_ids(self) -> List[int]:
+        ids = [self._loop_thread_id]
+        for thread in threading.enumerate():
+            # run_in_threadpool (anyio) and asyncio.to_thread workers
+            if thread.name.startswith(("AnyIO worker thread", "asyncio_")):
+                ids.append(thread.ident)
+        return ids
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self._target_thread_ids():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def render(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class RequestProfile:
+    """
+    Profile of one request: stack samples plus every SQL statement it ran.
+    """
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.started_at = datetime.datetime.utcnow()
+        self.duration = 0.0
+        self.statements: List[Dict[str, Any]] = []
+        self.statement_count = 0
+        self.sql_seconds = 0.0
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._token = None
+
+        if PyinstrumentProfiler is not None:
+            self._sampler = PyinstrumentProfiler(interval=PROFILE_SAMPLE_INTERVAL, async_mode="enabled")
+        else:
+            self._sampler = StackSampler()
+
+    def start(self) -> None:
+        self._token = _active_profile.set(self)
+        self._started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._sampler.stop()
+        self.duration = time.perf_counter() - self._started
+        _active_profile.reset(self._token)
+
+    def record_statement(self, statement: str, seconds: float, executemany: bool) -> None:
+        with self._lock:
+            self.statement_count += 1
+            self.sql_seconds += seconds
+            if len(self.statements) < MAX_RECORDED_STATEMENTS:
+                self.statements.append({
+                    "statement": statement,
+                    "duration_ms": seconds * 1000,
+                    "executemany": executemany,
+                })
+
+    def write(self, directory: str = PROFILE_DIR) -> str:
+        """
+        Write <time>-<route>-<request id>.json plus the sampler output
+        (.html from pyinstrument, .folded from the built-in sampler).
+        """
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", self.route or self.path).strip("_") or "root"
+        request_id = re.sub(r"[^A-Za-z0-9_-]+", "_", self.request_id)
+        base = os.path.join(directory, f"{self.started_at:%Y%m%dT%H%M%S}-{slug}-{request_id}")
+
+        if PyinstrumentProfiler is not None:
+            samples_path = base + ".html"
+            content = self._sampler.output_html()
+        else:
+            samples_path = base + ".folded"
+            content = self._sampler.render()
+        with open(samples_path, "w") as f:
+            f.write(content)
+
+        summary = {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status_code": self.status_code,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration * 1000,
+            "sql": {
+                "statements": self.statement_count,
+                "total_ms": self.sql_seconds * 1000,
+                "recorded": sorted(self.statements, key=lambda s: s["duration_ms"], reverse=True),
+            },
+            "samples_file": os.path.basename(samples_path),
+        }
+        with open(base + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
+        return base + ".json"
+
+
+class ProfilingState:
+    """
+    Admin toggle: profile a random share of requests, optionally only those
+    whose path starts with a prefix. Requests with a valid X-Profile header
+    are always profiled.
+    """
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.path_prefix: Optional[str] = None
+        self.profiles_written = 0
+
+    def configure(self, sample_rate: float, path_prefix: Optional[str] = None) -> None:
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.path_prefix = path_prefix or None
+
+    def should_sample(self, path: str) -> bool:
+        if self.sample_rate <= 0.0:
+            return False
+        if self.path_prefix and not path.startswith(self.path_prefix):
+            return False
+        return random.random() < self.sample_rate
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "available": PROFILING_AVAILABLE,
+            "sample_rate": self.sample_rate,
+            "path_prefix": self.path_prefix,
+            "profiler": "pyinstrument" if PyinstrumentProfiler is not None else "stack-sampler",
+            "directory": os.path.abspath(PROFILE_DIR),
+            "profiles_written": self.profiles_written,
+        }
+
+
+profiling_state = ProfilingState()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profile.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active_profile.get()
+    if profile is None:
+        return
+    starts = conn.info.get("profile_query_start")
+    if starts:
+        profile.record_statement(statement, time.perf_counter() - starts.pop(), executemany)
+
+
+if PROFILING_AVAILABLE:
+    # Engine-class listeners cover the sync and the async engine
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -136,4 +136,7 @@ class RecommendationEngine:
             score -= 10  # Reduce score for expensive cars if no credit history
         
         # Clamp the score between 0 and 100
-        return max(0, min(100, score)) 
\ No newline at end of file
+        return max(0, min(100, score))
+
+
+recommendation_engine = RecommendationEngine()
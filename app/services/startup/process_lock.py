@@ -0,0 +1,45 @@
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: bitta worker, fayl qulfi kerak emas
+    fcntl = None
+
+
+class ProcessLock:
+    """
+    Non-blocking exclusive file lock electing the one worker process that
+    runs a job (cameras, stale visit closing). The lock is held until
+    release() or the process exits, after which another worker's next
+    acquire() succeeds.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[object] = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """
+        Take the lock unless another process holds it; True if this one does.
+        """
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._file = lock_file
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            # Closing the file releases the lock
+            self._file.close()
+            self._file = None
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.metrics.registry import metrics
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to skip the optional steps (required ones, e.g. the gallery, still run)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") != "0"
+
+WARMUP_IMAGE = os.getenv(
+    "WARMUP_IMAGE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "warmup.jpg")
+)
+
+
+class StartupWarmup:
+    """
+    Steps run once after startup so the first real request does not pay for
+    cold models, decoders and caches. The readiness probe reports not-ready
+    until every step has finished.
+
+    A failing step is logged and recorded; it does not stop the others. If a
+    required step failed, the warm-up ends as "failed" instead of "done" and
+    the process never reports ready, so it gets no traffic and is restarted.
+    """
+
+    def __init__(self):
+        self._steps: List[Tuple[str, Callable[[], Any], bool]] = []
+        self.state = "pending"  # pending, running, done, failed
+        self.duration: Optional[float] = None
+        self.step_results: List[Dict[str, Any]] = []
+
+    def add_step(self, name: str, step: Callable[[], Any], required: bool = False) -> None:
+        """
+        Register a blocking callable; it runs in a worker thread.
+        Required steps run even when WARMUP_ON_STARTUP is off, and the
+        process is not ready if one of them fails.
+        """
+        self._steps.append((name, step, required))
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    async def run(self) -> None:
+        self.state = "running"
+        started = time.perf_counter()
+        failed = False
+        for name, step, required in self._steps:
+            if not WARMUP_ON_STARTUP and not required:
+                continue
+
+            step_started = time.perf_counter()
+            result = {"step": name}
+            try:
+                await asyncio.to_thread(step)
+                result["status"] = "ok"
+            except Exception as e:
+                logger.exception("Warm-up step %s failed", name)
+                result.update(status="failed", error=str(e))
+                failed = failed or required
+            result["duration_ms"] = (time.perf_counter() - step_started) * 1000
+            self.step_results.append(result)
+            logger.info("Warm-up step %s: %s in %.1f ms", name, result["status"], result["duration_ms"])
+
+        self.duration = time.perf_counter() - started
+        self.state = "failed" if failed else "done"
+        if failed:
+            logger.error("Warm-up failed in %.1f ms: a required step failed", self.duration * 1000)
+        else:
+            logger.info("Warm-up finished in %.1f ms", self.duration * 1000)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "steps": self.step_results,
+        }
+
+
+startup_warmup = StartupWarmup()
+
+metrics.gauge("startup_warmup_seconds", "Duration of the startup warm-up (0 until finished)",
+              callback=lambda: startup_warmup.duration or 0.0)
@@ -0,0 +1,335 @@
+"""
+Dwell-time (exit_time - entry_time) quantile sketches.
+
+Every closed visit adds its dwell time to the sketch of its (entry day,
+purpose, age bucket). A sketch is a set of logarithmic bins (DDSketch):
+bin i counts values in (gamma^(i-1), gamma^i], so any quantile read from
+it is within RELATIVE_ACCURACY of the true value. Sketches merge by adding
+bin counts, so the statistics of any day range and grouping come from a
+GROUP BY over dwell_sketch_bins instead of a scan of the visits.
+
+Rows are updated with atomic upserts in the transaction that closes the
+visit, so concurrent workers never lose updates. Deleting visits and
+changing a client's age update them too (forget_dwell, reassign_dwell_age),
+so the sketches always describe the visits table. To fill the table for
+visits closed before it existed (or written in bulk):
+
+    python -m app.services.visits.dwell --rebuild
+"""
+import argparse
+import datetime
+import itertools
+import logging
+import math
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.db.base import IS_SQLITE, SessionLocal
+from app.models.models import Client, DwellSketchBin, Visit
+
+logger = logging.getLogger(__name__)
+
+RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+# Dwell times under a second
+ZERO_BIN = 0
+
+# Same ranges as /analytics/visits/by-age
+AGE_BUCKETS = ((0, 18, "0-18"), (19, 25, "19-25"), (26, 35, "26-35"), (36, 45, "36-45"), (46, 55, "46-55"), (56, 200, "56+"))
+UNKNOWN_AGE = "unknown"
+DEFAULT_PURPOSE = "Not specified"
+
+# Dimensions /analytics/dwell-time can group by
+GROUP_COLUMNS = {
+    "day": DwellSketchBin.day,
+    "purpose": DwellSketchBin.purpose,
+    "age": DwellSketchBin.age_bucket,
+}
+
+
+class SketchKey(NamedTuple):
+    day: str         # entry date, YYYY-MM-DD (UTC)
+    purpose: str
+    age_bucket: str
+
+
+def bin_index(seconds: float) -> int:
+    if seconds < 1:
+        return ZERO_BIN
+    return max(1, math.ceil(math.log(seconds) / _LOG_GAMMA))
+
+
+def bin_value(index: int) -> float:
+    """
+    Value reported for a bin: within RELATIVE_ACCURACY of everything in it.
+    """
+    if index == ZERO_BIN:
+        return 0.0
+    return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+
+def age_bucket(age: Optional[int]) -> str:
+    if age is None:
+        return UNKNOWN_AGE
+    for low, high, label in AGE_BUCKETS:
+        if low <= age <= high:
+            return label
+    return UNKNOWN_AGE
+
+
+class DwellSketch:
+    """
+    Mergeable quantile sketch: per-bin counts plus per-bin sums, so the
+    mean is exact.
+    """
+
+    def __init__(self):
+        self.bins: Dict[int, List[float]] = {}  # index -> [count, total seconds]
+
+    def add(self, seconds: float) -> None:
+        self.add_bin(bin_index(seconds), 1, seconds)
+
+    def add_bin(self, index: int, count: int, total_seconds: float) -> None:
+        entry = self.bins.setdefault(index, [0, 0.0])
+        entry[0] += count
+        entry[1] += total_seconds
+
+    def merge(self, other: "DwellSketch") -> None:
+        for index, (count, total_seconds) in other.bins.items():
+            self.add_bin(index, count, total_seconds)
+
+    @property
+    def count(self) -> int:
+        return int(sum(count for count, _ in self.bins.values()))
+
+    @property
+    def mean(self) -> Optional[float]:
+        count = self.count
+        return sum(total for _, total in self.bins.values()) / count if count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        count = self.count
+        if not count:
+            return None
+        rank = q * (count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index][0]
+            if seen > rank:
+                return bin_value(index)
+        return bin_value(max(self.bins))
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "count": self.count,
+            "mean_seconds": self.mean,
+            "p50_seconds": self.quantile(0.5),
+            "p90_seconds": self.quantile(0.9),
+            "p99_seconds": self.quantile(0.99),
+        }
+
+
+def dwell_contribution(visit: Visit, age: Optional[int]) -> Optional[Tuple[SketchKey, float]]:
+    """
+    Sketch key and dwell seconds of a visit; None while it is open, and for
+    visits closed as stale without any sighting after entry (unknown dwell).
+    """
+    if visit.exit_time is None or visit.entry_time is None:
+        return None
+    # Live visits start with last_seen_at = entry_time
+    if visit.exit_estimated and (visit.last_seen_at is None or visit.last_seen_at <= visit.entry_time):
+        return None
+    seconds = max((visit.exit_time - visit.entry_time).total_seconds(), 0.0)
+    key = SketchKey(visit.entry_time.strftime("%Y-%m-%d"), visit.purpose or DEFAULT_PURPOSE, age_bucket(age))
+    return key, seconds
+
+
+def visit_dwell(db: Session, visit: Visit) -> Optional[Tuple[SketchKey, float]]:
+    if visit.exit_time is None:
+        return None
+    age = db.execute(select(Client.age).where(Client.id == visit.client_id)).scalar()
+    return dwell_contribution(visit, age)
+
+
+def _upsert_bins(db: Session, rows: List[Dict]) -> None:
+    if not rows:
+        return
+    table = DwellSketchBin.__table__
+    statement = (sqlite_insert if IS_SQLITE else postgresql_insert)(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.day, table.c.purpose, table.c.age_bucket, table.c.bin],
+        set_={
+            "count": table.c.count + statement.excluded.count,
+            "total_seconds": table.c.total_seconds + statement.excluded.total_seconds,
+        }
+    )
+    db.execute(statement, rows)
+
+
+def _bin_row(key: SketchKey, index: int, count: int, total_seconds: float) -> Dict:
+    return {
+        "day": key.day, "purpose": key.purpose, "age_bucket": key.age_bucket,
+        "bin": index, "count": count, "total_seconds": total_seconds,
+    }
+
+
+def apply_dwell_changes(
+    db: Session, changes: Iterable[Tuple[Optional[Tuple[SketchKey, float]], Optional[Tuple[SketchKey, float]]]]
+) -> None:
+    """
+    Apply (previous, current) contributions in the caller's transaction:
+    previous is taken out of its sketch, current added (either may be None).
+    """
+    # One row per bin: a multi-row upsert may not touch the same row twice
+    bins: Dict[Tuple[SketchKey, int], List[float]] = {}
+    for previous, current in changes:
+        if previous == current:
+            continue
+        for contribution, sign in ((previous, -1), (current, 1)):
+            if contribution is not None:
+                key, seconds = contribution
+                entry = bins.setdefault((key, bin_index(seconds)), [0, 0.0])
+                entry[0] += sign
+                entry[1] += sign * seconds
+    _upsert_bins(db, [
+        _bin_row(key, index, count, total_seconds)
+        for (key, index), (count, total_seconds) in bins.items()
+        if count or total_seconds
+    ])
+
+
+def record_dwell(
+    db: Session, visit: Visit, previous: Optional[Tuple[SketchKey, float]] = None
+) -> None:
+    """
+    Add a visit's dwell time to its sketch, in the caller's transaction.
+    previous is visit_dwell() taken before the visit was changed; it is
+    taken out again (e.g. an edited exit time or purpose).
+    """
+    apply_dwell_changes(db, [(previous, visit_dwell(db, visit))])
+
+
+def forget_dwell(db: Session, visits: Iterable[Visit], age: Optional[int]) -> None:
+    """
+    Take visits of one client (of the given age) out of their sketches;
+    call before deleting them.
+    """
+    apply_dwell_changes(db, [(dwell_contribution(visit, age), None) for visit in visits])
+
+
+def reassign_dwell_age(db: Session, client_id: int, old_age: Optional[int], new_age: Optional[int]) -> None:
+    """
+    Move a client's closed visits to the sketches of their new age bucket;
+    call when the client's age changes (or its visits move to another client).
+    """
+    if age_bucket(old_age) == age_bucket(new_age):
+        return
+    visits = db.query(Visit).filter(Visit.client_id == client_id, Visit.exit_time.isnot(None))
+    apply_dwell_changes(db, [
+        (dwell_contribution(visit, old_age), dwell_contribution(visit, new_age)) for visit in visits
+    ])
+
+
+def dwell_stats(
+    db: Session,
+    start_day: datetime.date,
+    end_day: datetime.date,
+    group_by: Sequence[str] = ("day",),
+    purpose: Optional[str] = None,
+    age: Optional[str] = None
+) -> List[Dict]:
+    """
+    Count, mean and p50/p90/p99 dwell seconds per group over entry days
+    start_day..end_day, merged from the stored sketches.
+    """
+    columns = [GROUP_COLUMNS[name].label(name) for name in group_by]
+    query = select(
+        *columns, DwellSketchBin.bin, func.sum(DwellSketchBin.count), func.sum(DwellSketchBin.total_seconds)
+    ).where(
+        DwellSketchBin.day >= start_day.isoformat(),
+        DwellSketchBin.day <= end_day.isoformat()
+    )
+    if purpose is not None:
+        query = query.where(DwellSketchBin.purpose == purpose)
+    if age is not None:
+        query = query.where(DwellSketchBin.age_bucket == age)
+    query = query.group_by(*columns, DwellSketchBin.bin).order_by(*columns, DwellSketchBin.bin)
+
+    groups = len(columns)
+    result = []
+    for group, rows in itertools.groupby(db.execute(query), key=lambda row: tuple(row[:groups])):
+        sketch = DwellSketch()
+        for row in rows:
+            if row[groups + 1]:
+                sketch.add_bin(row[groups], row[groups + 1], row[groups + 2])
+        if sketch.count:
+            result.append({**dict(zip(group_by, group)), **sketch.summary()})
+    return result
+
+
+def rebuild_dwell_sketches(db: Session, chunk_size: int = 50000) -> int:
+    """
+    Recompute every sketch from the visits table (backfill). Returns the
+    number of visits added.
+    """
+    sketches: Dict[SketchKey, DwellSketch] = {}
+    added = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(
+                Visit.id, Visit.entry_time, Visit.exit_time, Visit.purpose,
+                Visit.exit_estimated, Visit.last_seen_at, Client.age
+            ).outerjoin(Client, Client.id == Visit.client_id)
+            .where(Visit.id > last_id, Visit.exit_time.isnot(None))
+            .order_by(Visit.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            contribution = dwell_contribution(row, row.age)
+            if contribution is not None:
+                key, seconds = contribution
+                sketches.setdefault(key, DwellSketch()).add(seconds)
+                added += 1
+        last_id = rows[-1].id
+
+    db.execute(delete(DwellSketchBin))
+    rows = [
+        _bin_row(key, index, count, total_seconds)
+        for key, sketch in sketches.items()
+        for index, (count, total_seconds) in sketch.bins.items()
+    ]
+    for start in range(0, len(rows), chunk_size):
+        _upsert_bins(db, rows[start:start + chunk_size])
+    db.commit()
+    return added
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Maintain the dwell-time sketches")
+    parser.add_argument("--rebuild", action="store_true", help="recompute all sketches from the visits table")
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        added = rebuild_dwell_sketches(db)
+        bins = db.execute(select(func.count()).select_from(DwellSketchBin)).scalar()
+    finally:
+        db.close()
+    print(f"Dwell sketches rebuilt from {added} closed visits: {bins} bins in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
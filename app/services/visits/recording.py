@@ -0,0 +1,130 @@
+"""
+Visit logging of recognized clients, shared by the detect endpoints (as
+background tasks) and the camera ingest workers.
+"""
+import functools
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.pagination import count_cache
+from app.db.base import AsyncSessionLocal
+from app.models.models import Visit
+from app.services.events.broker import publish_entry, publish_exit, publish_recommendations
+from app.services.metrics.registry import metrics, recognition_stage_seconds
+from app.services.recommendation.engine import recommendation_engine
+from app.services.visits.dwell import record_dwell
+from app.services.visits.sessions import last_seen
+
+visit_logging_in_progress = metrics.gauge(
+    "visit_logging_in_progress", "Background visit logging tasks currently running"
+)
+
+
+def track_visit_logging(func):
+    """
+    Count a background visit logging task as in progress while it runs.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with visit_logging_in_progress.track_in_progress():
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+async def _create_visit(db: AsyncSession, client_id: int, purpose: str) -> Visit:
+    entry_time = datetime.utcnow()
+    visit = Visit(
+        client_id=client_id,
+        entry_time=entry_time,
+        last_seen_at=entry_time,
+        purpose=purpose
+    )
+    
+    with recognition_stage_seconds.time(stage="visit_insert"):
+        db.add(visit)
+        await db.commit()
+        count_cache.invalidate("visits")
+        
+        # Stream payload needs the client; load it without a lazy (sync) load
+        await db.refresh(visit, ["client"])
+    publish_entry(visit)
+    
+    # Get recommendations and save them to the visit
+    if visit.client:
+        with recognition_stage_seconds.time(stage="recommendations"):
+            recommendations = await db.run_sync(
+                lambda session: recommendation_engine.get_recommendations(visit.client, session)
+            )
+        recommendations_data = []
+        
+        for car, score in recommendations:
+            recommendations_data.append({
+                "car_id": car.id,
+                "name": f"{car.brand} {car.model}",
+                "interest_score": score
+            })
+        
+        visit.recommendations = json.dumps(recommendations_data)
+        with recognition_stage_seconds.time(stage="recommendations_save"):
+            await db.commit()
+        publish_recommendations(visit, recommendations_data)
+    
+    return visit
+
+
+@track_visit_logging
+async def log_visit(client_id: int):
+    """
+    Log a visit for a client (used as a background task).
+    """
+    last_seen.touch(client_id)
+    async with AsyncSessionLocal() as db:
+        await _create_visit(db, client_id, "Auto detected by face recognition")
+
+
+@track_visit_logging
+async def log_entry_visit(client_id: int):
+    """
+    Mijoz kirish tashrifini ro'yxatga olish
+    """
+    # Keeps the open visit from being closed as stale
+    last_seen.touch(client_id)
+    async with AsyncSessionLocal() as db:
+        # Avval tugallanmagan tashrif bor-yo'qligini tekshirish
+        active_visit = (await db.execute(
+            select(Visit.id).where(
+                Visit.client_id == client_id,
+                Visit.exit_time.is_(None)
+            ).limit(1)
+        )).first()
+        
+        # Agar faol tashrif bo'lsa, yangi tashrif yaratmaymiz
+        if active_visit:
+            return
+        
+        await _create_visit(db, client_id, "Auto detected by face recognition (Entry)")
+
+@track_visit_logging
+async def log_exit_visit(client_id: int):
+    """
+    Mijoz chiqish tashrifini ro'yxatga olish (exit_time ni qo'shish)
+    """
+    async with AsyncSessionLocal() as db:
+        # Mijozning eng so'nggi tugallanmagan tashrifini topish
+        active_visit = (await db.execute(
+            select(Visit).where(
+                Visit.client_id == client_id,
+                Visit.exit_time.is_(None)
+            ).order_by(Visit.entry_time.desc()).limit(1)
+        )).scalars().first()
+        
+        # Agar faol tashrif bo'lsa, uni yakunlaymiz
+        if active_visit:
+            active_visit.exit_time = datetime.utcnow()
+            with recognition_stage_seconds.time(stage="visit_update"):
+                await db.run_sync(lambda session: record_dwell(session, active_visit))
+                await db.commit()
+            publish_exit(active_visit)
@@ -0,0 +1,144 @@
+import datetime
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, func, or_, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.db.base import SessionLocal, engine
+from app.models.models import Visit
+from app.services.events.broker import publish_exit
+from app.services.visits.dwell import record_dwell
+from app.services.metrics.registry import metrics
+from app.services.startup.process_lock import ProcessLock
+
+logger = logging.getLogger(__name__)
+
+# Open visits without a sighting for this long are closed (exit camera missed them)
+VISIT_IDLE_TIMEOUT_MINUTES = float(os.getenv("VISIT_IDLE_TIMEOUT_MINUTES", "30"))
+
+# Seconds between last-seen flushes and stale visit checks (0 disables both)
+VISIT_SESSION_INTERVAL = float(os.getenv("VISIT_SESSION_INTERVAL", "60"))
+
+# Held by the one worker process that closes stale visits
+VISIT_SESSION_LOCK_FILE = os.getenv("VISIT_SESSION_LOCK_FILE", "./visit_sessions.lock")
+
+_CLOSE_BATCH_SIZE = 500
+
+visits_auto_closed_total = metrics.counter(
+    "visits_auto_closed_total", "Open visits closed after VISIT_IDLE_TIMEOUT_MINUTES without a sighting"
+)
+
+
+class LastSeenTracker:
+    """
+    Latest recognition time per client, kept in memory and written to the
+    clients' open visits in one batch per VISIT_SESSION_INTERVAL, instead
+    of one UPDATE per recognized frame.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[int, datetime.datetime] = {}
+
+    def touch(self, client_id: int, seen_at: Optional[datetime.datetime] = None) -> None:
+        seen_at = seen_at or datetime.datetime.utcnow()
+        with self._lock:
+            if client_id not in self._pending or seen_at > self._pending[client_id]:
+                self._pending[client_id] = seen_at
+
+    def flush(self) -> int:
+        """
+        Write pending sightings to the open visits. Returns the updated rows.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        visits = Visit.__table__
+        # Core statement on its own connection: last_seen_at is only read by
+        # the stale visit check, so these writes stay out of the change feed
+        statement = update(visits).where(
+            visits.c.client_id == bindparam("seen_client_id"),
+            visits.c.exit_time.is_(None),
+            or_(visits.c.last_seen_at.is_(None), visits.c.last_seen_at < bindparam("seen_at"))
+        ).values(last_seen_at=bindparam("seen_at"))
+        with engine.begin() as connection:
+            result = connection.execute(statement, [
+                {"seen_client_id": client_id, "seen_at": seen_at} for client_id, seen_at in pending.items()
+            ])
+        return result.rowcount
+
+
+last_seen = LastSeenTracker()
+
+
+def close_stale_visits(
+    db: Session,
+    idle_minutes: float = VISIT_IDLE_TIMEOUT_MINUTES,
+    now: Optional[datetime.datetime] = None
+) -> int:
+    """
+    Close open visits not seen for idle_minutes. The exit time is
+    estimated as the last sighting (the entry time if there was none).
+    Returns the number of closed visits.
+    """
+    cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(minutes=idle_minutes)
+    closed = 0
+    while True:
+        # entry_time <= last sighting, so the partial index of open visits
+        # narrows the scan to entries before the cutoff
+        visits = db.query(Visit).filter(
+            Visit.exit_time.is_(None),
+            Visit.entry_time < cutoff,
+            func.coalesce(Visit.last_seen_at, Visit.entry_time) < cutoff
+        ).order_by(Visit.entry_time).limit(_CLOSE_BATCH_SIZE).all()
+        if not visits:
+            break
+
+        batch = []
+        for visit in visits:
+            exit_time = max(visit.last_seen_at or visit.entry_time, visit.entry_time)
+            # Only if still open: the exit camera or a checkout may have
+            # closed it since it was read
+            updated = db.query(Visit).filter(Visit.id == visit.id, Visit.exit_time.is_(None)).update(
+                {Visit.exit_time: exit_time, Visit.exit_estimated: True}, synchronize_session=False
+            )
+            if not updated:
+                continue
+            set_committed_value(visit, "exit_time", exit_time)
+            set_committed_value(visit, "exit_estimated", True)
+            record_dwell(db, visit)
+            batch.append(visit)
+        db.commit()
+        for visit in batch:
+            publish_exit(visit)
+        closed += len(batch)
+
+    if closed:
+        visits_auto_closed_total.inc(closed)
+        logger.info("Closed %d visits idle for over %.0f minutes", closed, idle_minutes)
+    return closed
+
+
+sessionization_lock = ProcessLock(VISIT_SESSION_LOCK_FILE)
+
+
+def run_sessionization() -> int:
+    """
+    Flush sightings (every worker), then close stale visits (periodic task).
+    Closing runs in one worker only, the holder of VISIT_SESSION_LOCK_FILE;
+    another takes over when it exits.
+    """
+    last_seen.flush()
+    if not sessionization_lock.acquire():
+        return 0
+    db = SessionLocal()
+    try:
+        return close_stale_visits(db)
+    finally:
+        db.close()
@@ -0,0 +1,75 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+
+def percentiles(samples_ns: List[int]) -> Dict[str, float]:
+    """
+    Latency summary in milliseconds from nanosecond samples.
+    """
+    if not len(samples_ns):
+        return {}
+    ms = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+    }
+
+
+def write_report(name: str, report: Dict, output: Optional[str] = None) -> str:
+    """
+    Write a results JSON (default: benchmarks/results/<name>-<time>.json).
+    """
+    output = output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"{name}-{datetime.datetime.utcnow():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+    return output
@@ -0,0 +1,411 @@
+"""
+End-to-end load harness for the face detect endpoints.
+
+Virtual cameras post JPEG frames to /api/face/detect, /detect-entry,
+/detect-exit and /detect-multiple at a fixed frame rate. Single-face frames
+come from public/faces; /detect-multiple gets synthetic composites of
+several faces. Reports p50/p95/p99 latency, throughput, error rate, event
+loop lag and whether background visit logging keeps up.
+
+Two modes:
+
+    # In-process through an ASGI client; loop lag is the lag of the app's
+    # own event loop
+    python -m benchmarks.detect_load --cameras 1,2,4,8 --fps 2 --duration 30
+
+    # Against a running server (loop lag is then the harness's own loop)
+    python -m benchmarks.detect_load --url http://127.0.0.1:8000 --cameras 4
+
+Pass several camera counts to step the load up and find where one worker
+saturates. --enroll registers the faces from public/faces as clients first,
+so frames are recognized and visits get logged.
+
+In-process mode runs the app in benchmarks/.scratch/detect_load, with its
+own SQLite database, so enrolled clients, uploaded face images, logged
+visits and the gallery never touch the repository's database or
+public/faces. Pass --database-url to run against another database
+(e.g. the app's own) on purpose.
+
+Visits are counted with a direct query on the database, since the API's
+totals are cached per process. Against a running server, pass its
+--database-url to measure visit logging; without it visits are not counted.
+
+Note: the in-process ASGI client returns a response only after its
+background tasks finished, so in that mode latency includes visit logging.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import httpx
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from benchmarks.common import BENCHMARK_DIR, REPO_DIR, environment, percentiles, write_report
+
+ENDPOINTS = ("detect", "detect-entry", "detect-exit", "detect-multiple")
+DEFAULT_FACES_DIR = os.path.join(REPO_DIR, "public", "faces")
+DEFAULT_SCRATCH_DIR = os.path.join(BENCHMARK_DIR, ".scratch", "detect_load")
+
+# Faces per synthetic composite frame
+COMPOSITE_SIZES = (2, 3, 4)
+COMPOSITE_HEIGHT = 240
+
+
+# Frames
+
+def load_faces(directory: str) -> List[np.ndarray]:
+    faces = []
+    for name in sorted(os.listdir(directory)):
+        image = cv2.imread(os.path.join(directory, name))
+        if image is not None:
+            faces.append(image)
+    if not faces:
+        sys.exit(f"No readable images in {directory}")
+    return faces
+
+
+def encode_jpeg(image: np.ndarray) -> bytes:
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buffer.tobytes()
+
+
+def make_composites(faces: List[np.ndarray], count: int, seed: int) -> List[bytes]:
+    """
+    Side-by-side composites of 2-4 faces, resized to a common height.
+    """
+    rng = np.random.default_rng(seed)
+    composites = []
+    for _ in range(count):
+        size = min(int(rng.choice(COMPOSITE_SIZES)), len(faces))
+        picked = [faces[i] for i in rng.choice(len(faces), size=size, replace=False)]
+        resized = [
+            cv2.resize(face, (max(1, face.shape[1] * COMPOSITE_HEIGHT // face.shape[0]), COMPOSITE_HEIGHT))
+            for face in picked
+        ]
+        composites.append(encode_jpeg(np.hstack(resized)))
+    return composites
+
+
+# Measurement
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies_ns: List[int] = []
+        self.status_codes: Counter = Counter()
+        self.errors = 0
+        self.recognized = 0
+        self.missed_frames = 0
+
+    def summary(self, duration_s: float) -> Dict:
+        requests = len(self.latencies_ns)
+        failed = self.errors + sum(count for code, count in self.status_codes.items() if code >= 400)
+        return {
+            "requests": requests,
+            "throughput_per_s": requests / duration_s if duration_s else 0.0,
+            "error_rate": failed / requests if requests else 0.0,
+            "status_codes": {str(code): count for code, count in sorted(self.status_codes.items())},
+            "transport_errors": self.errors,
+            "recognized_faces": self.recognized,
+            "missed_frames": self.missed_frames,
+            "latency": percentiles(self.latencies_ns),
+        }
+
+
+def recognized_faces(endpoint: str, body: Dict) -> int:
+    if endpoint == "detect-multiple":
+        return sum(1 for face in body.get("faces", []) if face.get("is_recognized"))
+    return 1 if body.get("is_recognized") else 0
+
+
+async def camera(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    frames: List[bytes],
+    fps: float,
+    start: float,
+    deadline: float,
+    stats: EndpointStats
+) -> None:
+    """
+    One virtual camera: a frame every 1/fps seconds. Like a real camera it
+    does not queue frames while a request is in flight; late ticks are
+    counted as missed frames.
+    """
+    loop = asyncio.get_running_loop()
+    interval = 1.0 / fps
+    next_tick = start
+    for frame in itertools.cycle(frames):
+        if next_tick >= deadline:
+            return
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+        started = time.perf_counter_ns()
+        try:
+            response = await client.post(
+                f"/api/face/{endpoint}", files={"file": ("frame.jpg", frame, "image/jpeg")}
+            )
+            stats.status_codes[response.status_code] += 1
+            if response.status_code == 200:
+                stats.recognized += recognized_faces(endpoint, response.json())
+        except httpx.HTTPError:
+            stats.errors += 1
+        stats.latencies_ns.append(time.perf_counter_ns() - started)
+
+        next_tick += interval
+        behind = loop.time() - next_tick
+        if behind > 0:
+            skipped = int(behind / interval) + 1
+            stats.missed_frames += skipped
+            next_tick += skipped * interval
+
+
+async def monitor_loop_lag(samples_ns: List[int], stop: asyncio.Event, period: float = 0.01) -> None:
+    """
+    Oversleep of a short periodic timer: how long the loop was blocked.
+    """
+    while not stop.is_set():
+        started = time.perf_counter_ns()
+        await asyncio.sleep(period)
+        samples_ns.append(max(0, time.perf_counter_ns() - started - int(period * 1e9)))
+
+
+def visit_counter(database_url: str) -> Callable[[], int]:
+    """
+    COUNT(*) of the visits table. Not through the API: its totals come from
+    a per-process cache (30 s TTL), stale and different in every worker.
+    """
+    engine = create_engine(database_url)
+
+    def count() -> int:
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT COUNT(*) FROM visits")).scalar_one()
+
+    return count
+
+
+async def visit_total(count_visits: Callable[[], int]) -> int:
+    return await asyncio.to_thread(count_visits)
+
+
+async def wait_for_visit_logging(count_visits: Callable[[], int], timeout: float, settle: float = 1.0) -> Dict:
+    """
+    Poll the visit total until it stops changing: how long background
+    logging needed to catch up after the load stopped.
+    """
+    started = time.perf_counter()
+    last, last_change = await visit_total(count_visits), time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        await asyncio.sleep(0.2)
+        total = await visit_total(count_visits)
+        if total != last:
+            last, last_change = total, time.perf_counter()
+        elif time.perf_counter() - last_change >= settle:
+            break
+    return {"total": last, "drain_s": max(0.0, last_change - started)}
+
+
+async def run_step(
+    client: httpx.AsyncClient,
+    cameras: int,
+    args: argparse.Namespace,
+    singles: List[bytes],
+    composites: List[bytes],
+    count_visits: Optional[Callable[[], int]]
+) -> Dict:
+    loop = asyncio.get_running_loop()
+    endpoints = args.endpoints.split(",")
+    stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+    visits_before = await visit_total(count_visits) if count_visits else 0
+
+    lag_samples: List[int] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples, stop))
+
+    # Cameras are spread over the endpoints and staggered within one frame
+    start = loop.time() + 0.1
+    deadline = start + args.duration
+    tasks = []
+    for index in range(cameras):
+        endpoint = endpoints[index % len(endpoints)]
+        frames = composites if endpoint == "detect-multiple" else singles
+        offset = index % len(frames)
+        tasks.append(camera(
+            client, endpoint, frames[offset:] + frames[:offset], args.fps,
+            start + index / (cameras * args.fps), deadline, stats[endpoint]
+        ))
+    wall_started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    duration_s = time.perf_counter() - wall_started
+
+    stop.set()
+    await lag_task
+    visits = await wait_for_visit_logging(count_visits, args.drain_timeout) if count_visits else None
+
+    all_latencies = [latency for endpoint_stats in stats.values() for latency in endpoint_stats.latencies_ns]
+    requests = len(all_latencies)
+    failed = sum(
+        s.errors + sum(c for code, c in s.status_codes.items() if code >= 400) for s in stats.values()
+    )
+    return {
+        "cameras": cameras,
+        "fps_per_camera": args.fps,
+        "offered_rate_per_s": cameras * args.fps,
+        "duration_s": duration_s,
+        "requests": requests,
+        "throughput_per_s": requests / duration_s if duration_s else 0.0,
+        "error_rate": failed / requests if requests else 0.0,
+        "missed_frames": sum(s.missed_frames for s in stats.values()),
+        "latency": percentiles(all_latencies),
+        "endpoints": {endpoint: s.summary(duration_s) for endpoint, s in sorted(stats.items())},
+        "loop_lag": percentiles(lag_samples),
+        "visits": {
+            "created": visits["total"] - visits_before,
+            "drain_s": visits["drain_s"],
+        } if visits else None,
+    }
+
+
+async def enroll(client: httpx.AsyncClient, faces_dir: str) -> int:
+    """
+    Create one client per face image and register the face.
+    """
+    enrolled = 0
+    stamp = datetime.datetime.utcnow().strftime("%H%M%S")
+    for index, name in enumerate(sorted(os.listdir(faces_dir))):
+        with open(os.path.join(faces_dir, name), "rb") as f:
+            image = f.read()
+        response = await client.post("/api/clients/", json={
+            "first_name": "Load",
+            "last_name": f"Test {index}",
+            "gender": "Male",
+            "age": 30,
+            "phone": f"+000{stamp}{index:04d}",
+        })
+        if response.status_code != 200:
+            continue
+        registered = await client.post(
+            "/api/face/register-face",
+            data={"client_id": response.json()["id"]},
+            files={"file": (f"{name}.jpg", image, "image/jpeg")}
+        )
+        enrolled += registered.status_code == 200
+    return enrolled
+
+
+def summary_line(step: Dict) -> str:
+    latency = step["latency"]
+    visits = step["visits"]
+    return (
+        f"{step['cameras']:>3} cameras  {step['throughput_per_s']:7.1f} req/s "
+        f"(offered {step['offered_rate_per_s']:.1f})  p50 {latency.get('p50_ms', 0):7.1f}ms  "
+        f"p95 {latency.get('p95_ms', 0):7.1f}ms  p99 {latency.get('p99_ms', 0):7.1f}ms  "
+        f"errors {step['error_rate']:.1%}  missed {step['missed_frames']}  "
+        f"lag p99 {step['loop_lag'].get('p99_ms', 0):.1f}ms"
+        + (f"  visits +{visits['created']} (drain {visits['drain_s']:.1f}s)" if visits else "")
+    )
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    faces = load_faces(args.faces_dir)
+    singles = [encode_jpeg(face) for face in faces]
+    composites = make_composites(faces, args.composites, args.seed)
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=timeout)
+        lifespan = None
+    else:
+        # Must be set before the app's engine is created
+        if args.database_url:
+            os.environ["DATABASE_URL"] = args.database_url
+        else:
+            # Uploads, the gallery and other cwd-relative app files go there too
+            os.makedirs(DEFAULT_SCRATCH_DIR, exist_ok=True)
+            os.chdir(DEFAULT_SCRATCH_DIR)
+            os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(DEFAULT_SCRATCH_DIR, "detect_load.db")
+        sys.path.insert(0, REPO_DIR)
+        import main
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://detect-load", timeout=timeout
+        )
+        # Run the app's startup hooks (gallery load, change feed)
+        lifespan = main.app.router.lifespan_context(main.app)
+        await lifespan.__aenter__()
+    database_url = args.database_url if args.url else os.environ["DATABASE_URL"]
+    count_visits = visit_counter(database_url) if database_url else None
+
+    steps = []
+    try:
+        async with client:
+            if args.enroll:
+                print(f"Enrolled {await enroll(client, args.faces_dir)} faces", file=sys.stderr)
+            for cameras in [int(value) for value in args.cameras.split(",")]:
+                step = await run_step(client, cameras, args, singles, composites, count_visits)
+                steps.append(step)
+                print(summary_line(step), file=sys.stderr)
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    return {
+        "benchmark": "detect_load",
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "environment": environment(),
+        "config": {
+            "mode": "http" if args.url else "asgi",
+            "url": args.url,
+            "database_url": database_url,
+            "endpoints": args.endpoints.split(","),
+            "fps_per_camera": args.fps,
+            "duration_s": args.duration,
+            "single_face_frames": len(singles),
+            "composite_frames": len(composites),
+        },
+        "steps": steps,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server (default: in-process ASGI client)")
+    parser.add_argument("--cameras", default="4", help="comma separated camera counts, one load step each")
+    parser.add_argument("--fps", type=float, default=2.0, help="frames per second per camera")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per load step")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--faces-dir", default=DEFAULT_FACES_DIR)
+    parser.add_argument("--composites", type=int, default=20, help="number of multi-face composite frames")
+    parser.add_argument("--enroll", action="store_true", help="register the faces as clients before the run")
+    parser.add_argument("--timeout", type=float, default=30.0, help="request timeout in seconds")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                        help="seconds to wait for background visit logging after each step")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url",
+                        help="in-process mode: database to use (default: a scratch SQLite file); "
+                             "with --url: the server's database, to count logged visits")
+    parser.add_argument("--output", help="results JSON path (default: benchmarks/results/detect_load-<time>.json)")
+    args = parser.parse_args()
+    # In-process mode may change the working directory
+    args.faces_dir = os.path.abspath(args.faces_dir)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    unknown = set(args.endpoints.split(",")) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    write_report("detect_load", report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Face match benchmark on synthetic galleries.
+
+Generates synthetic 128-d encodings into a scratch SQLite database and
+measures, for each gallery size and matcher implementation:
+
+- gallery load time (cold rebuild from the table, warm start from the
+  memory-mapped snapshot),
+- per-probe latency percentiles,
+- sequential and multi-threaded throughput,
+- memory footprint,
+- recall against an exact float64 brute-force search.
+
+No camera or face model is needed. Run from the repository root:
+
+    python -m benchmarks.face_match                        # 1k, 10k, 100k, 1M
+    python -m benchmarks.face_match --sizes 1k,10k --encodings-per-client 3
+    python -m benchmarks.face_match --output benchmarks/results/v1.1.json
+
+Every size runs in its own process (with its own DATABASE_URL and
+GALLERY_DIR), so memory numbers are not polluted by the previous size.
+Scratch databases are reused between runs with the same seed.
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.common import BENCHMARK_DIR, REPO_DIR, environment, percentiles, rss_bytes, write_report
+
+DEFAULT_SIZES = "1k,10k,100k,1M"
+DEFAULT_SCRATCH_DIR = os.path.join(BENCHMARK_DIR, ".scratch")
+
+ENCODING_DIM = 128
+TOLERANCE = 0.6
+
+# Synthetic identities: random directions of norm ~1 (like dlib descriptors);
+# samples of one identity are ~0.3 apart, different identities ~1.4 apart
+CENTER_SCALE = 1.0 / np.sqrt(ENCODING_DIM)
+SAMPLE_NOISE = 0.02
+
+# Clients are generated and inserted in chunks; chunk c uses seed [seed, c]
+CHUNK_SIZE = 10000
+
+Match = Tuple[Optional[int], Optional[float]]
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+
+# Synthetic data
+
+def chunk_centers(seed: int, chunk: int, count: int) -> np.ndarray:
+    rng = np.random.default_rng([seed, chunk])
+    return (rng.standard_normal((count, ENCODING_DIM)) * CENTER_SCALE).astype(np.float32)
+
+
+def client_center(seed: int, size: int, client_index: int) -> np.ndarray:
+    chunk = client_index // CHUNK_SIZE
+    count = min(CHUNK_SIZE, size - chunk * CHUNK_SIZE)
+    return chunk_centers(seed, chunk, count)[client_index % CHUNK_SIZE]
+
+
+def generate_database(seed: int, size: int, encodings_per_client: int) -> None:
+    """
+    Insert size clients with encodings_per_client encodings each. Core
+    inserts bypass the ORM events, so no change_log rows are written.
+    """
+    from sqlalchemy import insert
+
+    from app.db.base import Base, engine
+    from app.models.models import Client, FaceEncoding
+
+    Base.metadata.create_all(bind=engine)
+    created_at = datetime.datetime.utcnow()
+
+    for chunk in range(0, (size + CHUNK_SIZE - 1) // CHUNK_SIZE):
+        first = chunk * CHUNK_SIZE
+        count = min(CHUNK_SIZE, size - first)
+        centers = chunk_centers(seed, chunk, count)
+        noise_rng = np.random.default_rng([seed, chunk, 1])
+        samples = (
+            np.repeat(centers, encodings_per_client, axis=0)
+            + noise_rng.standard_normal((count * encodings_per_client, ENCODING_DIM)) * SAMPLE_NOISE
+        ).astype(np.float32)
+
+        clients = [
+            {
+                "id": first + i + 1,
+                "first_name": "Bench",
+                "last_name": str(first + i + 1),
+                "gender": "Male",
+                "age": 30,
+                "created_at": created_at,
+                "updated_at": created_at,
+            }
+            for i in range(count)
+        ]
+        encodings = [
+            {
+                "client_id": first + row // encodings_per_client + 1,
+                "encoding_vector": json.dumps(sample.tolist()),
+                "image_path": "synthetic",
+                "created_at": created_at,
+            }
+            for row, sample in enumerate(samples)
+        ]
+        with engine.begin() as connection:
+            connection.execute(insert(Client.__table__), clients)
+            connection.execute(insert(FaceEncoding.__table__), encodings)
+        print(f"  generated {first + count}/{size} clients", file=sys.stderr)
+
+
+def generate_probes(seed: int, size: int, count: int, genuine_ratio: float) -> Tuple[np.ndarray, List[Optional[int]]]:
+    """
+    Probes of enrolled clients (new samples of their identity) mixed with
+    impostors that are not in the gallery.
+    """
+    rng = np.random.default_rng([seed, 2**31])
+    probes, truth = [], []
+    for _ in range(count):
+        if rng.random() < genuine_ratio:
+            client_index = int(rng.integers(size))
+            center = client_center(seed, size, client_index)
+            truth.append(client_index + 1)
+        else:
+            center = (rng.standard_normal(ENCODING_DIM) * CENTER_SCALE).astype(np.float32)
+            truth.append(None)
+        probes.append(center + rng.standard_normal(ENCODING_DIM).astype(np.float32) * SAMPLE_NOISE)
+    return np.asarray(probes, dtype=np.float32), truth
+
+
+# Matchers: each factory returns probe -> (client id or None, distance or None)
+
+def brute_force_matcher(snapshot) -> Callable[[np.ndarray], Match]:
+    """
+    Exact float64 search, chunked to bound memory. The recall reference.
+    """
+    matrix = snapshot.matrix
+    client_ids = np.asarray(snapshot.client_ids)
+    chunk_rows = 65536
+
+    def match(probe: np.ndarray) -> Match:
+        if not len(matrix):
+            return None, None
+        probe64 = probe.astype(np.float64)
+        best_index, best_distance = -1, np.inf
+        for start in range(0, len(matrix), chunk_rows):
+            block = np.asarray(matrix[start:start + chunk_rows], dtype=np.float64)
+            distances = np.linalg.norm(block - probe64, axis=1)
+            index = int(np.argmin(distances))
+            if distances[index] < best_distance:
+                best_index, best_distance = start + index, float(distances[index])
+        if best_distance < TOLERANCE:
+            return int(client_ids[best_index]), best_distance
+        return None, None
+
+    return match
+
+
+def gallery_matcher(gallery) -> Callable[[np.ndarray], Match]:
+    """
+    The production path: SharedFaceGallery.match (generation check + float32
+    norm-expansion search over the memory-mapped snapshot).
+    """
+    def match(probe: np.ndarray) -> Match:
+        client_id, _, distance = gallery.match(probe, TOLERANCE)
+        return client_id, distance
+
+    return match
+
+
+def legacy_table_scan_matcher() -> Callable[[np.ndarray], Match]:
+    """
+    The original find_matching_client: read every face_encodings row, decode
+    its JSON and compare one row at a time, on every probe.
+    """
+    from app.db.base import SessionLocal
+    from app.models.models import FaceEncoding
+
+    def match(probe: np.ndarray) -> Match:
+        probe64 = probe.astype(np.float64)
+        db = SessionLocal()
+        try:
+            rows = db.query(FaceEncoding.client_id, FaceEncoding.encoding_vector).all()
+        finally:
+            db.close()
+        best_client, best_distance = None, 1.0
+        for client_id, encoding_vector in rows:
+            distance = float(np.linalg.norm(np.array(json.loads(encoding_vector)) - probe64))
+            if distance < TOLERANCE and distance < best_distance:
+                best_client, best_distance = client_id, distance
+        return (best_client, best_distance) if best_client is not None else (None, None)
+
+    return match
+
+
+def measure_matcher(
+    match: Callable[[np.ndarray], Match],
+    probes: np.ndarray,
+    truth: List[Optional[int]],
+    reference: Optional[List[Optional[int]]],
+    threads: int
+) -> Dict:
+    for probe in probes[:5]:
+        match(probe)
+
+    latencies, predictions = [], []
+    started = time.perf_counter()
+    for probe in probes:
+        t0 = time.perf_counter_ns()
+        client_id, _ = match(probe)
+        latencies.append(time.perf_counter_ns() - t0)
+        predictions.append(client_id)
+    sequential_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(match, probes))
+    threaded_s = time.perf_counter() - started
+
+    genuine = [i for i, expected in enumerate(truth) if expected is not None]
+    impostors = [i for i, expected in enumerate(truth) if expected is None]
+    result = {
+        "probes": len(probes),
+        "latency": percentiles(latencies),
+        "throughput_per_s": len(probes) / sequential_s,
+        "threaded_throughput_per_s": len(probes) / threaded_s,
+        "threads": threads,
+        "identification_rate": (
+            sum(predictions[i] == truth[i] for i in genuine) / len(genuine) if genuine else None
+        ),
+        "false_accept_rate": (
+            sum(predictions[i] is not None for i in impostors) / len(impostors) if impostors else None
+        ),
+    }
+    if reference is not None:
+        result["recall_vs_brute_force"] = (
+            sum(predictions[i] == reference[i] for i in range(len(predictions))) / len(predictions)
+        )
+    return result
+
+
+# One gallery size (runs in a child process)
+
+def run_size(args: argparse.Namespace) -> Dict:
+    from app.db.base import engine
+    from app.services.face_recognition.gallery import SharedFaceGallery
+
+    size = args.size
+    rows = size * args.encodings_per_client
+    gallery_dir = os.environ["GALLERY_DIR"]
+
+    # Cold: the whole table is read and decoded
+    for name in os.listdir(gallery_dir) if os.path.isdir(gallery_dir) else []:
+        os.remove(os.path.join(gallery_dir, name))
+    started = time.perf_counter()
+    SharedFaceGallery(gallery_dir).load()
+    cold_load_s = time.perf_counter() - started
+
+    # Warm: what a restarted worker does
+    started = time.perf_counter()
+    SharedFaceGallery(gallery_dir).load(verify=False)
+    warm_load_s = time.perf_counter() - started
+
+    rss_before = rss_bytes()
+    gallery = SharedFaceGallery(gallery_dir)
+    started = time.perf_counter()
+    snapshot = gallery.load(verify=True)
+    warm_verified_load_s = time.perf_counter() - started
+
+    probes, truth = generate_probes(args.seed, size, args.probes, args.genuine_ratio)
+    # Touch every page once so RSS reflects the mapped gallery
+    gallery.match(probes[0], TOLERANCE)
+    rss_after = rss_bytes()
+
+    disk_bytes = sum(
+        os.path.getsize(os.path.join(gallery_dir, name))
+        for name in os.listdir(gallery_dir)
+        if name.startswith(f"gallery-{snapshot.generation:08d}.")
+    )
+    result = {
+        "identities": size,
+        "encodings_per_client": args.encodings_per_client,
+        "encodings": rows,
+        "load": {
+            "cold_rebuild_s": cold_load_s,
+            "warm_start_s": warm_load_s,
+            "warm_start_verified_s": warm_verified_load_s,
+        },
+        "memory": {
+            "gallery_array_bytes": int(sum(array.nbytes for array in snapshot.arrays().values())),
+            "gallery_disk_bytes": disk_bytes,
+            "rss_before_load_bytes": rss_before,
+            "rss_after_load_bytes": rss_after,
+        },
+        "matchers": {},
+    }
+
+    brute_force = brute_force_matcher(snapshot)
+    reference = [brute_force(probe)[0] for probe in probes]
+    result["matchers"]["brute_force"] = measure_matcher(brute_force, probes, truth, None, args.threads)
+    result["matchers"]["gallery"] = measure_matcher(
+        gallery_matcher(gallery), probes, truth, reference, args.threads
+    )
+    if rows <= args.legacy_max_rows:
+        count = min(args.legacy_probes, len(probes))
+        result["matchers"]["legacy_table_scan"] = measure_matcher(
+            legacy_table_scan_matcher(), probes[:count], truth[:count], reference[:count], args.threads
+        )
+
+    engine.dispose()
+    return result
+
+
+def child_main(args: argparse.Namespace) -> None:
+    scratch = os.path.join(args.scratch_dir, f"seed{args.seed}-n{args.size}-k{args.encodings_per_client}")
+    os.makedirs(scratch, exist_ok=True)
+    db_path = os.path.join(scratch, "bench.db")
+    marker = os.path.join(scratch, "generated")
+
+    if args.regenerate or not os.path.exists(marker):
+        for name in ("bench.db", "bench.db-wal", "bench.db-shm", "generated"):
+            if os.path.exists(os.path.join(scratch, name)):
+                os.remove(os.path.join(scratch, name))
+
+    # Must be set before the app's engine is created
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["GALLERY_DIR"] = os.path.join(scratch, "gallery")
+    sys.path.insert(0, REPO_DIR)
+
+    if args.generate_only:
+        generate_database(args.seed, args.size, args.encodings_per_client)
+        open(marker, "w").close()
+        return
+
+    generation_s = None
+    if not os.path.exists(marker):
+        # Separate process, so generation garbage does not show up in RSS
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.face_match"] + sys.argv[1:] + ["--generate-only"],
+            cwd=REPO_DIR, check=True
+        )
+        generation_s = time.perf_counter() - started
+
+    result = run_size(args)
+    result["generation_s"] = generation_s
+    print(json.dumps(result))
+
+
+# Driver
+
+def summary_line(result: Dict) -> str:
+    gallery = result["matchers"]["gallery"]
+    return (
+        f"{result['identities']:>8} ids  cold {result['load']['cold_rebuild_s']:.2f}s  "
+        f"warm {result['load']['warm_start_s']:.3f}s  "
+        f"p50 {gallery['latency']['p50_ms']:.2f}ms  p99 {gallery['latency']['p99_ms']:.2f}ms  "
+        f"{gallery['throughput_per_s']:.0f}/s  recall {gallery['recall_vs_brute_force']:.3f}  "
+        f"rss {result['memory']['rss_after_load_bytes'] / 2**20:.0f}MB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated identity counts (1k, 10k, 1M, ...)")
+    parser.add_argument("--encodings-per-client", type=int, default=1)
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--genuine-ratio", type=float, default=0.8, help="share of probes from enrolled clients")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--legacy-max-rows", type=int, default=20000,
+                        help="only run the legacy table scan for galleries up to this many encodings")
+    parser.add_argument("--legacy-probes", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scratch-dir", default=DEFAULT_SCRATCH_DIR)
+    parser.add_argument("--regenerate", action="store_true", help="rebuild scratch databases")
+    parser.add_argument("--output", help="results JSON path (default: benchmarks/results/face_match-<time>.json)")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--generate-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        child_main(args)
+        return
+
+    results = []
+    for size in [parse_size(value) for value in args.sizes.split(",")]:
+        print(f"Benchmarking {size} identities...", file=sys.stderr)
+        command = [
+            sys.executable, "-m", "benchmarks.face_match",
+            "--size", str(size),
+            "--encodings-per-client", str(args.encodings_per_client),
+            "--probes", str(args.probes),
+            "--genuine-ratio", str(args.genuine_ratio),
+            "--threads", str(args.threads),
+            "--legacy-max-rows", str(args.legacy_max_rows),
+            "--legacy-probes", str(args.legacy_probes),
+            "--seed", str(args.seed),
+            "--scratch-dir", os.path.abspath(args.scratch_dir),
+        ] + (["--regenerate"] if args.regenerate else [])
+        completed = subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            sys.exit(f"Benchmark for {size} identities failed")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(summary_line(result), file=sys.stderr)
+
+    report = {
+        "benchmark": "face_match",
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "environment": environment(),
+        "config": {
+            "sizes": [result["identities"] for result in results],
+            "encodings_per_client": args.encodings_per_client,
+            "probes": args.probes,
+            "genuine_ratio": args.genuine_ratio,
+            "tolerance": TOLERANCE,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    write_report("face_match", report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Bulk synthetic data generator for scale testing the database layer.
+
+Fills a database with realistic, reproducible data through batched Core
+inserts (executemany), e.g. the production-scale default set:
+
+    python -m benchmarks.generate_data                                  # 1M clients, 10M visits, 1M encodings, 10k cars
+    python -m benchmarks.generate_data --clients 10k --visits 100k --encodings 10k --cars 500
+    python -m benchmarks.generate_data --database-url sqlite:///./big.db --seed 7
+
+Without --database-url a scratch SQLite file under benchmarks/.scratch/data
+is used; the path is printed so it can be passed to the app or another
+benchmark as DATABASE_URL.
+
+The same seed, sizes and --end-date always give the same rows. Every table is generated
+chunk by chunk, each chunk from its own seeded generator, so memory stays
+flat at any size.
+
+- clients: names, ages, budgets, credit, workplace and purpose drawn from
+  the values the API accepts;
+- cars: catalog in the shape of update_gm_cars (UZS prices, features JSON
+  with the keys the recommendation engine scores);
+- face_encodings: 128-d unit-scale vectors, one identity per client;
+- visits: entry times spread over --days with showroom hours, dwell times,
+  a few still open, skewed visit counts per client and recommendations
+  JSON for most visits.
+
+Core inserts bypass the ORM events, so no change_log rows are written; the
+face gallery rebuilds itself on the next load because its row count no
+longer matches.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, Iterator, List
+
+import numpy as np
+
+from benchmarks.common import BENCHMARK_DIR, REPO_DIR
+from benchmarks.face_match import parse_size
+
+DEFAULT_SCRATCH_DIR = os.path.join(BENCHMARK_DIR, ".scratch", "data")
+
+ENCODING_DIM = 128
+CENTER_SCALE = 1.0 / np.sqrt(ENCODING_DIM)
+
+FIRST_NAMES = {
+    "Male": ["Aziz", "Bekzod", "Jasur", "Sardor", "Rustam", "Otabek", "Javlon", "Sherzod",
+             "Timur", "Ulugbek", "Akmal", "Farrukh", "John", "Michael", "David", "Alexander"],
+    "Female": ["Dilnoza", "Madina", "Nilufar", "Gulnora", "Shahnoza", "Malika", "Zarina",
+               "Kamola", "Sevara", "Nargiza", "Emma", "Sophia", "Anna", "Elena"],
+}
+LAST_NAMES = ["Karimov", "Rahimov", "Aliyev", "Yusupov", "Tashkentov", "Nazarov", "Ismoilov",
+              "Abdullayev", "Qodirov", "Saidov", "Ergashev", "Mirzayev", "Smith", "Johnson",
+              "Brown", "Garcia", "Ivanov", "Petrov"]
+INTERESTS = ["Sedans", "SUVs", "Fuel efficiency", "Family cars", "Luxury", "Sports cars",
+             "Electric vehicles", "Low price", "Technology", "Safety", "Spacious interior"]
+WORKPLACES = ["Uzbektelekom", "Hamkorbank", "Artel", "UzAuto Motors", "Korzinka", "Tashkent University",
+              "Ministry of Health", "Private business", "Uzbekistan Airways", "IT Park", None]
+PURPOSES = ["View new cars", "Access services", "Schedule test drive", "Manage documents",
+            "Get information", "Purchase car", "Other"]
+PURPOSE_WEIGHTS = [0.3, 0.15, 0.15, 0.05, 0.2, 0.1, 0.05]
+
+# (brand, models, category, base price in UZS)
+CAR_LINES = [
+    ("Chevrolet", ["Onix", "Cobalt", "Lacetti", "Malibu", "Monza"], "Sedan", 150_000_000),
+    ("Chevrolet", ["Tracker", "Captiva", "Equinox", "Traverse", "Tahoe"], "SUV", 300_000_000),
+    ("Chevrolet", ["Spark", "Nexia"], "Hatchback", 110_000_000),
+    ("Chevrolet", ["Damas", "Labo"], "LCV", 93_000_000),
+    ("Kia", ["K5", "Sportage", "Sorento", "Seltos"], "Crossover", 330_000_000),
+    ("Hyundai", ["Elantra", "Sonata", "Tucson", "Santa Fe"], "Sedan", 320_000_000),
+    ("Toyota", ["Camry", "Corolla", "RAV4", "Land Cruiser"], "SUV", 450_000_000),
+    ("BYD", ["Song Plus", "Han", "Chazor", "Seal"], "Electric", 380_000_000),
+    ("Mercedes-Benz", ["E-Class", "S-Class", "GLE"], "Luxury", 1_100_000_000),
+    ("BMW", ["X5", "5 Series", "M4"], "Coupe", 1_000_000_000),
+]
+CAR_FEATURES = ["luxury", "electric", "sporty", "family_friendly", "powerful", "prestige",
+                "safety", "spacious", "fuel_efficient", "comfort", "affordable", "technology"]
+
+VISIT_RECOMMENDATION_RATE = 0.7
+# Share of the newest visits that still have someone in the showroom
+OPEN_VISIT_TAIL = 0.001
+OPEN_VISIT_RATE = 0.5
+# Visit counts per client: client rank = n * u ** skew, regulars come first
+VISIT_CLIENT_SKEW = 1.3
+
+
+def chunks(total: int, chunk_size: int) -> Iterator[range]:
+    for first in range(0, total, chunk_size):
+        yield range(first, min(first + chunk_size, total))
+
+
+def generate_cars(seed: int, count: int, start: datetime.datetime) -> List[Dict]:
+    """
+    The whole catalog at once; visits pick their recommendations from it.
+    """
+    rng = np.random.default_rng([seed, 1])
+    lines = rng.integers(len(CAR_LINES), size=count)
+    years = rng.integers(2015, 2026, size=count)
+    # Trim levels and markups around the line's base price
+    price_factors = rng.lognormal(0.0, 0.25, size=count)
+    feature_flags = rng.random((count, len(CAR_FEATURES))) < 0.35
+
+    cars = []
+    for i in range(count):
+        brand, models, category, base_price = CAR_LINES[lines[i]]
+        model = models[i % len(models)]
+        features = {name: True for name, flag in zip(CAR_FEATURES, feature_flags[i]) if flag}
+        features["seats"] = 2 if category == "Coupe" else 7 if category == "SUV" else 5
+        cars.append({
+            "id": i + 1,
+            "name": f"{model} {i + 1}",
+            "brand": brand,
+            "model": model,
+            "price": float(round(base_price * price_factors[i], -5)),
+            "year": int(years[i]),
+            "category": category,
+            "features": json.dumps(features),
+            "image_url": None,
+            "created_at": start,
+        })
+    return cars
+
+
+def generate_clients(seed: int, rows: range, start: datetime.datetime, days: int) -> List[Dict]:
+    rng = np.random.default_rng([seed, 2, rows.start])
+    count = len(rows)
+    genders = np.where(rng.random(count) < 0.62, "Male", "Female")
+    first_picks = rng.integers(1 << 30, size=count)
+    last_picks = rng.integers(len(LAST_NAMES), size=count)
+    ages = np.clip(rng.normal(38, 11, size=count), 18, 80).astype(int)
+    budgets = np.round(rng.lognormal(np.log(250_000_000), 0.6, size=count), -6)
+    interest_masks = rng.random((count, len(INTERESTS))) < 0.2
+    has_credit = rng.choice(["Yes", "No", None], size=count, p=[0.35, 0.5, 0.15])
+    workplaces = rng.integers(len(WORKPLACES), size=count)
+    purposes = rng.choice(PURPOSES, size=count, p=PURPOSE_WEIGHTS)
+    phones = rng.integers(0, 10_000_000, size=count)
+    operators = rng.choice([90, 91, 93, 94, 97, 99, 33, 88], size=count)
+    created_offsets = rng.random(count) * days * 86400
+
+    clients = []
+    for i, client_id in enumerate(rows):
+        gender = str(genders[i])
+        names = FIRST_NAMES[gender]
+        last_name = LAST_NAMES[last_picks[i]]
+        if gender == "Female" and last_name.endswith("v"):
+            last_name += "a"
+        interests = [name for name, flag in zip(INTERESTS, interest_masks[i]) if flag]
+        created_at = start + datetime.timedelta(seconds=float(created_offsets[i]))
+        clients.append({
+            "id": client_id + 1,
+            "first_name": names[first_picks[i] % len(names)],
+            "last_name": last_name,
+            "gender": gender,
+            "age": int(ages[i]),
+            "phone": f"+998 {operators[i]} {phones[i] // 10000:03d} {phones[i] // 100 % 100:02d} {phones[i] % 100:02d}",
+            "interests": ", ".join(interests) or None,
+            "budget": float(budgets[i]),
+            "has_credit": has_credit[i],
+            "workplace": WORKPLACES[workplaces[i]],
+            "purpose": str(purposes[i]),
+            "created_at": created_at,
+            "updated_at": created_at,
+        })
+    return clients
+
+
+def generate_encodings(seed: int, rows: range, clients: int, start: datetime.datetime) -> List[Dict]:
+    rng = np.random.default_rng([seed, 3, rows.start])
+    vectors = rng.standard_normal((len(rows), ENCODING_DIM)) * CENTER_SCALE
+    return [
+        {
+            "id": encoding_id + 1,
+            # One identity per client, extra encodings wrap around
+            "client_id": encoding_id % clients + 1,
+            "encoding_vector": json.dumps(vector.tolist()),
+            "image_path": "synthetic",
+            "created_at": start,
+        }
+        for encoding_id, vector in zip(rows, vectors)
+    ]
+
+
+def generate_visits(
+    seed: int, rows: range, total: int, client_order: np.ndarray, cars: List[Dict],
+    start: datetime.datetime, days: int
+) -> List[Dict]:
+    rng = np.random.default_rng([seed, 4, rows.start])
+    count = len(rows)
+    # Visit ids follow entry time; about 10 hours of showroom traffic a day
+    day_position = (np.arange(rows.start, rows.stop) + rng.random(count)) / total * days
+    entry_offsets = np.floor(day_position) * 86400 + 9 * 3600 + (day_position % 1) * 10 * 3600
+    dwell = np.clip(rng.lognormal(np.log(40 * 60), 0.6, size=count), 120, 5 * 3600)
+    is_open = (rng.random(count) < OPEN_VISIT_RATE) & (np.arange(rows.start, rows.stop) >= total * (1 - OPEN_VISIT_TAIL))
+    # Ranks index a fixed shuffle, so regulars are spread over the id range
+    client_ids = client_order[(len(client_order) * rng.random(count) ** VISIT_CLIENT_SKEW).astype(np.int64)] + 1
+    purposes = rng.choice(PURPOSES, size=count, p=PURPOSE_WEIGHTS)
+    with_recommendations = rng.random(count) < VISIT_RECOMMENDATION_RATE
+    recommended = rng.integers(len(cars), size=(count, 3)) if cars else None
+    scores = np.round(rng.uniform(50, 100, size=(count, 3)), 1)
+
+    visits = []
+    for i, visit_id in enumerate(rows):
+        entry_time = start + datetime.timedelta(seconds=float(entry_offsets[i]))
+        recommendations = None
+        if recommended is not None and with_recommendations[i]:
+            recommendations = json.dumps([
+                {
+                    "car_id": cars[car]["id"],
+                    "name": f"{cars[car]['brand']} {cars[car]['model']}",
+                    "interest_score": float(score),
+                }
+                for car, score in sorted(zip(recommended[i], scores[i]), key=lambda pair: -pair[1])
+            ])
+        visits.append({
+            "id": visit_id + 1,
+            "client_id": int(client_ids[i]),
+            "entry_time": entry_time,
+            "exit_time": None if is_open[i] else entry_time + datetime.timedelta(seconds=float(dwell[i])),
+            "purpose": str(purposes[i]),
+            "recommendations": recommendations,
+        })
+    return visits
+
+
+def insert_table(connection, table, total: int, chunk_size: int, generate: Callable[[range], List[Dict]]) -> Dict:
+    """
+    Insert total rows chunk by chunk: one executemany and one transaction
+    per chunk.
+    """
+    from sqlalchemy import insert
+
+    started = time.perf_counter()
+    statement = insert(table)
+    for rows in chunks(total, chunk_size):
+        batch = generate(rows)
+        with connection.begin():
+            connection.execute(statement, batch)
+        elapsed = time.perf_counter() - started
+        print(f"  {table.name}: {rows.stop}/{total} ({rows.stop / elapsed:,.0f} rows/s)", file=sys.stderr)
+    seconds = time.perf_counter() - started
+    return {"rows": total, "seconds": seconds, "rows_per_second": total / seconds if seconds else None}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=parse_size, default="1M")
+    parser.add_argument("--visits", type=parse_size, default="10M")
+    parser.add_argument("--encodings", type=parse_size, default="1M")
+    parser.add_argument("--cars", type=parse_size, default="10k")
+    parser.add_argument("--days", type=int, default=730, help="history the visits and clients span")
+    parser.add_argument("--end-date", type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="last day of that history, YYYY-MM-DD (default: today)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows per executemany batch")
+    parser.add_argument("--database-url", help="target database (default: a scratch SQLite file)")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate the tables first")
+    args = parser.parse_args(argv)
+
+    if args.clients < 1 and (args.visits or args.encodings):
+        parser.error("visits and encodings need at least one client")
+
+    database_url = args.database_url
+    if not database_url:
+        os.makedirs(DEFAULT_SCRATCH_DIR, exist_ok=True)
+        database_url = "sqlite:///" + os.path.join(DEFAULT_SCRATCH_DIR, f"seed{args.seed}.db")
+    # Must be set before the app's engine is created
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, REPO_DIR)
+
+    from sqlalchemy import func, select
+
+    from app.db.base import IS_SQLITE, Base, engine, optimize_database
+    from app.db.client_search import ensure_client_search_index
+    from app.models.models import Car, Client, FaceEncoding, Visit
+
+    if args.reset:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    tables = [Car.__table__, Client.__table__, FaceEncoding.__table__, Visit.__table__]
+    with engine.connect() as connection:
+        non_empty = [t.name for t in tables if connection.execute(select(func.count()).select_from(t)).scalar()]
+    if non_empty:
+        sys.exit(f"Tables already contain rows: {', '.join(non_empty)} (use --reset to start over)")
+
+    print(f"Generating into {database_url}", file=sys.stderr)
+    start = datetime.datetime.combine(args.end_date, datetime.time()) - datetime.timedelta(days=args.days - 1)
+    started = time.perf_counter()
+
+    report = {}
+    # One connection for the whole load, so the PRAGMA applies to every chunk
+    with engine.connect() as connection:
+        if IS_SQLITE:
+            # A crash mid-run means regenerating anyway
+            connection.exec_driver_sql("PRAGMA synchronous=OFF")
+
+        # Secondary indexes are built once at the end instead of per row
+        indexes = [index for table in tables for index in table.indexes]
+        for index in indexes:
+            index.drop(connection, checkfirst=True)
+        connection.commit()
+
+        cars = generate_cars(args.seed, args.cars, start)
+        report["cars"] = insert_table(
+            connection, Car.__table__, args.cars, args.chunk_size,
+            lambda rows: cars[rows.start:rows.stop]
+        )
+        report["clients"] = insert_table(
+            connection, Client.__table__, args.clients, args.chunk_size,
+            lambda rows: generate_clients(args.seed, rows, start, args.days)
+        )
+        report["face_encodings"] = insert_table(
+            connection, FaceEncoding.__table__, args.encodings, args.chunk_size,
+            lambda rows: generate_encodings(args.seed, rows, args.clients, start)
+        )
+        client_order = np.random.default_rng([args.seed, 5]).permutation(args.clients)
+        report["visits"] = insert_table(
+            connection, Visit.__table__, args.visits, args.chunk_size,
+            lambda rows: generate_visits(args.seed, rows, args.visits, client_order, cars, start, args.days)
+        )
+
+        index_started = time.perf_counter()
+        for index in indexes:
+            index.create(connection, checkfirst=True)
+        connection.commit()
+    report["indexes"] = {"count": len(indexes), "seconds": time.perf_counter() - index_started}
+    print(f"  rebuilt {len(indexes)} indexes in {report['indexes']['seconds']:.1f}s", file=sys.stderr)
+
+    search_started = time.perf_counter()
+    ensure_client_search_index()
+    report["client_search_index"] = {"seconds": time.perf_counter() - search_started}
+
+    optimize_database()
+    report["total_seconds"] = time.perf_counter() - started
+
+    print(json.dumps({"database_url": database_url, "seed": args.seed, "tables": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Import-time budget check for the app.
+
+Imports main in a fresh interpreter per deployment role (APP_ROLE) and
+fails (exit code 1) when:
+
+- the import takes longer than the budget (best of --repeat runs), or
+- one of the heavy ML libraries got imported; they must stay lazy and
+  only load on the first recognition request.
+
+Run from the repository root, e.g. in CI:
+
+    python -m benchmarks.import_budget
+    python -m benchmarks.import_budget --roles api --budget 1.5
+
+The slowest imports made by main (from python -X importtime) are printed and
+written to the results JSON, to show where a regression came from.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.common import BENCHMARK_DIR, REPO_DIR, environment, write_report
+
+DEFAULT_ROLES = "api,recognition,all"
+DEFAULT_BUDGET_SECONDS = 3.0
+DEFAULT_SCRATCH_DIR = os.path.join(BENCHMARK_DIR, ".scratch", "import_budget")
+
+# Must not be imported by "import main" in any role
+HEAVY_MODULES = ("face_recognition", "dlib", "cv2", "deepface", "lightgbm", "tensorflow", "torch")
+
+_CHILD_CODE = (
+    "import json, sys; import main; "
+    f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+)
+
+
+def parse_importtime(stderr: str, top: int) -> List[Dict]:
+    """
+    Slowest imports made directly by main, from python -X importtime output.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line.split("|", 2)
+        # Nested imports are indented two spaces per level below their parent
+        if (len(name) - len(name.lstrip()) - 1) // 2 != 1:
+            continue
+        imports.append({"module": name.strip(), "cumulative_ms": int(cumulative_us) / 1000})
+    imports.sort(key=lambda entry: entry["cumulative_ms"], reverse=True)
+    return imports[:top]
+
+
+def measure_role(role: str, repeat: int, scratch_dir: str, top: int) -> Dict:
+    role_dir = os.path.join(scratch_dir, role)
+    os.makedirs(role_dir, exist_ok=True)
+    env = dict(
+        os.environ,
+        APP_ROLE=role,
+        DATABASE_URL=f"sqlite:///{os.path.join(role_dir, 'app.db')}",
+        GALLERY_DIR=os.path.join(role_dir, "gallery"),
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])),
+    )
+
+    timings = []
+    heavy: List[str] = []
+    slowest: List[Dict] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _CHILD_CODE],
+            cwd=REPO_DIR, env=env, capture_output=True, text=True
+        )
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            raise RuntimeError(f"import main failed for role {role}:\n{result.stderr[-2000:]}")
+        if not timings or elapsed < min(timings):
+            slowest = parse_importtime(result.stderr, top)
+        timings.append(elapsed)
+        heavy = json.loads(result.stdout.strip().splitlines()[-1])
+
+    return {
+        "role": role,
+        "best_seconds": min(timings),
+        "runs_seconds": timings,
+        "heavy_modules_imported": heavy,
+        "slowest_imports": slowest,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roles", default=DEFAULT_ROLES, help="comma-separated APP_ROLE values")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_SECONDS,
+                        help="max seconds for 'import main' (best run)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to report")
+    parser.add_argument("--scratch-dir", default=DEFAULT_SCRATCH_DIR)
+    parser.add_argument("--output", help="results JSON path")
+    args = parser.parse_args(argv)
+
+    results = []
+    failures = []
+    for role in [r.strip() for r in args.roles.split(",") if r.strip()]:
+        result = measure_role(role, args.repeat, args.scratch_dir, args.top)
+        results.append(result)
+
+        print(f"{role:<12} import main: {result['best_seconds']:.2f}s (budget {args.budget:.2f}s)")
+        for entry in result["slowest_imports"]:
+            print(f"    {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+
+        if result["best_seconds"] > args.budget:
+            failures.append(f"{role}: import took {result['best_seconds']:.2f}s, budget is {args.budget:.2f}s")
+        if result["heavy_modules_imported"]:
+            failures.append(f"{role}: imported {', '.join(result['heavy_modules_imported'])} at startup")
+
+    write_report("import_budget", {
+        "environment": environment(),
+        "budget_seconds": args.budget,
+        "results": results,
+        "failures": failures,
+    }, args.output)
+
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
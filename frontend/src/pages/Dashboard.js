@@ -12,7 +12,7 @@ import {
 import { Card, CardHeader, CardTitle, CardContent } from '../components/ui/Card';
 import Button from '../components/ui/Button';
 import Spinner from '../components/ui/Spinner';
-import { getCurrentVisits, getVisitCount, getClientStats } from '../utils/api';
+import { getCurrentVisits, getVisitCount, getClientStats, subscribeToVisits } from '../utils/api';
 
 const Dashboard = () => {
   const [currentVisits, setCurrentVisits] = useState([]);
@@ -44,17 +44,20 @@ const Dashboard = () => {
 
     fetchData();
 
-    // Poll for current visits every 30 seconds
-    const interval = setInterval(async () => {
-      try {
-        const visitsResponse = await getCurrentVisits();
-        setCurrentVisits(visitsResponse);
-      } catch (error) {
-        console.error('Error polling current visits:', error);
-      }
-    }, 5000);
+    // Listen for visit events instead of polling
+    const unsubscribe = subscribeToVisits({
+      snapshot: (visits) => setCurrentVisits(visits),
+      entry: (visit) => setCurrentVisits((visits) => [
+        ...visits.filter((v) => v.id !== visit.id),
+        visit
+      ]),
+      exit: ({ id }) => setCurrentVisits((visits) => visits.filter((v) => v.id !== id)),
+      recommendation: ({ id, recommendations }) => setCurrentVisits((visits) =>
+        visits.map((v) => (v.id === id ? { ...v, recommendations } : v))
+      ),
+    });
 
-    return () => clearInterval(interval);
+    return () => unsubscribe();
   }, []);
 
   // Calculate pagination values
@@ -14,7 +14,7 @@ const api = axios.create({
 export const getClients = async () => {
   try {
     const response = await api.get('/clients');
-    return response.data;
+    return response.data.items;
   } catch (error) {
     throw error;
   }
@@ -56,18 +56,19 @@ export const deleteClient = async (id) => {
 export const getVisits = async () => {
   try {
     const response = await api.get('/visits');
-    console.log('Visit data from API:', response.data); // Debug uchun
+    const visits = response.data.items;
+    console.log('Visit data from API:', visits); // Debug uchun
     
     // Ma'lumotlarni tekshirish
-    if (Array.isArray(response.data)) {
-      response.data.forEach(visit => {
+    if (Array.isArray(visits)) {
+      visits.forEach(visit => {
         if (!visit.purpose) {
           visit.purpose = "Not specified";
         }
       });
     }
     
-    return response.data;
+    return visits;
   } catch (error) {
     console.error('Error fetching visits:', error);
     throw error;
@@ -79,9 +80,18 @@ export const getCurrentVisits = async () => {
   return response.data;
 };
 
+// Joriy tashriflar oqimi (server-sent events): snapshot, entry, exit, recommendation
+export const subscribeToVisits = (handlers) => {
+  const source = new EventSource(`${API_URL}/visits/stream`);
+  Object.entries(handlers).forEach(([eventType, handler]) => {
+    source.addEventListener(eventType, (event) => handler(JSON.parse(event.data)));
+  });
+  return () => source.close();
+};
+
 export const getClientVisits = async (clientId) => {
   const response = await api.get(`/visits/client/${clientId}`);
-  return response.data;
+  return response.data.items;
 };
 
 export const createVisit = async (visitData) => {
@@ -97,7 +107,7 @@ export const checkoutVisit = async (visitId) => {
 // Cars
 export const getCars = async () => {
   const response = await api.get('/cars');
-  return response.data;
+  return response.data.items;
 };
 
 export const getCar = async (id) => {
@@ -0,0 +1,38 @@
+"""
+Pre-fork server mode: gunicorn -c gunicorn.conf.py main:app
+
+The app (ML libraries, face models, the memory-mapped gallery snapshot) is
+loaded once in the master process and then forked, so workers share those
+pages copy-on-write instead of each loading its own copy.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count(), 4))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+
+def when_ready(server):
+    # Runs in the master after the app was imported, before workers fork
+    from app.api import SERVES_RECOGNITION
+    from app.services.face_recognition.gallery import face_gallery
+    from app.services.face_recognition.recognition import load_ml_libraries
+
+    if not SERVES_RECOGNITION:
+        return
+
+    # The ML libraries are imported lazily; import them here to share them
+    load_ml_libraries()
+    snapshot = face_gallery.load()
+    server.log.info("Face gallery preloaded: generation %d, %d encodings", snapshot.generation, len(snapshot))
+
+
+def post_fork(server, worker):
+    # Database connections opened in the master must not be shared with workers
+    from app.db.base import async_engine, engine
+
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
@@ -1,13 +1,32 @@
+import asyncio
+import functools
+import logging
+import os
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from app.api import api_router
-from app.db.base import engine, Base
+from app.api import SERVES_RECOGNITION, api_router
+from app.api.endpoints import cars, monitoring
+from app.db.base import engine, async_engine, Base, DB_OPTIMIZE_INTERVAL, optimize_database
+from app.db.client_search import ensure_client_search_index
+from app.db.changes import CHANGE_FEED_POLL_INTERVAL, change_feed
+from app.services.face_recognition.gallery import face_gallery
+from app.services.face_recognition.recognition import face_service, load_ml_libraries
+from app.services.ingest.cameras import CAMERA_LOCK_RETRY_SECONDS, camera_ingest
+from app.services.metrics.middleware import RequestMetricsMiddleware
+from app.services.profiling.middleware import ProfilingMiddleware
+from app.services.profiling.profiler import PROFILING_AVAILABLE
+from app.services.startup.warmup import WARMUP_IMAGE, startup_warmup
+from app.services.visits.sessions import VISIT_SESSION_INTERVAL, last_seen, run_sessionization
 # from app.db.init_db import create_sample_data  # Import sample data function - vaqtincha o'chirib qo'yamiz
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+# FTS5 index behind /api/clients/search (built on first run)
+ensure_client_search_index()
 
 # Initialize database with sample data
 # create_sample_data()  # Bu qatorni vaqtincha kommentariyaga olib qo'yamiz
@@ -27,16 +46,125 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms for /metrics
+app.add_middleware(RequestMetricsMiddleware)
+
+# On-demand request profiling; not installed at all without PROFILING_TOKEN
+if PROFILING_AVAILABLE:
+    app.add_middleware(ProfilingMiddleware)
+
 # Mount static files for face images
 app.mount("/faces", StaticFiles(directory="public/faces"), name="faces")
 
 # Include API router
 app.include_router(api_router, prefix="/api")
 
+# /metrics and /ready live outside /api for scrapers and load balancers
+app.include_router(monitoring.router, tags=["monitoring"])
+
+logger = logging.getLogger(__name__)
+
+
+async def optimize_database_periodically():
+    while True:
+        try:
+            await run_in_threadpool(optimize_database)
+        except Exception:
+            logger.exception("Database optimize failed")
+        await asyncio.sleep(DB_OPTIMIZE_INTERVAL)
+
+
+async def close_stale_visits_periodically():
+    while True:
+        await asyncio.sleep(VISIT_SESSION_INTERVAL)
+        try:
+            await run_in_threadpool(run_sessionization)
+        except Exception:
+            logger.exception("Closing stale visits failed")
+
+
+async def run_camera_ingest():
+    # Frames are matched against the gallery, which the warm-up loads
+    await app.state.warmup_task
+    if not startup_warmup.done:
+        logger.error("Camera ingest not started: the warm-up failed")
+        return
+    loop = asyncio.get_running_loop()
+    # One process runs the cameras; the others take over if it exits
+    while not await run_in_threadpool(camera_ingest.start, loop):
+        await asyncio.sleep(CAMERA_LOCK_RETRY_SECONDS)
+
+
+# Warm-up steps, run in order after startup; /ready is 503 until they finish,
+# and for good if a required one fails
+if SERVES_RECOGNITION:
+    # Maps the on-disk snapshot; a no-op when gunicorn preloaded it before fork
+    startup_warmup.add_step("gallery", face_gallery.load, required=True)
+    # A recognition worker that cannot run the models must not take traffic
+    startup_warmup.add_step("ml_libraries", load_ml_libraries, required=True)
+    startup_warmup.add_step("inference", functools.partial(face_service.warm_up, WARMUP_IMAGE), required=True)
+startup_warmup.add_step("car_catalog", cars.prime_catalog)
+
+
+@app.on_event("startup")
+async def start_warmup():
+    # In the background, so /ready can report progress meanwhile
+    app.state.warmup_task = asyncio.create_task(startup_warmup.run())
+
+
+@app.on_event("startup")
+async def start_change_feed():
+    # Table versions (ETags) come from the change log; take them before serving
+    await run_in_threadpool(change_feed.prime)
+    # Applies other workers' writes to this worker's caches
+    if CHANGE_FEED_POLL_INTERVAL > 0:
+        app.state.change_feed_task = asyncio.create_task(change_feed.run())
+
+
+@app.on_event("startup")
+async def start_database_maintenance():
+    if DB_OPTIMIZE_INTERVAL > 0:
+        app.state.db_maintenance_task = asyncio.create_task(optimize_database_periodically())
+
+
+@app.on_event("startup")
+async def start_visit_sessions():
+    # Flushes last-seen times and (in one worker) closes visits the exit camera missed
+    if VISIT_SESSION_INTERVAL > 0:
+        app.state.visit_sessions_task = asyncio.create_task(close_stale_visits_periodically())
+
+
+@app.on_event("startup")
+async def start_camera_ingest():
+    # RTSP/device/file sources from CAMERA_SOURCES, read without the browser
+    if SERVES_RECOGNITION and camera_ingest.configured:
+        app.state.camera_ingest_task = asyncio.create_task(run_camera_ingest())
+
+
+@app.on_event("shutdown")
+async def stop_camera_ingest():
+    # Before the last-seen flush, so the cameras' last sightings are written
+    await run_in_threadpool(camera_ingest.stop)
+
+
+@app.on_event("shutdown")
+async def flush_last_seen():
+    await run_in_threadpool(last_seen.flush)
+
+
+@app.on_event("shutdown")
+async def close_database_connections():
+    # aiosqlite connections run in their own threads; close them cleanly
+    await async_engine.dispose()
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to AutoClientAI API. Visit /docs for documentation."}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Several workers share one memory-mapped face gallery; reload only works with one.
+    # For copy-on-write sharing of the preloaded app use gunicorn (see gunicorn.conf.py)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=workers == 1, workers=workers)